@@ -2,3 +2,12 @@ import mimic3benchmark.mimic3csv
 import mimic3benchmark.subject
 import mimic3benchmark.preprocessing
 import mimic3benchmark.util
+import mimic3benchmark.episode_catalog
+import mimic3benchmark.hcup_ccs
+import mimic3benchmark.partitions
+import mimic3benchmark.instrumentation
+import mimic3benchmark.pipeline
+import mimic3benchmark.in_memory
+import mimic3benchmark.event_store
+import mimic3benchmark.readers
+import mimic3benchmark.item_profile
@@ -0,0 +1,152 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+import os
+import pandas as pd
+import re
+from tqdm import tqdm
+
+from mimic3benchmark.subject import read_stays
+
+catalog_columns = ['SUBJECT_ID', 'EPISODE', 'ICUSTAY_ID', 'HADM_ID', 'LOS', 'MORTALITY', 'N_ROWS',
+                   'MIN_HOURS', 'MAX_HOURS', 'FIRST_ICU_HOURS']
+
+episode_timeseries_re = re.compile(r'^episode(\d+)_timeseries\.csv$')
+
+
+def summarize_episode(subject_id, episode, icustay_id, hadm_id, los, mortality, hours, eps=1e-6):
+    """
+    One catalog row for an episode. LOS and MORTALITY are NaN when the episode label file is empty.
+    FIRST_ICU_HOURS is the first event time after ICU admission, which is enough to tell whether
+    any window starting at the admission contains an event.
+    """
+    hours = np.asarray(hours, dtype=float)
+    in_icu = hours[hours > -eps]
+    return {'SUBJECT_ID': subject_id, 'EPISODE': episode, 'ICUSTAY_ID': icustay_id, 'HADM_ID': hadm_id,
+            'LOS': los, 'MORTALITY': mortality, 'N_ROWS': hours.shape[0],
+            'MIN_HOURS': hours.min() if hours.shape[0] > 0 else np.nan,
+            'MAX_HOURS': hours.max() if hours.shape[0] > 0 else np.nan,
+            'FIRST_ICU_HOURS': in_icu.min() if in_icu.shape[0] > 0 else np.nan}
+
+
+def list_subject_dirs(subjects_root_path):
+    subject_dirs = []
+    for parent in [subjects_root_path, os.path.join(subjects_root_path, 'train'),
+                   os.path.join(subjects_root_path, 'test')]:
+        if not os.path.isdir(parent):
+            continue
+        subject_dirs += [os.path.join(parent, x) for x in os.listdir(parent) if str.isdigit(x)]
+    return subject_dirs
+
+
+def list_episode_timeseries_files(subject_dir):
+    """ Names of the episode time series files of a subject directory, in episode order. """
+    matches = [episode_timeseries_re.match(fn) for fn in os.listdir(subject_dir)]
+    return [match.group(0) for match in sorted((m for m in matches if m is not None), key=lambda m: int(m.group(1)))]
+
+
+def build_episode_catalog(subjects_root_path, eps=1e-6):
+    """
+    Builds the catalog by reading every episode of every subject. This is as slow as a pass of the
+    create stages and is only meant for roots extracted before the catalog existed.
+    """
+    rows = []
+    for subject_dir in tqdm(list_subject_dirs(subjects_root_path), desc='Building episode catalog'):
+        subject_id = int(os.path.basename(subject_dir))
+        stays = read_stays(subject_dir)
+        for fn in os.listdir(subject_dir):
+            match = episode_timeseries_re.match(fn)
+            if match is None:
+                continue
+            episode = int(match.group(1))
+            label_df = pd.read_csv(os.path.join(subject_dir, 'episode{}.csv'.format(episode)))
+            if label_df.shape[0] > 0:
+                icustay_id = label_df['Icustay'].iloc[0]
+                los, mortality = label_df['Length of Stay'].iloc[0], label_df['Mortality'].iloc[0]
+            else:
+                icustay_id = stays.ICUSTAY_ID.iloc[episode - 1]
+                los, mortality = np.nan, np.nan
+            hadm_id = stays.HADM_ID[stays.ICUSTAY_ID == icustay_id].iloc[0]
+            hours = pd.read_csv(os.path.join(subject_dir, fn), usecols=['Hours'])['Hours'].values
+            rows.append(summarize_episode(subject_id, episode, icustay_id, hadm_id, los, mortality, hours, eps=eps))
+    return pd.DataFrame(rows, columns=catalog_columns)
+
+
+def write_episode_catalog(catalog, fn):
+    catalog.sort_values(by=['SUBJECT_ID', 'EPISODE'])[catalog_columns].to_csv(fn, index=False)
+
+
+def read_episode_catalog(fn):
+    # the lengths of stay become the period lengths of the listfiles, read them back to the same floats
+    return pd.read_csv(fn, float_precision='round_trip')
+
+
+def is_current_episode_catalog(catalog, fn, subjects_root_path):
+    """
+    Whether the catalog read from fn still describes the episodes under subjects_root_path: every episode it
+    lists exists and was not written after fn, and every subject directory with episodes is in it. The episode
+    files are only looked up, not read.
+    """
+    catalog_mtime = os.stat(fn).st_mtime_ns
+    subject_dirs = dict((int(os.path.basename(d)), d) for d in list_subject_dirs(subjects_root_path))
+    for subject_id, episode in zip(catalog.SUBJECT_ID, catalog.EPISODE):
+        if subject_id not in subject_dirs:
+            return False
+        try:
+            if os.stat(os.path.join(subject_dirs[subject_id],
+                                    'episode{}_timeseries.csv'.format(episode))).st_mtime_ns > catalog_mtime:
+                return False
+        except OSError:
+            return False
+    catalog_subjects = set(catalog.SUBJECT_ID)
+    return not any(list_episode_timeseries_files(subject_dir)
+                   for (subject_id, subject_dir) in subject_dirs.items() if subject_id not in catalog_subjects)
+
+
+def load_episode_catalog(subjects_root_path, fn=None):
+    """
+    The catalog in fn, or if fn is None, {subjects_root_path}/episode_catalog.csv when it exists and is still
+    current (see is_current_episode_catalog). None when there is no usable catalog.
+    """
+    if fn is not None:
+        return read_episode_catalog(fn)
+    fn = os.path.join(subjects_root_path, 'episode_catalog.csv')
+    if not os.path.exists(fn):
+        return None
+    catalog = read_episode_catalog(fn)
+    if not is_current_episode_catalog(catalog, fn, subjects_root_path):
+        print('Episode catalog does not match the episode files, ignoring it:', fn)
+        return None
+    return catalog
+
+
+def merge_episode_catalogs(fns):
+    """ Catalog of all subjects from the catalogs that extract_episodes_from_subjects wrote per shard. """
+    return pd.concat([read_episode_catalog(fn) for fn in fns], ignore_index=True)
+
+
+def episode_order(catalog):
+    """ HADM_ID -> (SUBJECT_ID, EPISODE), the order in which the create stages visit the episodes. """
+    return dict(zip(catalog.HADM_ID, zip(catalog.SUBJECT_ID, catalog.EPISODE)))
+
+
+def episode_timeseries_files(episodes):
+    """
+    SUBJECT_ID -> names of the timeseries files of the given catalog rows, in episode order.
+    """
+    files = {}
+    for subject_id, episode in sorted(zip(episodes.SUBJECT_ID, episodes.EPISODE)):
+        files.setdefault(subject_id, []).append('episode{}_timeseries.csv'.format(episode))
+    return files
+
+
+def select_episodes(catalog, min_los_hours=48, window_hours=None, eps=1e-6):
+    """
+    Episodes that the create stages keep: a known length of stay of at least min_los_hours and at least
+    one event inside the window [0, window_hours], or [0, length of stay] if window_hours is None.
+    """
+    los = 24.0 * catalog.LOS
+    window = los if window_hours is None else window_hours
+    keep = los.notnull() & ~(los < min_los_hours - eps) & (catalog.FIRST_ICU_HOURS < window + eps)
+    return catalog[keep]
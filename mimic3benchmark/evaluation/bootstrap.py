@@ -0,0 +1,67 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import multiprocessing
+import numpy as np
+
+from mimic3benchmark.evaluation.metrics import binary_curve_metrics, binary_metric_names, sort_by_score
+
+
+def _bootstrap_block(task):
+    models, n_resamples, seed_sequence = task
+    n = models[0][0].shape[0]
+    rng = np.random.default_rng(seed_sequence)
+    # resample counts of every sample, one row per resample
+    indices = rng.integers(0, n, size=(n_resamples, n)) + n * np.arange(n_resamples)[:, None]
+    counts = np.bincount(indices.ravel(), minlength=n_resamples * n).reshape(n_resamples, n)
+    return [binary_curve_metrics(y_sorted, group_ends, counts[:, order])
+            for (order, y_sorted, group_ends) in models]
+
+
+def bootstrap_binary_metrics_batch(y_true, y_scores, n_iters=10000, seed=0, block_size=256, n_workers=1):
+    """
+    AUROC, AUPRC and min(+P, Se) of n_iters bootstrap resamples for each of several score vectors of the same
+    samples. All models are evaluated on the same resamples. Resamples are drawn and evaluated in blocks of
+    block_size, each block with its own generator spawned from seed, so the runs only depend on seed and
+    block_size and not on n_workers.
+    """
+    models = [sort_by_score(y_true, y_score) for y_score in y_scores]
+    sizes = [block_size] * (n_iters // block_size)
+    if n_iters % block_size > 0:
+        sizes.append(n_iters % block_size)
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(models, size, seed_sequence) for (size, seed_sequence) in zip(sizes, seed_sequences)]
+
+    if n_workers > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(n_workers) as pool:
+            results = pool.map(_bootstrap_block, tasks)
+    else:
+        results = [_bootstrap_block(task) for task in tasks]
+    return [{k: np.concatenate([result[i][k] for result in results] + [np.zeros(0)]) for k in binary_metric_names}
+            for i in range(len(models))]
+
+
+def bootstrap_binary_metrics(y_true, y_score, n_iters=10000, seed=0, block_size=256, n_workers=1):
+    """
+    AUROC, AUPRC and min(+P, Se) of n_iters bootstrap resamples, see bootstrap_binary_metrics_batch.
+    """
+    return bootstrap_binary_metrics_batch(y_true, [y_score], n_iters=n_iters, seed=seed, block_size=block_size,
+                                          n_workers=n_workers)[0]
+
+
+def summarize_runs(runs):
+    """
+    Mean, median, std and 95% interval of the metric over the resamples. Resamples where the metric is NaN (the
+    AUROC of resamples with only one class) are left out and counted in 'n_dropped'.
+    """
+    runs = np.asarray(runs, dtype=float)
+    valid = runs[~np.isnan(runs)]
+    if valid.shape[0] == 0:
+        return {'mean': np.nan, 'median': np.nan, 'std': np.nan, '2.5% percentile': np.nan,
+                '97.5% percentile': np.nan, 'n_dropped': int(runs.shape[0])}
+    return {'mean': np.mean(valid),
+            'median': np.median(valid),
+            'std': np.std(valid),
+            '2.5% percentile': np.percentile(valid, 2.5),
+            '97.5% percentile': np.percentile(valid, 97.5),
+            'n_dropped': int(runs.shape[0] - valid.shape[0])}
@@ -0,0 +1,106 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+
+binary_metric_names = ['auroc', 'auprc', 'minpse']
+
+
+def sort_by_score(y_true, y_score):
+    """
+    Order of the samples by decreasing score, their labels in that order and the last position of every group of
+    tied scores, i.e. the positions at which the ROC and PR curves have a point. O(n log n).
+    """
+    y_score = np.asarray(y_score, dtype=float)
+    order = np.argsort(y_score, kind='mergesort')[::-1]
+    y_sorted = np.asarray(y_true, dtype=float)[order]
+    group_ends = np.r_[np.flatnonzero(np.diff(y_score[order])), y_score.shape[0] - 1]
+    return order, y_sorted, group_ends
+
+
+def binary_curve_metrics(y_sorted, group_ends, weights):
+    """
+    AUROC, AUPRC and min(+P, Se) for every row of weights, which holds how often each sample (in the order of
+    sort_by_score) is in the resample. The curves are the ones of sklearn's roc_curve and precision_recall_curve
+    on the resampled data, AUPRC is the trapezoidal area under the PR curve like metrics.auc(recall, precision).
+    Resamples with only one class get NaN. O(n) per row.
+    """
+    weights = np.atleast_2d(weights)
+    positive = np.asarray(y_sorted) > 0
+    n_rows, n = weights.shape
+    # true and false positives at every threshold, from one cumulative sum over all samples and one over
+    # the positives, in integers as long as the weights are counts
+    total = np.cumsum(weights, axis=1)
+    tps = np.zeros((n_rows, np.count_nonzero(positive) + 1), dtype=total.dtype)
+    np.cumsum(weights[:, positive], axis=1, out=tps[:, 1:])
+    tps = tps[:, np.cumsum(positive)[group_ends]].astype(float)
+    total = (total if len(group_ends) == n else total[:, group_ends]).astype(float)
+    fps = total - tps
+    n_pos, n_neg = tps[:, -1], fps[:, -1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # ROC curve starts at (0, 0), its trapezoids are summed before dividing by the number of
+        # positives and negatives
+        auroc = (np.einsum('ij,ij->i', fps[:, 1:] - fps[:, :-1], tps[:, 1:] + tps[:, :-1])
+                 + fps[:, 0] * tps[:, 0]) / (2 * n_pos * n_neg)
+        # PR curve ends at (recall 0, precision 1); thresholds that no resampled sample reaches get
+        # the same point as the previous threshold, which adds no area
+        precision = tps / total
+        precision[total == 0] = 1.0
+        recall = tps / n_pos[:, None]
+    auprc = (np.einsum('ij,ij->i', recall[:, 1:] - recall[:, :-1], precision[:, 1:] + precision[:, :-1])
+             + recall[:, 0] * (precision[:, 0] + 1)) / 2
+    minpse = np.max(np.minimum(precision, recall), axis=1)
+    auroc[(n_pos == 0) | (n_neg == 0)] = np.nan
+    return {'auroc': auroc, 'auprc': auprc, 'minpse': minpse}
+
+
+def binary_metrics(y_true, y_score):
+    """ AUROC, AUPRC and min(+P, Se) of one set of predictions. """
+    _, y_sorted, group_ends = sort_by_score(y_true, y_score)
+    ret = binary_curve_metrics(y_sorted, group_ends, np.ones(y_sorted.shape[0]))
+    return {k: ret[k][0] for k in binary_metric_names}
+
+
+def print_metrics_binary(y_true, predictions, verbose=1):
+    """
+    Confusion-matrix metrics at the 0.5 threshold and the binary curve metrics. predictions is either the
+    probability of class 1 or a (n, 2) array of class probabilities.
+    """
+    y_true = np.asarray(y_true).astype(int)
+    predictions = np.array(predictions)
+    if len(predictions.shape) == 1:
+        predictions = np.stack([1 - predictions, predictions]).transpose((1, 0))
+
+    cf = np.zeros((2, 2), dtype=int)
+    np.add.at(cf, (y_true, predictions.argmax(axis=1)), 1)
+    if verbose:
+        print("confusion matrix:")
+        print(cf)
+    cf = cf.astype(np.float32)
+
+    acc = (cf[0][0] + cf[1][1]) / np.sum(cf)
+    prec0 = cf[0][0] / (cf[0][0] + cf[1][0])
+    prec1 = cf[1][1] / (cf[1][1] + cf[0][1])
+    rec0 = cf[0][0] / (cf[0][0] + cf[0][1])
+    rec1 = cf[1][1] / (cf[1][1] + cf[1][0])
+    ret = binary_metrics(y_true, predictions[:, 1])
+
+    if verbose:
+        print("accuracy = {}".format(acc))
+        print("precision class 0 = {}".format(prec0))
+        print("precision class 1 = {}".format(prec1))
+        print("recall class 0 = {}".format(rec0))
+        print("recall class 1 = {}".format(rec1))
+        print("AUC of ROC = {}".format(ret['auroc']))
+        print("AUC of PRC = {}".format(ret['auprc']))
+        print("min(+P, Se) = {}".format(ret['minpse']))
+
+    return {"acc": acc,
+            "prec0": prec0,
+            "prec1": prec1,
+            "rec0": rec0,
+            "rec1": rec1,
+            "auroc": ret['auroc'],
+            "auprc": ret['auprc'],
+            "minpse": ret['minpse']}
@@ -0,0 +1,201 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sqlite3
+
+import pandas as pd
+from tqdm import tqdm
+
+from mimic3benchmark.episode_catalog import list_subject_dirs
+from mimic3benchmark.instrumentation import RunReport
+from mimic3benchmark.preprocessing import clean_events
+from mimic3benchmark.subject import read_stays
+from mimic3benchmark.util import parse_times
+
+event_store_columns = ['SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'CHARTTIME', 'HOURS', 'ITEMID', 'VARIABLE', 'VALUE',
+                       'VALUEUOM']
+stay_store_columns = ['SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'INTIME', 'OUTTIME', 'LOS', 'AGE', 'GENDER',
+                      'MORTALITY']
+
+# SQLite builds before 3.32 allow at most 999 parameters per statement
+max_ids_per_query = 500
+
+schema = """
+CREATE TABLE stays (SUBJECT_ID INTEGER, HADM_ID INTEGER, ICUSTAY_ID INTEGER PRIMARY KEY, INTIME TEXT, OUTTIME TEXT,
+                    LOS REAL, AGE REAL, GENDER TEXT, MORTALITY INTEGER);
+CREATE TABLE items (ITEMID INTEGER PRIMARY KEY, VARIABLE TEXT, MIMIC_LABEL TEXT);
+CREATE TABLE events (SUBJECT_ID INTEGER, HADM_ID INTEGER, ICUSTAY_ID INTEGER, CHARTTIME TEXT, HOURS REAL,
+                     ITEMID INTEGER, VARIABLE TEXT, VALUE TEXT, VALUEUOM TEXT);
+"""
+
+indexes = """
+CREATE INDEX events_subject ON events (SUBJECT_ID, ICUSTAY_ID, VARIABLE, CHARTTIME);
+CREATE INDEX events_stay ON events (ICUSTAY_ID, VARIABLE, HOURS);
+CREATE INDEX stays_subject ON stays (SUBJECT_ID);
+"""
+
+
+def _values(series):
+    """ Python values of a column for sqlite3, None for missing values. """
+    return [None if pd.isnull(v) else v for v in series.tolist()]
+
+
+def _ints(series):
+    return [None if pd.isnull(v) else int(v) for v in series.tolist()]
+
+
+def _times(series):
+    return _values(series.dt.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def read_subject_store_rows(subject_dir, var_map):
+    """
+    Rows of the stays and events tables of one subject directory. HOURS is the time since the admission to the
+    stay of the event, VARIABLE is empty for ITEMIDs that are not in var_map.
+    """
+    stays = read_stays(subject_dir)
+    events = pd.read_csv(os.path.join(subject_dir, 'events.csv'), dtype={'VALUE': str, 'VALUEUOM': str})
+    events = events[events.VALUE.notnull()]
+    charttime = parse_times(events.CHARTTIME)
+    intime = pd.Series(stays.INTIME.values, index=stays.ICUSTAY_ID.values)
+    hours = (charttime - events.ICUSTAY_ID.map(intime)) / pd.Timedelta(hours=1)
+    stay_rows = list(zip(_ints(stays.SUBJECT_ID), _ints(stays.HADM_ID), _ints(stays.ICUSTAY_ID), _times(stays.INTIME),
+                         _times(stays.OUTTIME), _values(stays.LOS), _values(stays.AGE), _values(stays.GENDER),
+                         _ints(stays.MORTALITY)))
+    event_rows = list(zip(_ints(events.SUBJECT_ID), _ints(events.HADM_ID), _ints(events.ICUSTAY_ID),
+                          _times(charttime), _values(hours), _ints(events.ITEMID),
+                          _values(events.ITEMID.map(var_map.VARIABLE)), _values(events.VALUE),
+                          _values(events.VALUEUOM)))
+    return stay_rows, event_rows
+
+
+def build_event_store(subjects_root_path, store_path, var_map, report=None):
+    """
+    Loads the stays and the (validated) events of every subject directory of subjects_root_path, including
+    the train and test sub-directories, into an SQLite file at store_path, indexed for lookups by subject or
+    stay, variable and time. An existing store is replaced once the new one is complete.
+    """
+    report = report if report is not None else RunReport('build_event_store')
+    tmp_path = store_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.executescript('PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;' + schema)
+        connection.executemany('INSERT INTO items VALUES (?, ?, ?)',
+                               zip(var_map.index.tolist(), var_map.VARIABLE.tolist(), var_map.MIMIC_LABEL.tolist()))
+        n_events = 0
+        with report.phase('load_subjects'):
+            for subject_dir in report.timed(tqdm(list_subject_dirs(subjects_root_path), desc='Loading subjects'),
+                                            key=os.path.basename):
+                if not os.path.exists(os.path.join(subject_dir, 'events.csv')):
+                    report.count('subjects_without_events')
+                    continue
+                stay_rows, event_rows = read_subject_store_rows(subject_dir, var_map)
+                connection.executemany('INSERT INTO stays VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', stay_rows)
+                connection.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', event_rows)
+                n_events += len(event_rows)
+        with report.phase('create_indexes'):
+            connection.executescript(indexes + 'ANALYZE;')
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, store_path)
+    report.count('events', n_events)
+    print('Event store with {} events written to {}'.format(n_events, store_path))
+
+
+def open_event_store(store_path):
+    """ Read-only connection to a store written by build_event_store. """
+    if not os.path.exists(store_path):
+        raise IOError('event store not found: {}'.format(store_path))
+    return sqlite3.connect('file:{}?mode=ro'.format(os.path.abspath(store_path)), uri=True)
+
+
+def _in_clause(column, values):
+    return '{} IN ({})'.format(column, ', '.join('?' * len(values))), list(values)
+
+
+def _query(store, select, conditions, id_column, ids, order_by):
+    """ Runs select with the conditions and id_column IN ids, in chunks of max_ids_per_query ids. """
+    connection = open_event_store(store) if isinstance(store, str) else store
+    try:
+        parts = []
+        ids = None if ids is None else sorted(set(ids))
+        id_chunks = [None] if ids is None else [ids[i:i + max_ids_per_query]
+                                                for i in range(0, max(len(ids), 1), max_ids_per_query)]
+        for chunk in id_chunks:
+            chunk_conditions = list(conditions)
+            if chunk is not None:
+                chunk_conditions.append(_in_clause(id_column, chunk))
+            where = ' AND '.join(clause for (clause, _) in chunk_conditions)
+            sql = select + (' WHERE ' + where if where else '') + ' ORDER BY ' + ', '.join(order_by)
+            parts.append(pd.read_sql_query(sql, connection,
+                                           params=[p for (_, params) in chunk_conditions for p in params]))
+        if len(parts) == 1:
+            return parts[0]
+        return pd.concat(parts, ignore_index=True).sort_values(by=[c.split('.')[-1] for c in order_by],
+                                                               kind='mergesort').reset_index(drop=True)
+    finally:
+        if connection is not store:
+            connection.close()
+
+
+def query_events(store, icustay_ids=None, subject_ids=None, variables=None, itemids=None, start_hours=None,
+                 end_hours=None, clean=False):
+    """
+    Events of the store (a path or an open connection) as a DataFrame ordered by stay and time, optionally
+    restricted to stays, subjects, variables, ITEMIDs and the window [start_hours, end_hours] since the
+    admission to the stay. With clean=True the values are cleaned like extract_episodes_from_subjects does
+    and events without a valid value are dropped, e.g. the Heart Rate of some stays in their first 24 hours:
+
+        query_events('data/root/events.sqlite', icustay_ids=ids, variables=['Heart Rate'], end_hours=24)
+    """
+    conditions = []
+    if subject_ids is not None and icustay_ids is not None:
+        conditions.append(_in_clause('e.SUBJECT_ID', [int(x) for x in subject_ids]))
+    if variables is not None:
+        conditions.append(_in_clause('e.VARIABLE', list(variables)))
+    if itemids is not None:
+        conditions.append(_in_clause('e.ITEMID', [int(x) for x in itemids]))
+    if start_hours is not None:
+        conditions.append(('e.HOURS >= ?', [float(start_hours)]))
+    if end_hours is not None:
+        conditions.append(('e.HOURS <= ?', [float(end_hours)]))
+    if icustay_ids is not None:
+        id_column, ids = 'e.ICUSTAY_ID', [int(x) for x in icustay_ids]
+    elif subject_ids is not None:
+        id_column, ids = 'e.SUBJECT_ID', [int(x) for x in subject_ids]
+    else:
+        id_column, ids = None, None
+
+    columns = ', '.join('e.' + c for c in event_store_columns)
+    if clean:
+        select = 'SELECT {}, i.MIMIC_LABEL FROM events e LEFT JOIN items i ON e.ITEMID = i.ITEMID'.format(columns)
+    else:
+        select = 'SELECT {} FROM events e'.format(columns)
+    events = _query(store, select, conditions, id_column, ids, ['e.ICUSTAY_ID', 'e.CHARTTIME'])
+    events.CHARTTIME = parse_times(events.CHARTTIME)
+    if clean:
+        events.MIMIC_LABEL = events.MIMIC_LABEL.fillna('')
+        events = clean_events(events).drop(['MIMIC_LABEL', 'VALUE_NUM', 'VALUE_TEXT'], axis=1)
+    return events
+
+
+def query_stays(store, icustay_ids=None, subject_ids=None):
+    """ Stays of the store (a path or an open connection) as a DataFrame, optionally restricted to stays or subjects. """
+    conditions = []
+    if subject_ids is not None and icustay_ids is not None:
+        conditions.append(_in_clause('SUBJECT_ID', [int(x) for x in subject_ids]))
+    if icustay_ids is not None:
+        id_column, ids = 'ICUSTAY_ID', [int(x) for x in icustay_ids]
+    elif subject_ids is not None:
+        id_column, ids = 'SUBJECT_ID', [int(x) for x in subject_ids]
+    else:
+        id_column, ids = None, None
+    stays = _query(store, 'SELECT {} FROM stays'.format(', '.join(stay_store_columns)), conditions, id_column, ids,
+                   ['SUBJECT_ID', 'INTIME'])
+    stays.INTIME = parse_times(stays.INTIME)
+    stays.OUTTIME = parse_times(stays.OUTTIME)
+    return stays
@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import hashlib
+import numpy as np
+import os
+import pandas as pd
+import yaml
+
+
+# like the clinical notes cache, relative to the directory the scripts run in (run_pipeline runs them in data_dir)
+default_cache_dir = os.path.join('data', 'cache', 'hcup_ccs')
+
+
+class HcupCcsMapping(object):
+    """
+    ICD9 code -> HCUP CCS group lookup compiled from the phenotype definitions YAML.
+    Groups are numbered by their position in sorted order, codes are sorted and carry the id of their group.
+    """
+    def __init__(self, codes, code_groups, groups, use_in_benchmark, digest=''):
+        self.codes = pd.Index(np.asarray(codes, dtype=object))
+        self.code_groups = np.asarray(code_groups, dtype=np.int32)
+        self.groups = np.asarray(groups, dtype=object)
+        self.use_in_benchmark = np.asarray(use_in_benchmark, dtype=bool)
+        self.digest = digest
+
+    def lookup(self, icd9_codes):
+        """ Group id of every code, -1 for codes that are not in any group. """
+        positions = pd.Categorical(icd9_codes, categories=self.codes).codes
+        return np.where(positions >= 0, self.code_groups[positions], -1)
+
+    def groups_in_benchmark(self):
+        return list(self.groups[self.use_in_benchmark])
+
+
+def compile_hcup_ccs_mapping(definitions, digest=''):
+    groups = sorted(definitions.keys())
+    code_to_group = {}
+    for group_id, group in enumerate(groups):
+        for code in definitions[group]['codes']:
+            assert code_to_group.get(code, group_id) == group_id, 'ICD9 code {} is in several groups'.format(code)
+            code_to_group[code] = group_id
+    codes = sorted(code_to_group.keys())
+    return HcupCcsMapping(codes, [code_to_group[code] for code in codes], groups,
+                          [bool(definitions[group]['use_in_benchmark']) for group in groups], digest=digest)
+
+
+def load_hcup_ccs_mapping(definitions_path, cache_dir=None):
+    """
+    Compiled mapping for a definitions file. With a cache_dir (the scripts use default_cache_dir) the compiled
+    arrays are cached there in a file named after the SHA-1 of the YAML, so every version of the definitions
+    has its own entry; by default nothing is cached.
+    """
+    with open(definitions_path, 'rb') as definitions_file:
+        content = definitions_file.read()
+    digest = hashlib.sha1(content).hexdigest()
+
+    cache_fn = None
+    if cache_dir is not None:
+        cache_fn = os.path.join(cache_dir, 'hcup_ccs-{}.npz'.format(digest))
+        if os.path.exists(cache_fn):
+            with np.load(cache_fn, allow_pickle=False) as f:
+                if str(f['digest']) == digest:
+                    return HcupCcsMapping(f['codes'], f['code_groups'], f['groups'], f['use_in_benchmark'],
+                                          digest=digest)
+
+    mapping = compile_hcup_ccs_mapping(yaml.safe_load(content), digest=digest)
+    if cache_fn is not None:
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_fn = '{}.{}.tmp'.format(cache_fn, os.getpid())
+            with open(tmp_fn, 'wb') as f:
+                np.savez(f, codes=np.array(mapping.codes, dtype=str), code_groups=mapping.code_groups,
+                         groups=mapping.groups.astype(str), use_in_benchmark=mapping.use_in_benchmark,
+                         digest=np.array(digest))
+            os.replace(tmp_fn, cache_fn)
+        except OSError as e:
+            print('Could not cache the compiled HCUP CCS mapping:', e)
+    return mapping
@@ -0,0 +1,186 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from mimic3benchmark.episode_catalog import catalog_columns, episode_timeseries_files, select_episodes
+from mimic3benchmark.hcup_ccs import load_hcup_ccs_mapping
+from mimic3benchmark.instrumentation import RunReport
+from mimic3benchmark.partitions import build_partition_manifest
+from mimic3benchmark.preprocessing import read_itemid_to_variable_map
+from mimic3benchmark.scripts.create_demography_diagnosis import make_cohort_table, process_partition_vectorized
+from mimic3benchmark.scripts.create_timeseries import make_timeseries_sample, read_channel_config,\
+    write_timeseries_listfile
+from mimic3benchmark.scripts.extract_episodes_from_subjects import default_variable_map_file, extract_subject_episodes
+from mimic3benchmark.scripts.extract_subjects import build_cohort, build_diagnoses, default_event_tables,\
+    default_phenotype_definitions
+from mimic3benchmark.scripts.split_train_val import split_train_val
+from mimic3benchmark.scripts.validate_events import report_validation_counts, validate_subject_events,\
+    validation_counts
+from mimic3benchmark.sparse_labels import make_phenotype_label_sparse
+from mimic3benchmark.subject import prepare_events, prepare_stays
+from mimic3benchmark.util import dataframe_from_csv
+
+package_path = os.path.dirname(__file__)
+default_test_subjects = os.path.join(package_path, 'mimic_test.csv')
+default_val_subjects = os.path.join(package_path, 'mimic_val.csv')
+
+event_columns = ['SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'CHARTTIME', 'ITEMID', 'VALUE', 'VALUEUOM']
+
+
+def read_events_tables(mimic3_path, tables, subjects, items_to_keep=None, chunksize=1000000, report=None):
+    """
+    Events of the subjects from the event tables, grouped by subject, read as text like validate_events reads
+    the events.csv files of extract_subjects: the tables in the given order, rows in file order.
+    """
+    report = report if report is not None else RunReport('in_memory')
+    subjects = set(str(s) for s in subjects)
+    items_to_keep = set(str(s) for s in items_to_keep) if items_to_keep is not None else None
+    parts = []
+    for table in tables:
+        nb_read, nb_kept = 0, 0
+        reader = pd.read_csv(os.path.join(mimic3_path, table.upper() + '.csv'), dtype=str, chunksize=chunksize)
+        for chunk in tqdm(reader, desc='Reading {} table'.format(table)):
+            nb_read += chunk.shape[0]
+            if 'ICUSTAY_ID' not in chunk.columns:
+                chunk['ICUSTAY_ID'] = np.nan
+            keep = chunk.SUBJECT_ID.isin(subjects)
+            if items_to_keep is not None:
+                keep &= chunk.ITEMID.isin(items_to_keep)
+            chunk = chunk.loc[keep, event_columns]
+            nb_kept += chunk.shape[0]
+            parts.append(chunk)
+        report.rows(table, nb_read, nb_kept)
+    events = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=event_columns)
+    return dict((int(subject_id), subject_events)
+                for (subject_id, subject_events) in events.groupby('SUBJECT_ID', sort=False))
+
+
+def build_subject_episodes(subject_id, stays, diagnoses, events, var_map, variables, totals, report=None):
+    """
+    Validates the events of one subject, read as text by read_events_tables, and builds its episodes.
+    Returns the episodes as (episode number, label table, time series table, catalog row) tuples.
+    """
+    events, counts = validate_subject_events(stays, events)
+    for k in validation_counts:
+        totals[k] += counts[k]
+
+    episodes = extract_subject_episodes(subject_id, prepare_stays(stays.copy()), diagnoses,
+                                        prepare_events(events.reset_index(drop=True)), var_map, variables,
+                                        report=report)
+    return [(number, episodic_data.rename_axis('Icustay').reset_index(), episode.rename_axis('Hours').reset_index(),
+             summary)
+            for (number, episodic_data, episode, summary) in episodes]
+
+
+def create_timeseries_partition(output_path, partition, patients, stays, episodes, catalog, channel_info,
+                                discretizer_config, eps=1e-6, n_hours=48, report=None):
+    """ create_timeseries for one partition from the episodes in memory, {(SUBJECT_ID, number): episode}. """
+    report = report if report is not None else RunReport('in_memory')
+    output_dir = os.path.join(output_path, partition)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    episode_files = episode_timeseries_files(select_episodes(catalog[catalog.SUBJECT_ID.isin(patients)],
+                                                             min_los_hours=n_hours, window_hours=n_hours, eps=eps))
+    xy_pairs = []
+    n_episodes = 0
+    for subject_id in tqdm(patients, desc='Creating timeseries of {}'.format(partition)):
+        patient = str(subject_id)
+        patient_stays_df = stays[stays.SUBJECT_ID == subject_id]
+        for ts_filename in episode_files.get(subject_id, []):
+            n_episodes += 1
+            number = int(ts_filename[len('episode'):-len('_timeseries.csv')])
+            label_df, ts = episodes[(subject_id, number)]
+            sample = make_timeseries_sample(patient, ts_filename, label_df, ts.copy, patient_stays_df,
+                                            channel_info, discretizer_config, eps=eps, n_hours=n_hours)
+            if sample is None:
+                continue
+            ts_df, mortality, _, hadm_id = sample
+            output_ts_filename = patient + "_" + ts_filename
+            ts_df.to_csv(os.path.join(output_dir, output_ts_filename))
+            xy_pairs.append((output_ts_filename, mortality, hadm_id))
+
+    report.rows('timeseries_episodes_{}'.format(partition), n_episodes, len(xy_pairs))
+    write_timeseries_listfile(output_dir, xy_pairs, partition)
+
+
+def run_in_memory(mimic3_path, data_dir, event_tables=default_event_tables,
+                  phenotype_definitions=default_phenotype_definitions, itemids_file=None,
+                  variable_map_file=default_variable_map_file, test_subjects=default_test_subjects,
+                  val_subjects=default_val_subjects, verbose=True, report=None):
+    """
+    Runs extract_subjects, validate_events, extract_episodes_from_subjects, split_train_and_test,
+    create_timeseries, create_demography_diagnosis and split_train_val without writing the per-subject files:
+    the cohort, the events and the episodes are handed from one step to the next in memory and only
+    {data_dir}/timeseries and {data_dir}/demography_diagnosis are written. All events of the cohort are held in
+    memory, so this is meant for subsets of MIMIC-III and synthetic data; the outputs are the same as those of
+    the scripts.
+    """
+    report = report if report is not None else RunReport('in_memory')
+    timeseries_path = os.path.join(data_dir, 'timeseries')
+    demography_path = os.path.join(data_dir, 'demography_diagnosis')
+    for path in [timeseries_path, demography_path]:
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    patients, stays = build_cohort(mimic3_path, verbose=verbose, report=report)
+    with report.phase('diagnoses_and_labels'):
+        _, phenotypes = build_diagnoses(mimic3_path, stays, phenotype_definitions, report=report)
+        phenotype_labels = make_phenotype_label_sparse(phenotypes, stays)
+
+    subjects = sorted(stays.SUBJECT_ID.unique())
+    report.count('subjects', len(subjects))
+    report.count('icustays', stays.shape[0])
+    items_to_keep = set(
+        [int(itemid) for itemid in dataframe_from_csv(itemids_file)['ITEMID'].unique()]) if itemids_file else None
+    with report.phase('read_events'):
+        events = read_events_tables(mimic3_path, event_tables, subjects, items_to_keep=items_to_keep, report=report)
+
+    var_map = read_itemid_to_variable_map(variable_map_file)
+    variables = var_map.VARIABLE.unique()
+    totals = dict((k, 0) for k in validation_counts)
+    episodes = {}
+    catalog = []
+    with report.phase('episodes'):
+        for subject_id in report.timed(tqdm(subjects, desc='Building episodes')):
+            if subject_id not in events:
+                report.count('subjects_without_events')
+                continue
+            subject_stays = stays[stays.SUBJECT_ID == subject_id].sort_values(by='INTIME')
+            subject_diagnoses = phenotypes[phenotypes.SUBJECT_ID == subject_id].sort_values(by=['ICUSTAY_ID',
+                                                                                                 'SEQ_NUM'])
+            for (number, label_df, ts, summary) in build_subject_episodes(subject_id, subject_stays,
+                                                                          subject_diagnoses, events.pop(subject_id),
+                                                                          var_map, variables, totals,
+                                                                          report=report):
+                episodes[(subject_id, number)] = (label_df, ts)
+                catalog.append(summary)
+    report_validation_counts(report, totals)
+    assert(totals['could_not_recover'] == 0)
+    report.count('episodes', len(catalog))
+    catalog = pd.DataFrame(catalog, columns=catalog_columns).sort_values(by=['SUBJECT_ID', 'EPISODE'])\
+        .reset_index(drop=True)
+
+    manifest = build_partition_manifest(subjects, set(pd.read_csv(test_subjects)['SUBJECT_ID'].values),
+                                        set(pd.read_csv(val_subjects)['SUBJECT_ID'].values))
+    partition_subjects = dict((partition, list(manifest.SUBJECT_ID[manifest.PARTITION == partition]))
+                              for partition in ['train', 'test'])
+
+    with report.phase('timeseries'):
+        channel_info, discretizer_config = read_channel_config()
+        for partition in ['test', 'train']:
+            create_timeseries_partition(timeseries_path, partition, partition_subjects[partition], stays, episodes,
+                                        catalog, channel_info, discretizer_config, report=report)
+        split_train_val(timeseries_path, set(manifest.SUBJECT_ID[manifest.SPLIT == 'val'].values), report=report)
+
+    with report.phase('demography_diagnosis'):
+        codes_in_benchmark = load_hcup_ccs_mapping(phenotype_definitions).groups_in_benchmark()
+        cohort = make_cohort_table(stays, phenotype_labels, codes_in_benchmark)
+        for partition in ['test', 'train']:
+            process_partition_vectorized(data_dir, demography_path, codes_in_benchmark, cohort, catalog, partition,
+                                         manifest=manifest, report=report)
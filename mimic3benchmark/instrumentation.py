@@ -0,0 +1,287 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import atexit
+import collections
+import contextlib
+import cProfile
+import io
+import json
+import os
+import platform
+import pstats
+import sys
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# upper edges of the per-item latency histogram, in seconds
+latency_bin_edges = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0,
+                     float('inf')]
+
+
+def peak_rss_mb():
+    """ Peak resident set size of this process so far in MiB, None where the resource module is missing. """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+def summarize_latencies(keys, seconds, slowest=10):
+    """ Count, total, quantiles, histogram and the slowest items of a list of per-item timings. """
+    seconds = np.asarray(seconds, dtype=float)
+    if seconds.shape[0] == 0:
+        return {'count': 0}
+    counts = np.bincount(np.searchsorted(latency_bin_edges, seconds), minlength=len(latency_bin_edges))
+    order = np.argsort(seconds, kind='mergesort')[::-1][:slowest]
+    return {'count': int(seconds.shape[0]),
+            'total_seconds': float(seconds.sum()),
+            'mean_seconds': float(seconds.mean()),
+            'quantiles_seconds': {q: float(v) for (q, v) in
+                                  zip(['p50', 'p90', 'p99', 'max'], np.percentile(seconds, [50, 90, 99, 100]))},
+            'histogram': [{'le': edge if edge < float('inf') else 'inf', 'count': int(count)}
+                          for (edge, count) in zip(latency_bin_edges, counts)],
+            'slowest': [{'key': keys[i], 'seconds': float(seconds[i])} for i in order]}
+
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler that records the Python stack of the main thread every interval seconds of CPU time
+    (SIGPROF). Only available on Unix.
+    """
+    def __init__(self, interval=0.005):
+        import signal
+        self.signal = signal
+        self.interval = interval
+        self.stacks = collections.Counter()
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{}:{}:{}'.format(code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.signal.signal(self.signal.SIGPROF, self._sample)
+        self.signal.setitimer(self.signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        self.signal.setitimer(self.signal.ITIMER_PROF, 0, 0)
+        self.signal.signal(self.signal.SIGPROF, self.signal.SIG_DFL)
+
+    def dump(self, fn):
+        """ Writes the stacks in the collapsed format read by flamegraph.pl and speedscope. """
+        with open(fn, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+    def summary(self, top=25):
+        self_samples, total_samples = collections.Counter(), collections.Counter()
+        for stack, count in self.stacks.items():
+            functions = stack.split(';')
+            self_samples[functions[-1]] += count
+            for function in set(functions):
+                total_samples[function] += count
+        return {'interval_seconds': self.interval,
+                'samples': sum(self.stacks.values()),
+                'top_self': [{'function': f, 'samples': n} for (f, n) in self_samples.most_common(top)],
+                'top_total': [{'function': f, 'samples': n} for (f, n) in total_samples.most_common(top)]}
+
+
+class CProfileProfiler(object):
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def dump(self, fn):
+        self.profile.dump_stats(fn)
+
+    def summary(self, top=25):
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(top)
+        return {'top_cumulative': stream.getvalue().splitlines()}
+
+
+class RunReport(object):
+    """
+    Measurements of one script run: wall and CPU time and peak RSS per phase, rows in and out of filter steps,
+    counters and per-item (usually per-subject) processing times. Written as JSON to path when the run ends;
+    with path=None nothing is written and the measurements only cost a few clock reads.
+    """
+    def __init__(self, script, path=None, args=None, slowest=10, profiler=None):
+        self.script = script
+        self.path = path
+        self.args = vars(args) if args is not None else {}
+        self.slowest = slowest
+        self.profiler = profiler
+        self.phases = []
+        self.row_flow = []
+        self.counters = collections.OrderedDict()
+        self.item_times = collections.OrderedDict()
+        self.start_time = time.time()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.closed = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield self
+        finally:
+            self.phases.append({'name': name,
+                                'wall_seconds': time.perf_counter() - wall,
+                                'cpu_seconds': time.process_time() - cpu,
+                                'peak_rss_mb': peak_rss_mb()})
+
+    def rows(self, step, rows_in, rows_out):
+        """ Records how many rows a filter step received and kept. """
+        self.row_flow.append({'step': step, 'rows_in': int(rows_in), 'rows_out': int(rows_out),
+                              'rows_dropped': int(rows_in) - int(rows_out)})
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def timed(self, items, name='subjects', key=str):
+        """
+        Yields the items and records the time until the next one is requested, i.e. the time the loop body
+        spent on every item, under key(item).
+        """
+        keys, seconds = self.item_times.setdefault(name, ([], []))
+        for item in items:
+            start = time.perf_counter()
+            yield item
+            keys.append(key(item))
+            seconds.append(time.perf_counter() - start)
+
+    def to_dict(self, status='completed'):
+        report = collections.OrderedDict()
+        report['script'] = self.script
+        report['status'] = status
+        report['started'] = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.start_time))
+        report['args'] = self.args
+        report['host'] = {'python': platform.python_version(), 'platform': platform.platform(),
+                          'cpus': os.cpu_count()}
+        report['wall_seconds'] = time.perf_counter() - self.start_wall
+        report['cpu_seconds'] = time.process_time() - self.start_cpu
+        report['peak_rss_mb'] = peak_rss_mb()
+        report['phases'] = self.phases
+        report['row_flow'] = self.row_flow
+        report['counters'] = self.counters
+        report['items'] = collections.OrderedDict(
+            (name, summarize_latencies(keys, seconds, self.slowest))
+            for (name, (keys, seconds)) in self.item_times.items())
+        return report
+
+    def close(self, status='completed'):
+        """ Stops the profiler and writes the report and the profile. Only the first call has an effect. """
+        if self.closed:
+            return
+        self.closed = True
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.path is None:
+            return
+        report = self.to_dict(status)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        if self.profiler is not None:
+            profile_fn = os.path.splitext(self.path)[0] + ('.prof' if isinstance(self.profiler, CProfileProfiler)
+                                                           else '.stacks.txt')
+            self.profiler.dump(profile_fn)
+            report['profile'] = dict(self.profiler.summary(), output=profile_fn)
+        with open(self.path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        print('Run report written to', self.path)
+
+
+def merge_run_reports(reports):
+    """
+    One report for a script that ran as several shards: counters, row counts, CPU seconds and per-item counts
+    and totals add up, wall seconds and peak RSS are the maximum over the shards (which ran side by side).
+    Per-item quantiles and histograms are not mergeable and are left out.
+    """
+    merged = collections.OrderedDict()
+    merged['script'] = reports[0]['script']
+    merged['status'] = 'failed' if any(r['status'] != 'completed' for r in reports) else 'completed'
+    merged['shards'] = len(reports)
+    merged['started'] = min(r['started'] for r in reports)
+    merged['wall_seconds'] = max(r['wall_seconds'] for r in reports)
+    merged['cpu_seconds'] = sum(r['cpu_seconds'] for r in reports)
+    merged['peak_rss_mb'] = max(r['peak_rss_mb'] or 0 for r in reports)
+
+    phases = collections.OrderedDict()
+    row_flow = collections.OrderedDict()
+    counters = collections.OrderedDict()
+    items = collections.OrderedDict()
+    for r in reports:
+        for phase in r['phases']:
+            merged_phase = phases.setdefault(phase['name'], {'name': phase['name'], 'wall_seconds': 0.0,
+                                                             'cpu_seconds': 0.0, 'peak_rss_mb': 0})
+            merged_phase['wall_seconds'] = max(merged_phase['wall_seconds'], phase['wall_seconds'])
+            merged_phase['cpu_seconds'] += phase['cpu_seconds']
+            merged_phase['peak_rss_mb'] = max(merged_phase['peak_rss_mb'], phase['peak_rss_mb'] or 0)
+        for step in r['row_flow']:
+            merged_step = row_flow.setdefault(step['step'], {'step': step['step'], 'rows_in': 0, 'rows_out': 0,
+                                                             'rows_dropped': 0})
+            for k in ['rows_in', 'rows_out', 'rows_dropped']:
+                merged_step[k] += step[k]
+        for name, n in r['counters'].items():
+            counters[name] = counters.get(name, 0) + n
+        for name, summary in r['items'].items():
+            merged_items = items.setdefault(name, {'count': 0, 'total_seconds': 0.0})
+            merged_items['count'] += summary['count']
+            merged_items['total_seconds'] += summary.get('total_seconds', 0.0)
+    merged['phases'] = list(phases.values())
+    merged['row_flow'] = list(row_flow.values())
+    merged['counters'] = counters
+    merged['items'] = items
+    return merged
+
+
+def add_report_arguments(parser):
+    parser.add_argument('--report', type=str, default=None,
+                        help='Write a JSON run report (phase timings, row counts, peak memory, per-subject '
+                             'timings) to this file.')
+    parser.add_argument('--profile', type=str, default=None, choices=['cprofile', 'sample'],
+                        help='Profile the run with cProfile or a sampling profiler; the profile is written next to '
+                             'the report and summarized in it.')
+    parser.add_argument('--report_slowest', type=int, default=10,
+                        help='Number of slowest subjects named in the report.')
+
+
+def start_run_report(script, args):
+    """
+    Report of a script run configured by the arguments of add_report_arguments. It is written when the
+    interpreter exits, with status failed if the script ended with an uncaught exception.
+    """
+    profiler = None
+    if getattr(args, 'profile', None) == 'cprofile':
+        profiler = CProfileProfiler()
+    elif getattr(args, 'profile', None) == 'sample':
+        profiler = SamplingProfiler()
+    report = RunReport(script, path=getattr(args, 'report', None) or (script + '_report.json' if profiler else None),
+                       args=args, slowest=getattr(args, 'report_slowest', 10), profiler=profiler)
+    if profiler is not None:
+        profiler.start()
+
+    def close_at_exit():
+        report.close('failed' if getattr(sys, 'last_value', None) is not None else 'completed')
+
+    atexit.register(close_at_exit)
+    return report
@@ -0,0 +1,223 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import collections
+import json
+import math
+
+import pandas as pd
+
+profile_quantiles = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+other_units = '(other)'
+
+
+class QuantileSketch(object):
+    """
+    Approximate quantiles of a stream of numbers with a relative error of at most relative_accuracy (DDSketch):
+    the numbers are counted in logarithmic buckets, so two sketches are merged by adding their counts. At most
+    max_buckets buckets are kept per sign; beyond that the buckets of the smallest magnitudes are collapsed,
+    which only loses accuracy close to zero.
+    """
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive = collections.Counter()
+        self.negative = collections.Counter()
+        self.zeros = 0
+        self.count = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def _key(self, magnitude):
+        return int(math.ceil(math.log(magnitude) / self._log_gamma))
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def _collapse(self, buckets):
+        if len(buckets) <= self.max_buckets:
+            return
+        keys = sorted(buckets)
+        n = len(keys) - self.max_buckets
+        buckets[keys[n]] += sum(buckets.pop(k) for k in keys[:n])
+
+    def add(self, x):
+        self.count += 1
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+        if x > 0:
+            self.positive[self._key(x)] += 1
+            self._collapse(self.positive)
+        elif x < 0:
+            self.negative[self._key(-x)] += 1
+            self._collapse(self.negative)
+        else:
+            self.zeros += 1
+
+    def merge(self, other):
+        assert self.gamma == other.gamma, 'sketches of different accuracies'
+        self.positive.update(other.positive)
+        self.negative.update(other.negative)
+        self._collapse(self.positive)
+        self._collapse(self.negative)
+        self.zeros += other.zeros
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """ Value of rank q * (count - 1), within the relative accuracy; NaN for an empty sketch. """
+        if self.count == 0:
+            return float('nan')
+        rank = q * (self.count - 1)
+        seen = 0
+        value = self.max
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                value = -self._value(key)
+                break
+        else:
+            seen += self.zeros
+            if seen > rank:
+                value = 0.0
+            else:
+                for key in sorted(self.positive):
+                    seen += self.positive[key]
+                    if seen > rank:
+                        value = self._value(key)
+                        break
+        return min(max(value, self.min), self.max)
+
+    def to_dict(self):
+        return {'relative_accuracy': self.relative_accuracy, 'max_buckets': self.max_buckets, 'count': self.count,
+                'zeros': self.zeros, 'min': self.min if self.count else None,
+                'max': self.max if self.count else None,
+                'positive': dict((str(k), v) for (k, v) in sorted(self.positive.items())),
+                'negative': dict((str(k), v) for (k, v) in sorted(self.negative.items()))}
+
+    @staticmethod
+    def from_dict(d):
+        sketch = QuantileSketch(d['relative_accuracy'], d['max_buckets'])
+        sketch.positive.update(dict((int(k), v) for (k, v) in d['positive'].items()))
+        sketch.negative.update(dict((int(k), v) for (k, v) in d['negative'].items()))
+        sketch.zeros, sketch.count = d['zeros'], d['count']
+        if sketch.count:
+            sketch.min, sketch.max = d['min'], d['max']
+        return sketch
+
+
+class ItemStats(object):
+    """ Rows, empty values, numeric values, units and a quantile sketch of the numeric values of one ITEMID. """
+    def __init__(self, table, max_units=50):
+        self.table = table
+        self.max_units = max_units
+        self.rows = 0
+        self.nulls = 0
+        self.numeric = 0
+        self.units = collections.Counter()
+        self.sketch = QuantileSketch()
+
+    def add(self, value, unit):
+        self.rows += 1
+        if unit not in self.units and len(self.units) >= self.max_units:
+            unit = other_units
+        self.units[unit] += 1
+        if value == '':
+            self.nulls += 1
+            return
+        try:
+            x = float(value)
+        except ValueError:
+            return
+        if math.isinf(x) or x != x:
+            return
+        self.numeric += 1
+        self.sketch.add(x)
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.nulls += other.nulls
+        self.numeric += other.numeric
+        for (unit, count) in other.units.items():
+            if unit not in self.units and len(self.units) >= self.max_units:
+                unit = other_units
+            self.units[unit] += count
+        self.sketch.merge(other.sketch)
+        return self
+
+
+class ItemProfile(object):
+    """
+    Per-ITEMID profile of the raw event tables, filled row by row while they are scanned (see
+    read_events_table_and_break_up_by_subject) in memory that grows with the number of ITEMIDs, not of rows.
+    Profiles of separate scans (tables, shards, runs) are combined with merge.
+    """
+    def __init__(self):
+        self.items = {}
+
+    def add(self, table, itemid, value, unit):
+        stats = self.items.get(itemid)
+        if stats is None:
+            stats = self.items[itemid] = ItemStats(table)
+        stats.add(value, unit)
+
+    def merge(self, other):
+        for (itemid, stats) in other.items.items():
+            if itemid in self.items:
+                self.items[itemid].merge(stats)
+            else:
+                self.items[itemid] = stats
+        return self
+
+    def to_frame(self):
+        """ One row per ITEMID with the counts, rates, main unit and quantiles, sorted by ITEMID. """
+        rows = []
+        for itemid in sorted(self.items, key=int):
+            stats = self.items[itemid]
+            non_null = stats.rows - stats.nulls
+            row = collections.OrderedDict([
+                ('ITEMID', int(itemid)), ('TABLE', stats.table), ('COUNT', stats.rows),
+                ('NULL_RATE', stats.nulls / float(stats.rows)),
+                ('NUMERIC_RATE', stats.numeric / float(non_null) if non_null else float('nan')),
+                ('VALUEUOM', stats.units.most_common(1)[0][0]), ('N_UNITS', len(stats.units)),
+                ('MIN', stats.sketch.min if stats.numeric else float('nan'))])
+            for q in profile_quantiles:
+                row['P{:02d}'.format(int(round(100 * q)))] = stats.sketch.quantile(q)
+            row['MAX'] = stats.sketch.max if stats.numeric else float('nan')
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def to_dict(self):
+        return dict((itemid, {'table': stats.table, 'rows': stats.rows, 'nulls': stats.nulls,
+                              'numeric': stats.numeric, 'units': dict(sorted(stats.units.items())),
+                              'sketch': stats.sketch.to_dict()})
+                    for (itemid, stats) in sorted(self.items.items(), key=lambda x: int(x[0])))
+
+    @staticmethod
+    def from_dict(d):
+        profile = ItemProfile()
+        for (itemid, item) in d.items():
+            stats = profile.items[itemid] = ItemStats(item['table'])
+            stats.rows, stats.nulls, stats.numeric = item['rows'], item['nulls'], item['numeric']
+            stats.units.update(item['units'])
+            stats.sketch = QuantileSketch.from_dict(item['sketch'])
+        return profile
+
+
+def write_item_profile(profile, fn):
+    """
+    Writes a profile as JSON with its sketches, so it can be merged later, and the summary of to_frame next to it
+    as CSV (fn with .csv instead of .json), which is what to diff across runs.
+    """
+    with open(fn, 'w') as profile_file:
+        json.dump(profile.to_dict(), profile_file, indent=1, sort_keys=True)
+    profile.to_frame().to_csv(fn[:-len('.json')] + '.csv' if fn.endswith('.json') else fn + '.csv', index=False)
+
+
+def read_item_profile(fn):
+    with open(fn) as profile_file:
+        return ItemProfile.from_dict(json.load(profile_file))
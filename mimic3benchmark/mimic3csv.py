@@ -4,34 +4,33 @@ from __future__ import print_function
 import csv
 import numpy as np
 import os
-import pandas as pd
 from pandas import Timestamp
 from tqdm import tqdm
 
-from mimic3benchmark.util import dataframe_from_csv
+from mimic3benchmark.util import dataframe_from_csv, epoch_seconds, parse_times
 
 
 def read_patients_table(mimic3_path):
     pats = dataframe_from_csv(os.path.join(mimic3_path, 'PATIENTS.csv'))
     pats = pats[['SUBJECT_ID', 'GENDER', 'DOB', 'DOD']]
-    pats.DOB = pd.to_datetime(pats.DOB)
-    pats.DOD = pd.to_datetime(pats.DOD)
+    pats.DOB = parse_times(pats.DOB)
+    pats.DOD = parse_times(pats.DOD)
     return pats
 
 
 def read_admissions_table(mimic3_path):
     admits = dataframe_from_csv(os.path.join(mimic3_path, 'ADMISSIONS.csv'))
     admits = admits[['SUBJECT_ID', 'HADM_ID', 'ADMITTIME', 'DISCHTIME', 'DEATHTIME', 'ETHNICITY', 'DIAGNOSIS']]
-    admits.ADMITTIME = pd.to_datetime(admits.ADMITTIME)
-    admits.DISCHTIME = pd.to_datetime(admits.DISCHTIME)
-    admits.DEATHTIME = pd.to_datetime(admits.DEATHTIME)
+    admits.ADMITTIME = parse_times(admits.ADMITTIME)
+    admits.DISCHTIME = parse_times(admits.DISCHTIME)
+    admits.DEATHTIME = parse_times(admits.DEATHTIME)
     return admits
 
 
 def read_icustays_table(mimic3_path):
     stays = dataframe_from_csv(os.path.join(mimic3_path, 'ICUSTAYS.csv'))
-    stays.INTIME = pd.to_datetime(stays.INTIME)
-    stays.OUTTIME = pd.to_datetime(stays.OUTTIME)
+    stays.INTIME = parse_times(stays.INTIME)
+    stays.OUTTIME = parse_times(stays.OUTTIME)
     return stays
 
 
@@ -143,7 +142,8 @@ def break_up_diagnoses_by_subject(diagnoses, output_path, subjects=None):
 
 
 def read_events_table_and_break_up_by_subject(mimic3_path, table, output_path,
-                                              items_to_keep=None, subjects_to_keep=None):
+                                              items_to_keep=None, subjects_to_keep=None, epoch_times=False,
+                                              item_profile=None):
     obs_header = ['SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'CHARTTIME', 'ITEMID', 'VALUE', 'VALUEUOM']
     if items_to_keep is not None:
         items_to_keep = set([str(s) for s in items_to_keep])
@@ -174,10 +174,13 @@ def read_events_table_and_break_up_by_subject(mimic3_path, table, output_path,
 
     nb_rows_dict = {'chartevents': 330712484, 'labevents': 27854056, 'outputevents': 4349219}
     nb_rows = nb_rows_dict[table.lower()]
+    nb_read, nb_kept = 0, 0
 
     for row, row_no, _ in tqdm(read_events_table_by_row(mimic3_path, table), total=nb_rows,
                                                         desc='Processing {} table'.format(table)):
-
+        nb_read += 1
+        if item_profile is not None:
+            item_profile.add(table, row['ITEMID'], row['VALUE'], row['VALUEUOM'])
         if (subjects_to_keep is not None) and (row['SUBJECT_ID'] not in subjects_to_keep):
             continue
         if (items_to_keep is not None) and (row['ITEMID'] not in items_to_keep):
@@ -186,7 +189,7 @@ def read_events_table_and_break_up_by_subject(mimic3_path, table, output_path,
         row_out = {'SUBJECT_ID': row['SUBJECT_ID'],
                    'HADM_ID': row['HADM_ID'],
                    'ICUSTAY_ID': '' if 'ICUSTAY_ID' not in row else row['ICUSTAY_ID'],
-                   'CHARTTIME': row['CHARTTIME'],
+                   'CHARTTIME': epoch_seconds(row['CHARTTIME']) if epoch_times else row['CHARTTIME'],
                    'ITEMID': row['ITEMID'],
                    'VALUE': row['VALUE'],
                    'VALUEUOM': row['VALUEUOM']}
@@ -194,6 +197,8 @@ def read_events_table_and_break_up_by_subject(mimic3_path, table, output_path,
             write_current_observations()
         data_stats.curr_obs.append(row_out)
         data_stats.curr_subject_id = row['SUBJECT_ID']
+        nb_kept += 1
 
     if data_stats.curr_subject_id != '':
         write_current_observations()
+    return nb_read, nb_kept
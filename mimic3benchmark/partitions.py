@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import zlib
+
+import pandas as pd
+
+manifest_columns = ['SUBJECT_ID', 'PARTITION', 'SPLIT']
+
+
+def build_partition_manifest(subject_ids, test_subjects, val_subjects=()):
+    """
+    Subject -> partition mapping. PARTITION is train or test, SPLIT further splits the train partition
+    into train and val.
+    """
+    subject_ids = pd.Series(sorted(set(int(x) for x in subject_ids)), dtype='int64')
+    is_test = subject_ids.isin(set(test_subjects))
+    is_val = subject_ids.isin(set(val_subjects)) & ~is_test
+    partition = pd.Series('train', index=subject_ids.index).mask(is_test, 'test')
+    split = partition.mask(is_val, 'val')
+    return pd.DataFrame({'SUBJECT_ID': subject_ids, 'PARTITION': partition, 'SPLIT': split},
+                        columns=manifest_columns)
+
+
+def write_partition_manifest(manifest, fn):
+    manifest.sort_values(by='SUBJECT_ID')[manifest_columns].to_csv(fn, index=False)
+
+
+def read_partition_manifest(fn):
+    return pd.read_csv(fn, dtype={'SUBJECT_ID': 'int64', 'PARTITION': str, 'SPLIT': str})
+
+
+def list_partition_subjects(root_path, partition, manifest=None):
+    """
+    (subject, subject directory) pairs of a partition in SUBJECT_ID order. Without a manifest the subjects are
+    the directories that split_train_and_test moved to {root_path}/{partition}, with a manifest they are read from
+    it and their directories stay in root_path.
+    """
+    if manifest is None:
+        partition_path = os.path.join(root_path, partition)
+        patients = sorted(filter(str.isdigit, os.listdir(partition_path)), key=int)
+        return [(patient, os.path.join(partition_path, patient)) for patient in patients]
+    patients = manifest.SUBJECT_ID[manifest.PARTITION == partition].astype(str)
+    return [(patient, os.path.join(root_path, patient)) for patient in patients]
+
+
+def subject_shard(subject_id, num_shards):
+    """ Shard of a subject: a CRC32 of its SUBJECT_ID, which is the same on every machine and Python version. """
+    return zlib.crc32(str(int(subject_id)).encode('ascii')) % num_shards
+
+
+def select_shard(subjects, shard=None, num_shards=None, key=lambda x: x):
+    """ The subjects (anything key maps to a SUBJECT_ID) of one shard, all subjects if shard is None. """
+    if shard is None:
+        return list(subjects)
+    return [subject for subject in subjects if subject_shard(key(subject), num_shards) == shard]
+
+
+def shard_path(fn, shard=None, num_shards=None):
+    """ Name of the part of an output file written by one shard, e.g. listfile.shard-0-of-4.csv. """
+    if shard is None:
+        return fn
+    base, ext = os.path.splitext(fn)
+    return '{}.shard-{}-of-{}{}'.format(base, shard, num_shards, ext)
+
+
+def add_shard_arguments(parser):
+    parser.add_argument('--shard', type=int, default=None,
+                        help='Process only the subjects of this shard, 0 <= shard < --num_shards. Outputs that '
+                             'cover all subjects are written per shard and combined with merge_shards.')
+    parser.add_argument('--num_shards', '--num-shards', dest='num_shards', type=int, default=None,
+                        help='Number of shards the subjects are split into by a hash of their SUBJECT_ID.')
+
+
+def check_shard_arguments(parser, args):
+    if (args.shard is None) != (args.num_shards is None):
+        parser.error('--shard and --num_shards go together')
+    if args.shard is not None and not 0 <= args.shard < args.num_shards:
+        parser.error('--shard must be in [0, --num_shards)')
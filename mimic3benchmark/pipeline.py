@@ -0,0 +1,233 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import time
+
+repo_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+resources_path = os.path.join(repo_path, 'mimic3benchmark', 'resources')
+
+
+class Stage(object):
+    """
+    One command of the pipeline: a module run with python -m in the data directory, the stages it depends on,
+    the files it reads and writes, and the CPUs and memory (in GB) it is expected to use.
+    """
+    def __init__(self, name, module_args, depends=(), inputs=(), outputs=(), cpus=1, memory_gb=1.0):
+        self.name = name
+        self.module_args = list(module_args)
+        self.depends = list(depends)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.cpus = cpus
+        self.memory_gb = memory_gb
+
+
+def default_stages(mimic_dir, data_dir='data', manifest=False, notes_workers=2):
+    """
+    The commands of the README as a DAG. create_clinical_notes only reads the MIMIC-III CSVs and the shipped
+    split listfiles, so it runs next to the per-subject stages. With manifest=True the subjects are split with
+    a partition manifest instead of being moved, so every stage can be re-run on the same root. Every path a
+    stage reads or writes is passed explicitly or is relative to data_dir, the working directory of the stages
+    (see run_stages), so nothing is written into the repository.
+    """
+    root = os.path.join(data_dir, 'root')
+    timeseries = os.path.join(data_dir, 'timeseries')
+    demography = os.path.join(data_dir, 'demography_diagnosis')
+    notes = os.path.join(data_dir, 'clinical_notes')
+    manifest_fn = os.path.join(root, 'partitions.csv')
+    manifest_args = ['--manifest', manifest_fn] if manifest else []
+    mimic_csvs = dict((table, os.path.join(mimic_dir, table + '.csv'))
+                      for table in ['PATIENTS', 'ADMISSIONS', 'ICUSTAYS', 'DIAGNOSES_ICD', 'CHARTEVENTS',
+                                    'LABEVENTS', 'OUTPUTEVENTS', 'NOTEEVENTS'])
+    phenotype_definitions = os.path.join(resources_path, 'hcup_ccs_2015_definitions.yaml')
+    split_dir = os.path.join(repo_path, 'data')
+    test_subjects = os.path.join(repo_path, 'mimic3benchmark', 'mimic_test.csv')
+    val_subjects = os.path.join(repo_path, 'mimic3benchmark', 'mimic_val.csv')
+    return [
+        Stage('extract_subjects', ['mimic3benchmark.scripts.extract_subjects', mimic_dir, root],
+              inputs=[mimic_csvs[t] for t in ['PATIENTS', 'ADMISSIONS', 'ICUSTAYS', 'DIAGNOSES_ICD', 'CHARTEVENTS',
+                                              'LABEVENTS', 'OUTPUTEVENTS']] + [phenotype_definitions],
+              outputs=[os.path.join(root, 'all_stays.csv'), os.path.join(root, 'phenotype_labels.csv')],
+              memory_gb=4),
+        Stage('validate_events', ['mimic3benchmark.scripts.validate_events', root],
+              depends=['extract_subjects']),
+        Stage('extract_episodes_from_subjects', ['mimic3benchmark.scripts.extract_episodes_from_subjects', root],
+              depends=['validate_events'],
+              inputs=[os.path.join(resources_path, 'itemid_to_variable_map.csv'),
+                      os.path.join(resources_path, 'variable_ranges.csv')],
+              outputs=[os.path.join(root, 'episode_catalog.csv')]),
+        Stage('split_train_and_test', ['mimic3benchmark.scripts.split_train_and_test', root,
+                                       '--test_subjects', test_subjects, '--val_subjects', val_subjects] +
+              (['--manifest'] if manifest else []),
+              depends=['extract_episodes_from_subjects'],
+              inputs=[test_subjects] + ([val_subjects] if manifest else []),
+              outputs=[manifest_fn] if manifest else []),
+        Stage('create_timeseries', ['mimic3benchmark.scripts.create_timeseries', root, timeseries] + manifest_args,
+              depends=['split_train_and_test'],
+              inputs=[os.path.join(resources_path, 'channel_info.json'),
+                      os.path.join(resources_path, 'discretizer_config.json')],
+              outputs=[os.path.join(timeseries, partition, 'listfile.csv') for partition in ['train', 'test']] +
+                      [os.path.join(data_dir, 'mp_listfile.csv')],
+              memory_gb=2),
+        Stage('create_demography_diagnosis', ['mimic3benchmark.scripts.create_demography_diagnosis', root,
+                                              demography] + manifest_args,
+              depends=['split_train_and_test'],
+              inputs=[phenotype_definitions],
+              outputs=[os.path.join(demography, partition, 'listfile.csv') for partition in ['train', 'test']],
+              memory_gb=2),
+        Stage('create_clinical_notes', ['mimic3benchmark.scripts.create_clinical_notes', '--mimic_dir', mimic_dir,
+                                        '--save_dir', notes, '--admission_only', 'True',
+                                        '--n_workers', str(notes_workers),
+                                        '--cache_dir', os.path.join(data_dir, 'cache', 'clinical_notes'),
+                                        '--split_dir', split_dir,
+                                        '--mortality_list', os.path.join(split_dir, 'mortality_listfile.csv')],
+              inputs=[mimic_csvs['NOTEEVENTS'], mimic_csvs['ADMISSIONS']] +
+                     [os.path.join(split_dir, '{}_listfile.csv'.format(split))
+                      for split in ['train', 'val', 'test', 'mortality']],
+              outputs=[os.path.join(notes, 'MP_IN_adm_{}.csv'.format(split)) for split in ['train', 'val', 'test']],
+              cpus=notes_workers, memory_gb=8),
+        Stage('split_train_val', ['mimic3benchmark.scripts.split_train_val', timeseries,
+                                  '--val_subjects', val_subjects] + manifest_args,
+              depends=['create_timeseries'],
+              inputs=[] if manifest else [val_subjects],
+              outputs=[os.path.join(timeseries, '{}_listfile.csv'.format(split))
+                       for split in ['train', 'val', 'test']]),
+    ]
+
+
+def stage_environment():
+    """ Environment of the stage processes: this one with the repository in front of the PYTHONPATH. """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([repo_path] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    return env
+
+
+def stamp_path(stamp_dir, stage):
+    return os.path.join(stamp_dir, stage.name + '.done')
+
+
+def is_up_to_date(stage, stages_by_name, stamp_dir):
+    """
+    A stage is up to date if it completed before (its stamp exists), all its outputs exist and none of its
+    inputs, including the stamps of the stages it depends on, is newer than the oldest of them.
+    """
+    outputs = [stamp_path(stamp_dir, stage)] + stage.outputs
+    if not all(os.path.exists(fn) for fn in outputs):
+        return False
+    inputs = stage.inputs + [stamp_path(stamp_dir, stages_by_name[dep]) for dep in stage.depends]
+    if not all(os.path.exists(fn) for fn in inputs):
+        return False
+    oldest_output = min(os.path.getmtime(fn) for fn in outputs)
+    return all(os.path.getmtime(fn) <= oldest_output for fn in inputs)
+
+
+def plan_stages(stages, stamp_dir, targets=None, force=False):
+    """
+    Stages needed for targets (default: all stages) in dependency order, with whether each of them has to run.
+    A stage runs if it is out of date or one of its dependencies runs.
+    """
+    stages_by_name = dict((stage.name, stage) for stage in stages)
+    needed = set()
+    todo = list(targets) if targets else [stage.name for stage in stages]
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(stages_by_name[name].depends)
+
+    plan = []
+    runs = {}
+    for stage in stages:
+        if stage.name not in needed:
+            continue
+        runs[stage.name] = force or any(runs.get(dep, False) for dep in stage.depends) or \
+            not is_up_to_date(stage, stages_by_name, stamp_dir)
+        plan.append((stage, runs[stage.name]))
+    return plan
+
+
+def total_memory_gb():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / float(1 << 30)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def run_stages(plan, stamp_dir, log_dir, cpus=None, memory_gb=None, report=True, poll_interval=0.2, cwd=None):
+    """
+    Runs the stages of the plan that have to run, each as soon as the stages it depends on have finished and
+    its CPUs and memory fit in the budget. A stage that asks for more than the whole budget runs alone.
+    The stages run in cwd (default: the parent of stamp_dir, the data directory) with the repository on
+    their PYTHONPATH, so files a stage writes to its working directory stay out of the repository.
+    On the first failure no further stage is started and the running ones are terminated.
+    Returns the names of the failed stages, empty on success.
+    """
+    cpus = cpus or os.cpu_count() or 1
+    memory_gb = memory_gb or total_memory_gb() or float('inf')
+    cwd = cwd or os.path.dirname(os.path.abspath(stamp_dir))
+    for path in [stamp_dir, log_dir, cwd]:
+        if not os.path.exists(path):
+            os.makedirs(path)
+    env = stage_environment()
+
+    pending = [stage for (stage, runs) in plan if runs]
+    done = set(stage.name for (stage, runs) in plan if not runs)
+    for name in sorted(done):
+        print('{:<32} up to date'.format(name))
+    running = {}
+    failed = []
+
+    def demand(stage):
+        return min(stage.cpus, cpus), min(stage.memory_gb, memory_gb)
+
+    try:
+        while (pending or running) and not failed:
+            used_cpus = sum(demand(stage)[0] for (stage, _, _, _) in running.values())
+            used_memory = sum(demand(stage)[1] for (stage, _, _, _) in running.values())
+            for stage in list(pending):
+                if not all(dep in done for dep in stage.depends):
+                    continue
+                stage_cpus, stage_memory = demand(stage)
+                if used_cpus + stage_cpus > cpus or used_memory + stage_memory > memory_gb:
+                    continue
+                if os.path.exists(stamp_path(stamp_dir, stage)):
+                    os.remove(stamp_path(stamp_dir, stage))
+                args = stage.module_args
+                if report:
+                    args = args + ['--report', os.path.join(log_dir, stage.name + '.json')]
+                log = open(os.path.join(log_dir, stage.name + '.txt'), 'w')
+                process = subprocess.Popen([sys.executable, '-m'] + args, cwd=cwd, env=env, stdout=log,
+                                           stderr=subprocess.STDOUT)
+                running[stage.name] = (stage, process, log, time.time())
+                pending.remove(stage)
+                used_cpus += stage_cpus
+                used_memory += stage_memory
+                print('{:<32} started'.format(stage.name))
+
+            time.sleep(poll_interval)
+            for name, (stage, process, log, start) in list(running.items()):
+                code = process.poll()
+                if code is None:
+                    continue
+                log.close()
+                del running[name]
+                if code != 0:
+                    failed.append(name)
+                    print('{:<32} FAILED with exit code {} after {:.1f}s, see {}'.format(
+                        name, code, time.time() - start, os.path.join(log_dir, name + '.txt')))
+                    continue
+                with open(stamp_path(stamp_dir, stage), 'w') as stamp:
+                    stamp.write('{}\n'.format(time.strftime('%Y-%m-%dT%H:%M:%S')))
+                done.add(name)
+                print('{:<32} finished in {:.1f}s'.format(name, time.time() - start))
+    finally:
+        # on failure or interruption, stop the stages that are still running
+        for name, (stage, process, log, start) in running.items():
+            process.terminate()
+            process.wait()
+            log.close()
+            print('{:<32} terminated'.format(name))
+    return failed
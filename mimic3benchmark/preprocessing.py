@@ -4,9 +4,10 @@ from __future__ import print_function
 import numpy as np
 import re
 
-from pandas import DataFrame, Series
+from pandas import Categorical, CategoricalDtype, DataFrame, Series, factorize
 
-from mimic3benchmark.util import dataframe_from_csv
+from mimic3benchmark.hcup_ccs import HcupCcsMapping, compile_hcup_ccs_mapping
+from mimic3benchmark.util import dataframe_from_csv, parse_float
 
 ###############################
 # Non-time series preprocessing
@@ -17,7 +18,9 @@ g_map = {'F': 1, 'M': 2, 'OTHER': 3, '': 0}
 
 def transform_gender(gender_series):
     global g_map
-    return {'Gender': gender_series.fillna('').apply(lambda s: g_map[s] if s in g_map else g_map['OTHER'])}
+    gender_series = gender_series.fillna('')
+    codes = dict((s, g_map[s] if s in g_map else g_map['OTHER']) for s in gender_series.unique())
+    return {'Gender': gender_series.map(codes)}
 
 
 e_map = {'ASIAN': 1,
@@ -43,8 +46,10 @@ def transform_ethnicity(ethnicity_series):
     def aggregate_ethnicity(ethnicity_str):
         return ethnicity_str.replace(' OR ', '/').split(' - ')[0].split('/')[0]
 
-    ethnicity_series = ethnicity_series.apply(aggregate_ethnicity)
-    return {'Ethnicity': ethnicity_series.fillna('').apply(lambda s: e_map[s] if s in e_map else e_map['OTHER'])}
+    # few distinct strings, each is aggregated and mapped once
+    ethnicity_series = ethnicity_series.fillna('')
+    codes = dict((s, e_map.get(aggregate_ethnicity(s), e_map['OTHER'])) for s in ethnicity_series.unique())
+    return {'Ethnicity': ethnicity_series.map(codes)}
 
 
 def assemble_episodic_data(stays, diagnoses):
@@ -78,10 +83,7 @@ def extract_diagnosis_labels(diagnoses):
     diagnoses['VALUE'] = 1
     labels = diagnoses[['ICUSTAY_ID', 'ICD9_CODE', 'VALUE']].drop_duplicates()\
                       .pivot(index='ICUSTAY_ID', columns='ICD9_CODE', values='VALUE').fillna(0).astype(int)
-    for l in diagnosis_labels:
-        if l not in labels:
-            labels[l] = 0
-    labels = labels[diagnosis_labels]
+    labels = labels.reindex(columns=diagnosis_labels, fill_value=0)
     return labels.rename(dict(zip(diagnosis_labels, ['Diagnosis ' + d for d in diagnosis_labels])), axis=1)
 
 
@@ -90,13 +92,14 @@ def add_hcup_ccs_2015_groups(diagnoses, definitions):
     add CCS column to the diagnoses table
     CCS are clinically meaningful categories that are sometimes more useful for presenting descriptive statistics than are individual ICD-9-CM codes.
     multiple ICD-9 codes can be mapped (classified) to one CCS code
+    definitions is either the parsed YAML or a compiled HcupCcsMapping (see hcup_ccs.load_hcup_ccs_mapping)
     """
-    def_map = {}
-    for dx in definitions:
-        for code in definitions[dx]['codes']:
-            def_map[code] = (dx, definitions[dx]['use_in_benchmark'])
-    diagnoses['HCUP_CCS_2015'] = diagnoses.ICD9_CODE.apply(lambda c: def_map[c][0] if c in def_map else None)
-    diagnoses['USE_IN_BENCHMARK'] = diagnoses.ICD9_CODE.apply(lambda c: int(def_map[c][1]) if c in def_map else None)
+    mapping = definitions if isinstance(definitions, HcupCcsMapping) else compile_hcup_ccs_mapping(definitions)
+    group_ids = mapping.lookup(diagnoses.ICD9_CODE)
+    found = group_ids >= 0
+    use_in_benchmark = mapping.use_in_benchmark[group_ids].astype(int)
+    diagnoses['HCUP_CCS_2015'] = np.where(found, mapping.groups[group_ids], None)
+    diagnoses['USE_IN_BENCHMARK'] = use_in_benchmark if found.all() else np.where(found, use_in_benchmark, np.nan)
     return diagnoses
 
 
@@ -154,19 +157,63 @@ def remove_outliers_for_variable(events, variable, ranges):
     return events
 
 
+########################
+# Typed event values
+########################
+
+plain_decimal_re = re.compile(r'^(\d+(\.\d*)?|\.\d+)$')
+
+
+def add_typed_values(events):
+    """
+    Parses the VALUE of the events once for all cleaners: VALUE_NUM is the value as a float (NaN if it is not a
+    number) and VALUE_TEXT, a categorical, holds the values that are strings other than plain decimals such as
+    'ERROR', '120/80' or 'Brisk'. Typed columns that are already there, as read from the events.csv files written
+    by validate_events, are kept. VALUEUOM becomes categorical with '' for missing units. VALUE stays as it was
+    read, because the time series write the values of the variables that are not cleaned as they are.
+    """
+    if 'VALUE_NUM' not in events.columns or 'VALUE_TEXT' not in events.columns:
+        value = events.VALUE
+        if value.dtype == object:
+            # strings are converted like astype(float) does, one conversion per distinct value
+            codes, uniques = factorize(value)
+            numbers = np.append(np.array([parse_float(u) for u in uniques], dtype=float), np.nan)
+            is_text = np.append(np.array([isinstance(u, str) and plain_decimal_re.match(u) is None
+                                          for u in uniques], dtype=bool), False)
+            events['VALUE_NUM'] = numbers[codes]
+            events['VALUE_TEXT'] = Categorical(value.where(is_text[codes]))
+        else:
+            events['VALUE_NUM'] = value.astype(float)
+            events['VALUE_TEXT'] = Categorical.from_codes(np.full(events.shape[0], -1), categories=[])
+    elif not isinstance(events.VALUE_TEXT.dtype, CategoricalDtype):
+        events['VALUE_TEXT'] = Categorical(events.VALUE_TEXT)
+    events['VALUEUOM'] = Categorical(events.VALUEUOM.fillna('').astype(str))
+    return events
+
+
+def category_flags(column, predicate):
+    """ predicate(value) for every row of a column, evaluated once per distinct value; False for missing values. """
+    if isinstance(column.dtype, CategoricalDtype):
+        codes, uniques = column.cat.codes.values, column.cat.categories
+    else:
+        codes, uniques = factorize(column)
+    flags = np.append(np.array([bool(predicate(u)) for u in uniques], dtype=bool), False)
+    return Series(flags[codes], index=column.index)
+
+
 # SBP: some are strings of type SBP/DBP
 def clean_sbp(df):
-    v = df.VALUE.astype(str).copy()
-    idx = v.apply(lambda s: '/' in s)
-    v.loc[idx] = v[idx].apply(lambda s: re.match('^(\d+)/(\d+)$', s).group(1))
-    return v.astype(float)
+    v = df.VALUE_NUM.copy()
+    idx = category_flags(df.VALUE_TEXT, lambda s: '/' in s)
+    v.loc[idx] = df.VALUE_TEXT[idx].astype(str).apply(lambda s: float(re.match('^(\d+)/(\d+)$', s).group(1)))
+    return v
 
 
 def clean_dbp(df):
-    v = df.VALUE.astype(str).copy()
-    idx = v.apply(lambda s: '/' in s)
-    v.loc[idx] = v[idx].apply(lambda s: re.match('^(\d+)/(\d+)$', s).group(2))
-    return v.astype(float)
+    v = df.VALUE_NUM.copy()
+    idx = category_flags(df.VALUE_TEXT, lambda s: '/' in s)
+    v.loc[idx] = df.VALUE_TEXT[idx].astype(str).apply(lambda s: float(re.match('^(\d+)/(\d+)$', s).group(2)))
+    return v
 
 
 # CRR: strings with brisk, <3 normal, delayed, or >3 abnormal
@@ -174,18 +221,14 @@ def clean_crr(df):
     v = Series(np.zeros(df.shape[0]), index=df.index)
     v[:] = np.nan
 
-    # when df.VALUE is empty, dtype can be float and comparision with string
-    # raises an exception, to fix this we change dtype to str
-    df_value_str = df.VALUE.astype(str)
-
-    v.loc[(df_value_str == 'Normal <3 secs') | (df_value_str == 'Brisk')] = 0
-    v.loc[(df_value_str == 'Abnormal >3 secs') | (df_value_str == 'Delayed')] = 1
+    v.loc[category_flags(df.VALUE_TEXT, lambda s: s in ('Normal <3 secs', 'Brisk'))] = 0
+    v.loc[category_flags(df.VALUE_TEXT, lambda s: s in ('Abnormal >3 secs', 'Delayed'))] = 1
     return v
 
 
 # FIO2: many 0s, some 0<x<0.2 or 1<x<20
 def clean_fio2(df):
-    v = df.VALUE.astype(float).copy()
+    v = df.VALUE_NUM.copy()
 
     ''' The line below is the correct way of doing the cleaning, since we will not compare 'str' to 'float'.
     If we use that line it will create mismatches from the data of the paper in ~50 ICU stays.
@@ -193,16 +236,13 @@ def clean_fio2(df):
     '''
     # idx = df.VALUEUOM.fillna('').apply(lambda s: 'torr' not in s.lower()) & (v>1.0)
 
-    ''' The line below was used to create the benchmark dataset that the paper used. Note this line will not work
-    in python 3, since it may try to compare 'str' to 'float'.
+    ''' The dataset of the paper was created with
+        is_str = np.array(map(lambda x: type(x) == str, list(df.VALUE)), dtype=np.bool)
+        idx = df.VALUEUOM.fillna('').apply(lambda s: 'torr' not in s.lower()) & (is_str | (~is_str & (v > 1.0)))
+    On python 3 map() returns an iterator, so is_str is a single True and every value whose unit is not torr
+    is divided by 100. The line below does the same.
     '''
-    # idx = df.VALUEUOM.fillna('').apply(lambda s: 'torr' not in s.lower()) & (df.VALUE > 1.0)
-
-    ''' The two following lines implement the code that was used to create the benchmark dataset that the paper used.
-    This works with both python 2 and python 3.
-    '''
-    is_str = np.array(map(lambda x: type(x) == str, list(df.VALUE)), dtype=np.bool)
-    idx = df.VALUEUOM.fillna('').apply(lambda s: 'torr' not in s.lower()) & (is_str | (~is_str & (v > 1.0)))
+    idx = ~category_flags(df.VALUEUOM, lambda s: 'torr' in s.lower())
 
     v.loc[idx] = v[idx] / 100.
     return v
@@ -210,20 +250,14 @@ def clean_fio2(df):
 
 # GLUCOSE, PH: sometimes have ERROR as value
 def clean_lab(df):
-    v = df.VALUE.copy()
-    idx = v.apply(lambda s: type(s) is str and not re.match('^(\d+(\.\d*)?|\.\d+)$', s))
-    v.loc[idx] = np.nan
-    return v.astype(float)
+    return df.VALUE_NUM.where(df.VALUE_TEXT.isnull())
 
 
 # O2SAT: small number of 0<x<=1 that should be mapped to 0-100 scale
 def clean_o2sat(df):
     # change "ERROR" to NaN
-    v = df.VALUE.copy()
-    idx = v.apply(lambda s: type(s) is str and not re.match('^(\d+(\.\d*)?|\.\d+)$', s))
-    v.loc[idx] = np.nan
+    v = df.VALUE_NUM.where(df.VALUE_TEXT.isnull())
 
-    v = v.astype(float)
     idx = (v <= 1)
     v.loc[idx] = v[idx] * 100.
     return v
@@ -231,8 +265,9 @@ def clean_o2sat(df):
 
 # Temperature: map Farenheit to Celsius, some ambiguous 50<x<80
 def clean_temperature(df):
-    v = df.VALUE.astype(float).copy()
-    idx = df.VALUEUOM.fillna('').apply(lambda s: 'F' in s.lower()) | df.MIMIC_LABEL.apply(lambda s: 'F' in s.lower()) | (v >= 79)
+    v = df.VALUE_NUM.copy()
+    idx = category_flags(df.VALUEUOM, lambda s: 'F' in s.lower()) | \
+        category_flags(df.MIMIC_LABEL, lambda s: 'F' in s.lower()) | (v >= 79)
     v.loc[idx] = (v[idx] - 32) * 5. / 9
     return v
 
@@ -240,12 +275,14 @@ def clean_temperature(df):
 # Weight: some really light/heavy adults: <50 lb, >450 lb, ambiguous oz/lb
 # Children are tough for height, weight
 def clean_weight(df):
-    v = df.VALUE.astype(float).copy()
+    v = df.VALUE_NUM.copy()
     # ounces
-    idx = df.VALUEUOM.fillna('').apply(lambda s: 'oz' in s.lower()) | df.MIMIC_LABEL.apply(lambda s: 'oz' in s.lower())
+    idx = category_flags(df.VALUEUOM, lambda s: 'oz' in s.lower()) | \
+        category_flags(df.MIMIC_LABEL, lambda s: 'oz' in s.lower())
     v.loc[idx] = v[idx] / 16.
     # pounds
-    idx = idx | df.VALUEUOM.fillna('').apply(lambda s: 'lb' in s.lower()) | df.MIMIC_LABEL.apply(lambda s: 'lb' in s.lower())
+    idx = idx | category_flags(df.VALUEUOM, lambda s: 'lb' in s.lower()) | \
+        category_flags(df.MIMIC_LABEL, lambda s: 'lb' in s.lower())
     v.loc[idx] = v[idx] * 0.453592
     return v
 
@@ -253,8 +290,9 @@ def clean_weight(df):
 # Height: some really short/tall adults: <2 ft, >7 ft)
 # Children are tough for height, weight
 def clean_height(df):
-    v = df.VALUE.astype(float).copy()
-    idx = df.VALUEUOM.fillna('').apply(lambda s: 'in' in s.lower()) | df.MIMIC_LABEL.apply(lambda s: 'in' in s.lower())
+    v = df.VALUE_NUM.copy()
+    idx = category_flags(df.VALUEUOM, lambda s: 'in' in s.lower()) | \
+        category_flags(df.MIMIC_LABEL, lambda s: 'in' in s.lower())
     v.loc[idx] = np.round(v[idx] * 2.54)
     return v
 
@@ -284,7 +322,12 @@ clean_fns = {
 
 
 def clean_events(events):
+    """
+    Cleans the values of the variables in clean_fns, in place, and drops the events without a value. The cleaners
+    use the typed columns of add_typed_values, which are added here only if the events do not have them yet.
+    """
     global clean_fns
+    events = add_typed_values(events)
     for var_name, clean_fn in clean_fns.items():
         idx = (events.VARIABLE == var_name)
         try:
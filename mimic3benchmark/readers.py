@@ -0,0 +1,121 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import collections
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from mimic3benchmark.util import prefetch
+
+default_discretizer_config = os.path.join(os.path.dirname(__file__), 'resources/discretizer_config.json')
+non_label_columns = ['stay', 'period_length', 'HADM_ID']
+
+Batch = collections.namedtuple('Batch', ['X', 'mask', 'lengths', 'y', 'names'])
+
+
+def read_channels(discretizer_config=default_discretizer_config):
+    """ Channels of the time series in the order of the discretizer config. """
+    with open(discretizer_config) as config_file:
+        return json.loads(config_file.read())['id_to_channel']
+
+
+def read_timeseries_episode(fn, channels):
+    """ Hours and the values of the channels (NaN where missing, float32) of a file written by create_timeseries. """
+    ts = pd.read_csv(fn, index_col=0)
+    return ts['Hours'].to_numpy(dtype=float), ts.reindex(columns=channels).to_numpy(dtype=np.float32)
+
+
+class TimeseriesReader(object):
+    """
+    Padded batches of the samples of a listfile written by create_timeseries (or split_train_val), for example
+
+        reader = TimeseriesReader('data/timeseries/train', 'data/timeseries/train_listfile.csv', shuffle=True)
+        for epoch in range(10):
+            for batch in reader:
+                ...
+
+    Every batch has X, the values of the channels (batch, time, channel) with 0 where there is no value, mask,
+    True where X holds a value, lengths, the number of time steps of every sample, y, the label columns of the
+    listfile, and names, the stays. Samples of --sliding_window listfiles are the rows of the stay before their
+    period_length, and max_hours cuts every sample. The parsed episodes are kept in an LRU cache of cache_size
+    stays, so from the second epoch on a dataset that fits is not read again, and the next prefetch_batches
+    batches are built on background threads. With shuffle, the order of epoch e is a permutation seeded with
+    seed + e, so runs are repeatable.
+    """
+    def __init__(self, dataset_dir, listfile=None, batch_size=32, shuffle=False, seed=0, cache_size=1024,
+                 prefetch_batches=2, label_columns=None, channels=None, max_hours=None, eps=1e-6):
+        self.dataset_dir = dataset_dir
+        self.samples = pd.read_csv(listfile or os.path.join(dataset_dir, 'listfile.csv'))
+        self.label_columns = label_columns if label_columns is not None else \
+            [c for c in self.samples.columns if c not in non_label_columns]
+        self.channels = channels if channels is not None else read_channels()
+        # built once, every batch takes its rows
+        self._labels = self.samples[self.label_columns].to_numpy()
+        self._stays = self.samples.stay.to_numpy()
+        self._end_hours = self.samples.period_length.to_numpy(dtype=float) + eps \
+            if 'period_length' in self.samples.columns else np.full(self.samples.shape[0], np.inf)
+        if max_hours is not None:
+            self._end_hours = np.minimum(self._end_hours, max_hours + eps)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.cache_size = cache_size
+        self.prefetch_batches = prefetch_batches
+        self.max_hours = max_hours
+        self.eps = eps
+        self.epoch = 0
+        self.cache_hits, self.cache_misses = 0, 0
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return (self.samples.shape[0] + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        epoch = self.epoch
+        self.epoch += 1
+        return self.batches(epoch)
+
+    def read_episode(self, stay):
+        """ (Hours, values) of a stay, from the cache if it was read before. """
+        with self._lock:
+            if stay in self._cache:
+                self._cache.move_to_end(stay)
+                self.cache_hits += 1
+                return self._cache[stay]
+            self.cache_misses += 1
+        episode = read_timeseries_episode(os.path.join(self.dataset_dir, stay), self.channels)
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[stay] = episode
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return episode
+
+    def read_sample(self, i):
+        """ Values (time, channel) of the i-th sample of the listfile, a view of the cached episode. """
+        hours, values = self.read_episode(self._stays[i])
+        return values[:np.searchsorted(hours, self._end_hours[i], side='left')]
+
+    def make_batch(self, indexes):
+        samples = [self.read_sample(i) for i in indexes]
+        lengths = np.array([sample.shape[0] for sample in samples], dtype=int)
+        X = np.full((len(samples), max(lengths.max(), 1), len(self.channels)), np.nan, dtype=np.float32)
+        for (i, sample) in enumerate(samples):
+            X[i, :sample.shape[0]] = sample
+        mask = ~np.isnan(X)
+        X[~mask] = 0
+        return Batch(X, mask, lengths, self._labels[indexes], self._stays[indexes])
+
+    def batches(self, epoch=0):
+        """ Batches of one epoch, in listfile order or, with shuffle, in the order of the epoch. """
+        order = np.arange(self.samples.shape[0])
+        if self.shuffle:
+            order = np.random.RandomState(self.seed + epoch).permutation(order)
+        batch_indexes = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        for (_, batch) in prefetch(batch_indexes, self.make_batch, depth=self.prefetch_batches):
+            yield batch()
@@ -0,0 +1,113 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from mimic3benchmark.pipeline import default_stages, stage_environment
+
+stage_names = [stage.name for stage in default_stages('', '')]
+
+
+def stage_commands(mimic_dir, data_dir):
+    """ The commands of the README, in order, with their outputs in data_dir. """
+    return [(stage.name, stage.module_args) for stage in default_stages(mimic_dir, data_dir)]
+
+
+def count_rows(path):
+    """ Number of lines after the header, which is the number of rows for tables without multi-line values. """
+    n = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            n += block.count(b'\n')
+    return max(n - 1, 0)
+
+
+def run_stage(name, module_args, log_path, data_dir):
+    """ Runs one stage with data_dir as working directory and returns its wall-clock seconds. """
+    start = time.time()
+    with open(log_path, 'w') as log:
+        code = subprocess.call([sys.executable, '-m'] + module_args, cwd=data_dir, env=stage_environment(),
+                               stdout=log, stderr=subprocess.STDOUT)
+    seconds = time.time() - start
+    if code != 0:
+        raise RuntimeError('Stage {} failed with exit code {}, see {}'.format(name, code, log_path))
+    return seconds
+
+
+def benchmark_scale(work_dir, mimic_dir, stages, label):
+    data_dir = os.path.join(work_dir, 'data')
+    log_dir = os.path.join(work_dir, 'logs')
+    for path in [data_dir, log_dir]:
+        if not os.path.exists(path):
+            os.makedirs(path)
+    chartevents = count_rows(os.path.join(mimic_dir, 'CHARTEVENTS.csv'))
+    results = []
+    for name, module_args in stage_commands(mimic_dir, data_dir):
+        if name not in stages:
+            continue
+        report_fn = os.path.join(log_dir, name + '.json')
+        seconds = run_stage(name, module_args + ['--report', report_fn], os.path.join(log_dir, name + '.txt'),
+                            data_dir)
+        with open(report_fn) as f:
+            peak_rss_mb = json.load(f)['peak_rss_mb']
+        print('{:>10} {:<32} {:10.2f}s {:12.0f} CHARTEVENTS rows/s'.format(label, name, seconds,
+                                                                         chartevents / seconds))
+        results.append({'scale': label, 'stage': name, 'seconds': seconds, 'chartevents_rows': chartevents,
+                        'rows_per_second': chartevents / seconds, 'peak_rss_mb': peak_rss_mb})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time every stage of the benchmark pipeline, optionally on '
+                                                 'synthetic MIMIC-III data of several sizes.')
+    parser.add_argument('work_dir', type=str, help='Directory for the generated data and the stage outputs.')
+    parser.add_argument('--mimic_dir', type=str, default=None,
+                        help='Existing MIMIC-III CSVs to run on. If not given, the data is generated.')
+    parser.add_argument('--n_subjects', type=int, nargs='+', default=[100, 1000],
+                        help='Numbers of synthetic subjects, one run per value.')
+    parser.add_argument('--events_per_stay', type=int, default=500, help='Mean number of CHARTEVENTS per ICU stay.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data.')
+    parser.add_argument('--stages', type=str, nargs='+', default=stage_names, choices=stage_names,
+                        help='Stages to run. Later stages need the outputs of the earlier ones.')
+    parser.add_argument('--output', type=str, default=None,
+                        help='CSV with the timings, {work_dir}/benchmark.csv by default. A JSON copy is written '
+                             'next to it.')
+    args, _ = parser.parse_known_args()
+    work_dir = os.path.abspath(args.work_dir)
+    output = args.output or os.path.join(work_dir, 'benchmark.csv')
+
+    results = []
+    if args.mimic_dir is not None:
+        results += benchmark_scale(os.path.join(work_dir, 'mimic'), os.path.abspath(args.mimic_dir), args.stages,
+                                   'mimic')
+    else:
+        for n_subjects in args.n_subjects:
+            scale_dir = os.path.join(work_dir, 'subjects_{}'.format(n_subjects))
+            mimic_dir = os.path.join(scale_dir, 'mimic')
+            if not os.path.exists(os.path.join(scale_dir, 'logs')):
+                os.makedirs(os.path.join(scale_dir, 'logs'))
+            seconds = run_stage('generate_synthetic_mimic',
+                                ['mimic3benchmark.scripts.generate_synthetic_mimic', mimic_dir,
+                                 '--n_subjects', str(n_subjects), '--events_per_stay', str(args.events_per_stay),
+                                 '--seed', str(args.seed)],
+                                os.path.join(scale_dir, 'logs', 'generate_synthetic_mimic.txt'))
+            print('{:>10} {:<32} {:10.2f}s'.format(n_subjects, 'generate_synthetic_mimic', seconds))
+            results += benchmark_scale(scale_dir, mimic_dir, args.stages, n_subjects)
+
+    results = pd.DataFrame(results)
+    results.to_csv(output, index=False)
+    with open(os.path.splitext(output)[0] + '.json', 'w') as f:
+        json.dump(results.to_dict(orient='records'), f, indent=2)
+    print(results.pivot_table(index='stage', columns='scale', values='seconds', sort=False).to_string())
+    print('Timings written to', output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import os
+
+from mimic3benchmark.event_store import build_event_store
+from mimic3benchmark.instrumentation import add_report_arguments, start_run_report
+from mimic3benchmark.preprocessing import read_itemid_to_variable_map
+from mimic3benchmark.scripts.extract_episodes_from_subjects import default_variable_map_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build an indexed SQLite store of the stays and events of the '
+                                                 'per-subject data for ad-hoc queries.')
+    parser.add_argument('subjects_root_path', type=str, help='Directory containing subject sub-directories.')
+    parser.add_argument('--output', type=str, default=None,
+                        help='SQLite file to write (default: {subjects_root_path}/events.sqlite).')
+    parser.add_argument('--variable_map_file', type=str, default=default_variable_map_file,
+                        help='CSV containing ITEMID-to-VARIABLE map.')
+    add_report_arguments(parser)
+    args, _ = parser.parse_known_args()
+    report = start_run_report('build_event_store', args)
+
+    build_event_store(args.subjects_root_path, args.output or os.path.join(args.subjects_root_path, 'events.sqlite'),
+                      read_itemid_to_variable_map(args.variable_map_file), report=report)
+
+
+if __name__ == '__main__':
+    main()
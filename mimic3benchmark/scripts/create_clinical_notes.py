@@ -1,5 +1,9 @@
 from __future__ import absolute_import
 from __future__ import print_function
+import functools
+import hashlib
+import json
+import multiprocessing
 import os
 import re
 import sys
@@ -9,61 +13,137 @@ sys.path.append('.')
 import pandas as pd
 import argparse
 import csv
+from concurrent.futures import ThreadPoolExecutor
 
+from mimic3benchmark.instrumentation import RunReport, add_report_arguments, start_run_report
 
-def filter_admission_text(notes_df) -> pd.DataFrame:
+
+# bump whenever filtering changes, to invalidate cached notes
+notes_cache_version = 1
+
+admission_sections = {
+    "CHIEF_COMPLAINT": "chief complaint:",
+    "PRESENT_ILLNESS": "present illness:",
+    "MEDICAL_HISTORY": "medical history:",
+    "MEDICATION_ADM": "medications on admission:",
+    "ALLERGIES": "allergies:",
+    "PHYSICAL_EXAM": "physical exam:",
+    "FAMILY_HISTORY": "family history:",
+    "SOCIAL_HISTORY": "social history:"
+}
+
+admission_text_headers = {
+    "CHIEF_COMPLAINT": "CHIEF COMPLAINT: ",
+    "PRESENT_ILLNESS": "PRESENT ILLNESS: ",
+    "MEDICAL_HISTORY": "MEDICAL HISTORY: ",
+    "MEDICATION_ADM": "MEDICATION ON ADMISSION: ",
+    "ALLERGIES": "ALLERGIES: ",
+    "PHYSICAL_EXAM": "PHYSICAL EXAM: ",
+    "FAMILY_HISTORY": "FAMILY HISTORY: ",
+    "SOCIAL_HISTORY": "SOCIAL HISTORY: "
+}
+
+# any phrase that one of the death mention patterns below needs
+death_mention_words = ("expired", "died", "passed away", "deceased", "time of death")
+death_mention_re = re.compile("|".join(death_mention_words), flags=re.IGNORECASE)
+
+death_indication_in_special_sections = re.compile(
+    r"((?:PHYSICAL EXAM|MEDICATION ON ADMISSION):[^\n\n]*?)((?:patient|pt)?\s+(?:had\s|has\s)?(?:expired|died|passed away|deceased))",
+    flags=re.IGNORECASE)
+
+death_indication_in_all_other_sections = re.compile(
+    r"(?:patient|pt)\s+(?:had\s|has\s)?(?:expired|died|passed away|deceased)", flags=re.IGNORECASE)
+
+# obvious death indications, "he expired" does also match "she expired"
+obvious_death_indications = re.compile("he expired|pronounced expired|time of death", flags=re.IGNORECASE)
+
+# case-insensitive section headers, only needed for non-ASCII notes whose lowercase copy may be longer
+section_start_res = {key: re.compile(re.escape(h), flags=re.IGNORECASE) for (key, h) in admission_sections.items()}
+# a section ends before an empty line that is followed by the next "header:" (on text with escaped linebreaks)
+section_end_re = re.compile(r'(?=\\n\\n[^(\\|\d|\.)]+?:)', flags=re.IGNORECASE)
+
+
+def split_admission_sections(text):
     """
-    Filter text information by section and only keep sections that are known on admission time.
+    Admission sections of one note. A section is the text from the first occurrence of its header to the first
+    section end at least one character later, which is what the former per-section regexes extracted. Headers
+    are looked up in one lowercase copy of the note and sections that end at the same place share one search
+    for the end. Missing sections are "".
     """
-    admission_sections = {
-        "CHIEF_COMPLAINT": "chief complaint:",
-        "PRESENT_ILLNESS": "present illness:",
-        "MEDICAL_HISTORY": "medical history:",
-        "MEDICATION_ADM": "medications on admission:",
-        "ALLERGIES": "allergies:",
-        "PHYSICAL_EXAM": "physical exam:",
-        "FAMILY_HISTORY": "family history:",
-        "SOCIAL_HISTORY": "social history:"
-    }
-
     # replace linebreak indicators
-    notes_df['TEXT'] = notes_df['TEXT'].str.replace(r"\n", r"\\n")
+    text = text.replace("\n", "\\n")
+
+    starts = {}
+    if text.isascii():
+        lower_text = text.lower()
+        for key, header in admission_sections.items():
+            i = lower_text.find(header)
+            if i >= 0:
+                starts[key] = i + len(header)
+    else:
+        for key, header_re in section_start_res.items():
+            match = header_re.search(text)
+            if match is not None:
+                starts[key] = match.end()
 
-    # extract each section by regex
-    for key in admission_sections.keys():
-        section = admission_sections[key]
-        notes_df[key] = notes_df.TEXT.str.extract(r'(?i){}(.+?)\\n\\n[^(\\|\d|\.)]+?:'
-                                                  .format(section))
+    sections = dict.fromkeys(admission_sections.keys(), "")
+    end = -1
+    for (start, key) in sorted((start, key) for (key, start) in starts.items()):
+        if end is not None and end < start + 1:
+            match = section_end_re.search(text, start + 1)
+            end = match.start() if match is not None else None
+        if end is not None:
+            sections[key] = text[start:end].replace("\\n", " ").strip()
+    return sections
 
-        notes_df[key] = notes_df[key].str.replace(r'\\n', r' ')
-        notes_df[key] = notes_df[key].str.strip()
-        notes_df[key] = notes_df[key].fillna("")
-        notes_df[notes_df[key].str.startswith("[]")][key] = ""
+
+def _map_chunk(func, items):
+    return [func(item) for item in items]
+
+
+def map_in_chunks(func, items, n_workers=None):
+    """
+    [func(item) for item in items], computed in chunks on a pool of n_workers processes (default: one per CPU).
+    func has to be a module-level function.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    n_chunks = min(len(items), 4 * n_workers) if n_workers > 1 else 1
+    if n_chunks <= 1:
+        return _map_chunk(func, items)
+
+    # chunk i holds items i, i + n_chunks, ...
+    with multiprocessing.Pool(n_workers) as pool:
+        results = pool.map(functools.partial(_map_chunk, func), [items[i::n_chunks] for i in range(n_chunks)])
+    mapped = [None] * len(items)
+    for i, result in enumerate(results):
+        mapped[i::n_chunks] = result
+    return mapped
+
+
+def filter_admission_text(notes_df, n_workers=None) -> pd.DataFrame:
+    """
+    Filter text information by section and only keep sections that are known on admission time.
+    Notes are split into sections in chunks on a pool of n_workers processes (default: one per CPU).
+    """
+    sections = map_in_chunks(split_admission_sections, notes_df.TEXT.tolist(), n_workers=n_workers)
+
+    notes_df = notes_df.copy()
+    for key in admission_sections.keys():
+        notes_df[key] = [note_sections[key] for note_sections in sections]
 
     # filter notes with missing main information
     notes_df = notes_df[(notes_df.CHIEF_COMPLAINT != "") | (notes_df.PRESENT_ILLNESS != "") |
                         (notes_df.MEDICAL_HISTORY != "")]
 
     # add section headers and combine into TEXT_ADMISSION
-    notes_df = notes_df.assign(TEXT="CHIEF COMPLAINT: " + notes_df.CHIEF_COMPLAINT.astype(str)
-                                    + '\n\n' +
-                                    "PRESENT ILLNESS: " + notes_df.PRESENT_ILLNESS.astype(str)
-                                    + '\n\n' +
-                                    "MEDICAL HISTORY: " + notes_df.MEDICAL_HISTORY.astype(str)
-                                    + '\n\n' +
-                                    "MEDICATION ON ADMISSION: " + notes_df.MEDICATION_ADM.astype(str)
-                                    + '\n\n' +
-                                    "ALLERGIES: " + notes_df.ALLERGIES.astype(str)
-                                    + '\n\n' +
-                                    "PHYSICAL EXAM: " + notes_df.PHYSICAL_EXAM.astype(str)
-                                    + '\n\n' +
-                                    "FAMILY HISTORY: " + notes_df.FAMILY_HISTORY.astype(str)
-                                    + '\n\n' +
-                                    "SOCIAL HISTORY: " + notes_df.SOCIAL_HISTORY.astype(str))
-
-    return notes_df
-
-def filter_notes(notes_df: pd.DataFrame, admissions_df: pd.DataFrame, admission_text_only=False) -> pd.DataFrame:
+    text = [
+        '\n\n'.join(header + section for (header, section) in zip(admission_text_headers.values(), sections))
+        for sections in zip(*[notes_df[key] for key in admission_text_headers.keys()])
+    ]
+    return notes_df.assign(TEXT=text)
+
+def filter_notes(notes_df: pd.DataFrame, admissions_df: pd.DataFrame, admission_text_only=False,
+                 n_workers=None) -> pd.DataFrame:
     """
     Keep only Discharge Summaries and filter out Newborn admissions. Replace duplicates and join reports with
     their addendums. If admission_text_only is True, filter all sections that are not known at admission time.
@@ -97,25 +177,103 @@ def filter_notes(notes_df: pd.DataFrame, admissions_df: pd.DataFrame, admission_
 
     if admission_text_only:
         # reduce text to admission-only text
-        notes_df = filter_admission_text(notes_df)
+        notes_df = filter_admission_text(notes_df, n_workers=n_workers)
+
+    return notes_df
+
+def read_valid_admissions(mimic_dir: str) -> pd.DataFrame:
+    """
+    Admissions that are not newborn admissions, with the columns needed to filter and label notes.
+    """
+    admissions_df = pd.read_csv(os.path.join(mimic_dir, "ADMISSIONS.csv"), usecols=["HADM_ID", "ADMISSION_TYPE"])
+    return admissions_df[admissions_df.ADMISSION_TYPE != "NEWBORN"]
 
+
+def read_notes_chunked(mimic_dir: str, hadm_ids, categories=("Discharge summary",), chunksize=20000) -> pd.DataFrame:
+    """
+    Streams NOTEEVENTS.csv and keeps only notes of the given categories that belong to one of hadm_ids.
+    Only the columns used by filter_notes are parsed and only surviving rows are accumulated, so peak memory
+    is about one chunk plus the result instead of the whole table.
+    """
+    columns = ["ROW_ID", "SUBJECT_ID", "HADM_ID", "CHARTDATE", "CATEGORY", "DESCRIPTION", "TEXT"]
+    dtypes = {"ROW_ID": "int64", "SUBJECT_ID": "int64", "HADM_ID": "float64", "CHARTDATE": str,
+              "CATEGORY": str, "DESCRIPTION": str, "TEXT": str}
+    hadm_ids = pd.Index(pd.unique(hadm_ids))
+    kept = []
+    reader = pd.read_csv(os.path.join(mimic_dir, "NOTEEVENTS.csv"), usecols=columns, dtype=dtypes,
+                         chunksize=chunksize)
+    for chunk in reader:
+        chunk = chunk[chunk.CATEGORY.isin(categories) & chunk.HADM_ID.isin(hadm_ids) & chunk.TEXT.notnull()]
+        kept.append(chunk[columns])
+    if not kept:
+        # a header-only file yields no chunks at all
+        return pd.DataFrame({c: pd.Series(dtype=dtypes[c]) for c in columns})
+    return pd.concat(kept, ignore_index=True)
+
+
+def file_fingerprint(path):
+    """ Identifies a version of an input file by its name, size and modification time. """
+    stat = os.stat(path)
+    return [os.path.basename(path), stat.st_size, stat.st_mtime_ns]
+
+
+def notes_cache_key(*parts):
+    return hashlib.sha1(json.dumps([notes_cache_version] + list(parts)).encode()).hexdigest()[:20]
+
+
+def cached_notes(cache_dir, name, key, build):
+    """
+    Notes table built by build(), cached as parquet in cache_dir under the given name and key.
+    cache_dir=None disables the cache.
+    """
+    if not cache_dir:
+        return build()
+    cache_fn = os.path.join(cache_dir, '{}-{}.parquet'.format(name, key))
+    if os.path.exists(cache_fn):
+        try:
+            return pd.read_parquet(cache_fn)
+        except (ImportError, OSError, ValueError) as e:
+            print('Could not read cached {} notes:'.format(name), e)
+
+    notes_df = build()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_fn = '{}.{}.tmp'.format(cache_fn, os.getpid())
+        notes_df.to_parquet(tmp_fn)
+        os.replace(tmp_fn, cache_fn)
+    except (ImportError, OSError) as e:
+        print('Could not cache {} notes:'.format(name), e)
     return notes_df
 
+
 def dataframe_from_csv(path, header=0, index_col=0):
     return pd.read_csv(path, header=header, index_col=index_col, encoding = 'utf-8')
 
-def save_mimic_split_patient_wise(df, label_column, save_dir, task_name, seed, column_list=None):
+def read_split_lookup(split_dir="data", split_names=("train", "val", "test")) -> pd.DataFrame:
+    """
+    Rows of all prebuilt MIMIC patient split listfiles in one frame, with HADM_ID renamed to ID and the split
+    of every row in SPLIT. Rows keep the order of the listfiles.
+    """
+    data_split = []
+    for split_name in split_names:
+        split_df = pd.read_csv(os.path.join(split_dir, "{}_listfile.csv".format(split_name)))
+        data_split.append(split_df.rename(columns={'HADM_ID': 'ID'}).assign(SPLIT=split_name))
+    return pd.concat(data_split, ignore_index=True)
+
+
+def save_mimic_split_patient_wise(df, label_column, save_dir, task_name, seed, column_list=None, split_dir="data",
+                                  output_format="csv"):
     """
     Splits a MIMIC dataframe into 70/10/20 train, val, test with no patient occuring in more than one set.
     Uses ROW_ID as ID column and save to save_path.
+    All notes are routed to their split with one merge against the listfiles in split_dir, and the three splits
+    are written concurrently, either as CSV or as a compressed parquet file (output_format="parquet").
     """
     if column_list is None:
         column_list = ["ID", "TEXT", label_column]
 
     # Load prebuilt MIMIC patient splits
-    data_split = {"train": pd.read_csv("data/train_listfile.csv"),
-                  "val": pd.read_csv("data/val_listfile.csv"),
-                  "test": pd.read_csv("data/test_listfile.csv")}
+    data_split = read_split_lookup(split_dir)
 
     # Use row id as general id and cast to int
     df = df.rename(columns={'HADM_ID': 'ID'})
@@ -123,50 +281,65 @@ def save_mimic_split_patient_wise(df, label_column, save_dir, task_name, seed, c
     # Create path to task data
     os.makedirs(save_dir, exist_ok=True)
 
-    # Save splits to data folder
-    for split_name in ["train", "val", "test"]:
-        # data_split[split_name].SUBJECT_ID = data_split[split_name].SUBJECT_ID.astype(int)
-        data_split[split_name] = data_split[split_name].rename(columns={'HADM_ID': 'ID'})
-        split_set = pd.merge(df, data_split[split_name], how='right', on=['ID']).sample(frac=1, random_state=seed)[column_list]
+    # a left merge from the listfiles keeps their row order, like the former right merge per split
+    routed = pd.merge(data_split, df, how='left', on=['ID'])
+
+    def save_split(split_name):
+        split_set = routed[routed.SPLIT == split_name].sample(frac=1, random_state=seed)[column_list]
         split_set.ID = split_set.ID.astype(int)
-        na_df = split_set.isna()
         split_set = split_set.dropna(subset=['HOSPITAL_EXPIRE_FLAG'])
         split_set.HOSPITAL_EXPIRE_FLAG = split_set.HOSPITAL_EXPIRE_FLAG.astype(int)
         # lower case column names
         split_set.columns = map(str.lower, split_set.columns)
 
-        split_set.to_csv(os.path.join(save_dir, "{}_{}.csv".format(task_name, split_name)),
-                         index=False,
-                         quoting=csv.QUOTE_ALL)
+        if output_format == "parquet":
+            split_set.to_parquet(os.path.join(save_dir, "{}_{}.parquet".format(task_name, split_name)),
+                                 index=False)
+        else:
+            split_set.to_csv(os.path.join(save_dir, "{}_{}.csv".format(task_name, split_name)),
+                             index=False,
+                             quoting=csv.QUOTE_ALL)
 
-def remove_mentions_of_patients_death(df: pd.DataFrame):
+    # Save splits to data folder
+    with ThreadPoolExecutor(3) as pool:
+        list(pool.map(save_split, ["train", "val", "test"]))
+
+def strip_death_mentions(text):
+    """
+    Classifies one note: returns the note unchanged if it does not mention a death, the note without the mentions
+    in PHYSICAL EXAM and MEDICATION ON ADMISSION if it only mentions it there, and None if the note is to be dropped.
+    Only notes that contain one of death_mention_words are matched against the patterns.
+    """
+    if text.isascii():
+        lower_text = text.lower()
+        if not any(word in lower_text for word in death_mention_words):
+            return text
+    elif death_mention_re.search(text) is None:
+        return text
+
+    # first remove mentions in sections PHYSICAL EXAM and MEDICATION ON ADMISSION
+    text = death_indication_in_special_sections.sub(r"\1", text)
+
+    # if mentions can be found in any other section, or there are obvious death indications, remove whole sample
+    if death_indication_in_all_other_sections.search(text) or obvious_death_indications.search(text):
+        return None
+    return text
+
+
+def remove_mentions_of_patients_death(df: pd.DataFrame, n_workers=None):
     """
     Some notes contain mentions of the patient's death such as 'patient deceased'. If these occur in the sections
     PHYSICAL EXAM and MEDICATION ON ADMISSION, we can simply remove the mentions, because the conditions are not
     further elaborated in these sections. However, if the mentions occur in any other section, such as CHIEF COMPLAINT,
     we want to remove the whole sample, because the patient's passing if usually closer described in the text and an
     outcome prediction does not make sense in these cases.
+    Notes are classified in chunks on a pool of n_workers processes (default: one per CPU).
     """
+    texts = map_in_chunks(strip_death_mentions, df.TEXT.tolist(), n_workers=n_workers)
 
-    death_indication_in_special_sections = re.compile(
-        r"((?:PHYSICAL EXAM|MEDICATION ON ADMISSION):[^\n\n]*?)((?:patient|pt)?\s+(?:had\s|has\s)?(?:expired|died|passed away|deceased))",
-        flags=re.IGNORECASE)
-
-    death_indication_in_all_other_sections = re.compile(
-        r"(?:patient|pt)\s+(?:had\s|has\s)?(?:expired|died|passed away|deceased)", flags=re.IGNORECASE)
-
-    # first remove mentions in sections PHYSICAL EXAM and MEDICATION ON ADMISSION
-    df['TEXT'] = df['TEXT'].replace(death_indication_in_special_sections, r"\1", regex=True)
-
-    # if mentions can be found in any other section, remove whole sample
-    df = df[~df['TEXT'].str.contains(death_indication_in_all_other_sections)]
-
-    # remove other samples with obvious death indications
-    df = df[~df['TEXT'].str.contains("he expired", flags=re.IGNORECASE)]  # does also match 'she expired'
-    df = df[~df['TEXT'].str.contains("pronounced expired", flags=re.IGNORECASE)]
-    df = df[~df['TEXT'].str.contains("time of death", flags=re.IGNORECASE)]
-
-    return df
+    df = df.copy()
+    df['TEXT'] = texts
+    return df[df.TEXT.notnull()]
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -175,33 +348,73 @@ def parse_args():
     parser.add_argument('--mortality_list', default=None)
     parser.add_argument('--admission_only', default=False)
     parser.add_argument('--seed', default=123, type=int)
+    parser.add_argument('--chunksize', default=20000, type=int,
+                        help='Number of NOTEEVENTS rows parsed at a time.')
+    parser.add_argument('--n_workers', default=None, type=int,
+                        help='Number of processes that parse the notes, defaults to the number of CPUs.')
+    parser.add_argument('--cache_dir', default='data/cache/clinical_notes',
+                        help='Directory for filtered notes that are reused across runs, empty to disable.')
+    parser.add_argument('--split_dir', default='data',
+                        help='Directory with the train/val/test listfiles that define the patient splits.')
+    parser.add_argument('--output_format', default='csv', choices=['csv', 'parquet'])
+    add_report_arguments(parser)
 
     return parser.parse_args()
 
-def mp_in_hospital_mimic(mimic_dir: str, save_dir: str, seed: int, admission_only: bool, mortality_listfile=None):
+def mp_in_hospital_mimic(mimic_dir: str, save_dir: str, seed: int, admission_only: bool, mortality_listfile=None,
+                         chunksize=20000, n_workers=None, cache_dir=None, split_dir="data", output_format="csv",
+                         report=None):
     """
     Extracts information needed for the task from the MIMIC dataset. Namely "TEXT" column from NOTEEVENTS.csv and
     "HOSPITAL_EXPIRE_FLAG" from ADMISSIONS.csv. Filters specific admission sections for often occuring signal words.
     Creates 70/10/20 split over patients for train/val/test sets.
+    The filtered notes are cached in cache_dir, keyed by the input files and the filter parameters, so runs
+    that only change the seed or the mortality listfile start from the cache.
     """
+    report = report if report is not None else RunReport("create_clinical_notes")
 
     # set task name
     task_name = "MP_IN"
     if admission_only:
         task_name = f"{task_name}_adm"
 
-    # load dataframes
-    mimic_notes = pd.read_csv(os.path.join(mimic_dir, "NOTEEVENTS.csv"))
-    mimic_admissions = pd.read_csv(os.path.join(mimic_dir, "ADMISSIONS.csv"))
+    inputs = [file_fingerprint(os.path.join(mimic_dir, fn)) for fn in ["NOTEEVENTS.csv", "ADMISSIONS.csv"]]
+    notes_key = notes_cache_key(inputs)
+    task_notes_key = notes_cache_key(inputs, bool(admission_only))
+
+    def build_filtered_notes():
+        # load dataframes, keeping only discharge summaries of non-newborn admissions while reading
+        with report.phase("read_notes"):
+            mimic_admissions = read_valid_admissions(mimic_dir)
+            mimic_notes = read_notes_chunked(mimic_dir, mimic_admissions.HADM_ID, chunksize=chunksize)
+        # filter notes
+        with report.phase("filter_notes"):
+            filtered_notes = filter_notes(mimic_notes, mimic_admissions)
+        report.rows("filter_notes", mimic_notes.shape[0], filtered_notes.shape[0])
+        return filtered_notes
+
+    def build_task_notes():
+        mimic_notes = cached_notes(cache_dir, "filtered", notes_key, build_filtered_notes)
+        if admission_only:
+            # reduce text to admission-only text
+            with report.phase("filter_admission_text"):
+                n_notes = mimic_notes.shape[0]
+                mimic_notes = filter_admission_text(mimic_notes, n_workers=n_workers)
+            report.rows("filter_admission_text", n_notes, mimic_notes.shape[0])
+
+        # filter out written out death indications
+        with report.phase("remove_mentions_of_patients_death"):
+            task_notes = remove_mentions_of_patients_death(mimic_notes, n_workers=n_workers)
+        report.rows("remove_mentions_of_patients_death", mimic_notes.shape[0], task_notes.shape[0])
+        return task_notes
+
+    with report.phase("task_notes"):
+        mimic_notes = cached_notes(cache_dir, task_name, task_notes_key, build_task_notes)
+
     if mortality_listfile:
         mortality = pd.read_csv(mortality_listfile)
     else:
         mortality = pd.read_csv('data/mortality_listfile.csv')
-    # filter notes
-    mimic_notes = filter_notes(mimic_notes, mimic_admissions, admission_text_only=admission_only)
-
-    # filter out written out death indications
-    mimic_notes = remove_mentions_of_patients_death(mimic_notes)
 
     # append HOSPITAL_EXPIRE_FLAG to notes
     notes_with_expire_flag = pd.merge(mimic_notes, mortality[["HADM_ID", "y_true"]], how="right",
@@ -210,12 +423,18 @@ def mp_in_hospital_mimic(mimic_dir: str, save_dir: str, seed: int, admission_onl
     notes_with_expire_flag = notes_with_expire_flag.rename(columns={'y_true': 'HOSPITAL_EXPIRE_FLAG'})
 
 
-    save_mimic_split_patient_wise(notes_with_expire_flag,
-                                              label_column='HOSPITAL_EXPIRE_FLAG',
-                                              save_dir=save_dir,
-                                              task_name=task_name,
-                                              seed=seed)
+    with report.phase("save_splits"):
+        save_mimic_split_patient_wise(notes_with_expire_flag,
+                                                  label_column='HOSPITAL_EXPIRE_FLAG',
+                                                  save_dir=save_dir,
+                                                  task_name=task_name,
+                                                  seed=seed,
+                                                  split_dir=split_dir,
+                                                  output_format=output_format)
 
 if __name__ == "__main__":
     args = parse_args()
-    mp_in_hospital_mimic(args.mimic_dir, args.save_dir, args.seed, args.admission_only, args.mortality_list)
+    report = start_run_report("create_clinical_notes", args)
+    mp_in_hospital_mimic(args.mimic_dir, args.save_dir, args.seed, args.admission_only, args.mortality_list,
+                         chunksize=args.chunksize, n_workers=args.n_workers, cache_dir=args.cache_dir,
+                         split_dir=args.split_dir, output_format=args.output_format, report=report)
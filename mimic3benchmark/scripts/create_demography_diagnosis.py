@@ -3,96 +3,202 @@ from __future__ import print_function
 
 import os
 import argparse
+import numpy as np
 import pandas as pd
-import yaml
 import random
-random.seed(49297)
 from tqdm import tqdm
 
+from mimic3benchmark.episode_catalog import build_episode_catalog, episode_order, episode_timeseries_files,\
+    list_episode_timeseries_files, load_episode_catalog, select_episodes, write_episode_catalog
+from mimic3benchmark.hcup_ccs import default_cache_dir, load_hcup_ccs_mapping
+from mimic3benchmark.instrumentation import RunReport, add_report_arguments, start_run_report
+from mimic3benchmark.partitions import add_shard_arguments, check_shard_arguments, list_partition_subjects,\
+    read_partition_manifest, select_shard, shard_path
+from mimic3benchmark.preprocessing import transform_gender
+from mimic3benchmark.sparse_labels import SparseLabels
+from mimic3benchmark.subject import read_episode_labels
+from mimic3benchmark.util import add_prefetch_arguments, prefetch
 
-def process_partition(args, definitions, code_to_group, id_to_group, group_to_id,
-                      partition, eps=1e-6):
+# seed of the shuffle of the train listfiles
+shuffle_seed = 49297
+
+
+def count_events_in_stay(ts_path, los, eps=1e-6):
+    with open(ts_path) as tsfile:
+        ts_lines = tsfile.readlines()
+    ts_lines = ts_lines[1:]
+    event_times = [float(line.split(',')[0]) for line in ts_lines]
+    return sum(1 for t in event_times if -eps < t < los + eps)
+
+
+def process_partition(args, mapping, partition, eps=1e-6, manifest=None, catalog=None, report=None):
+    report = report if report is not None else RunReport('create_demography_diagnosis')
     output_dir = os.path.join(args.output_path, partition)
     if not os.path.exists(output_dir):
         os.mkdir(output_dir)
 
     rows = []
-    patients = list(filter(str.isdigit, os.listdir(os.path.join(args.root_path, partition))))
-    for patient in tqdm(patients, desc='Iterating over patients in {}'.format(partition)):
-        patient_folder = os.path.join(args.root_path, partition, patient)
-        patient_ts_files = list(filter(lambda x: x.find("timeseries") != -1, os.listdir(patient_folder)))
-
-        for ts_filename in patient_ts_files:
-            with open(os.path.join(patient_folder, ts_filename)) as tsfile:
-                lb_filename = ts_filename.replace("_timeseries", "")
-                label_df = pd.read_csv(os.path.join(patient_folder, lb_filename))
-                patient_stays_df = pd.read_csv(patient_folder + "/stays.csv")
-
-                # empty label file
-                if label_df.shape[0] == 0:
-                    continue
-
-                los = 24.0 * label_df.iloc[0]['Length of Stay']  # in hours
-                if pd.isnull(los):
-                    print("\n\t(length of stay is missing)", patient, ts_filename)
-                    continue
-
-                ts_lines = tsfile.readlines()
-                ts_lines = ts_lines[1:]
-                event_times = [float(line.split(',')[0]) for line in ts_lines]
-
-                ts_lines = [line for (line, t) in zip(ts_lines, event_times)
-                            if -eps < t < los + eps]
-
-                # no measurements in ICU
-                if len(ts_lines) == 0:
-                    print("\n\t(no events in ICU) ", patient, ts_filename)
-                    continue
-
-                if los < 48 - eps:
-                    continue
-
-
-                cur_labels = [0 for i in range(len(id_to_group))]
-
-                age = label_df['Age'].iloc[0]
-                gender = label_df['Gender'].iloc[0]
-                male = int(gender == 2)
-                female = int(gender == 1)
-                mortality = label_df['Mortality'].iloc[0]
-                icustay = label_df['Icustay'].iloc[0]
-                diagnoses_df = pd.read_csv(os.path.join(patient_folder, "diagnoses.csv"),
-                                           dtype={"ICD9_CODE": str})
-                diagnoses_df = diagnoses_df[diagnoses_df.ICUSTAY_ID == icustay]
-                for index, row in diagnoses_df.iterrows():
-                    if row['USE_IN_BENCHMARK']:
-                        code = row['ICD9_CODE']
-                        group = code_to_group[code]
-                        group_id = group_to_id[group]
-                        cur_labels[group_id] = 1
-
-                cur_labels = [x for (i, x) in enumerate(cur_labels)
-                              if definitions[id_to_group[i]]['use_in_benchmark']]
-                subject_id, hadm_id = patient_stays_df['SUBJECT_ID'][0], patient_stays_df[patient_stays_df['ICUSTAY_ID'] == label_df['Icustay'].values[0]]['HADM_ID'].values[0]
-                rows.append((hadm_id, mortality, los, age, male, female, cur_labels))
+    patients = select_shard(list_partition_subjects(args.root_path, partition, manifest), args.shard, args.num_shards,
+                            key=lambda x: x[0])
+    if catalog is not None:
+        # episodes with a length of stay of at least 48 hours and events during the stay
+        episode_files = episode_timeseries_files(select_episodes(catalog, min_los_hours=48, eps=eps))
+
+    def read_patient(patient_and_folder):
+        patient, patient_folder = patient_and_folder
+        if catalog is not None:
+            patient_ts_files = episode_files.get(int(patient), [])
+        else:
+            patient_ts_files = list_episode_timeseries_files(patient_folder)
+        if len(patient_ts_files) == 0:
+            return None, None, []
+        label_dfs = [read_episode_labels(os.path.join(patient_folder, ts_filename.replace("_timeseries", "")))
+                     for ts_filename in patient_ts_files]
+        patient_stays_df = pd.read_csv(patient_folder + "/stays.csv")
+        patient_diagnoses_df = pd.read_csv(os.path.join(patient_folder, "diagnoses.csv"), dtype={"ICD9_CODE": str})
+        return patient_stays_df, patient_diagnoses_df, list(zip(patient_ts_files, label_dfs))
+
+    n_episodes = 0
+    patient_data = prefetch(patients, read_patient, depth=args.prefetch)
+    for ((patient, patient_folder), data) in report.timed(tqdm(patient_data, total=len(patients),
+                                                               desc='Iterating over patients in {}'.format(partition)),
+                                                          name='patients_{}'.format(partition), key=lambda x: x[0][0]):
+        patient_stays_df, patient_diagnoses_df, episodes = data()
+        n_episodes += len(episodes)
+
+        for (ts_filename, label_df) in episodes:
+            # empty label file
+            if label_df.shape[0] == 0:
+                continue
+
+            los = 24.0 * label_df.iloc[0]['Length of Stay']  # in hours
+            if pd.isnull(los):
+                print("\n\t(length of stay is missing)", patient, ts_filename)
+                continue
+
+            # no measurements in ICU, the catalog only lists episodes with measurements
+            if catalog is None and count_events_in_stay(os.path.join(patient_folder, ts_filename), los, eps) == 0:
+                print("\n\t(no events in ICU) ", patient, ts_filename)
+                continue
 
+            if los < 48 - eps:
+                continue
+
+
+            cur_labels = np.zeros(len(mapping.groups), dtype=int)
+
+            age = label_df['Age'].iloc[0]
+            gender = label_df['Gender'].iloc[0]
+            male = int(gender == 2)
+            female = int(gender == 1)
+            mortality = label_df['Mortality'].iloc[0]
+            icustay = label_df['Icustay'].iloc[0]
+            diagnoses_df = patient_diagnoses_df[patient_diagnoses_df.ICUSTAY_ID == icustay]
+            group_ids = mapping.lookup(diagnoses_df.ICD9_CODE[diagnoses_df.USE_IN_BENCHMARK.astype(bool)])
+            cur_labels[group_ids[group_ids >= 0]] = 1
+
+            cur_labels = list(cur_labels[mapping.use_in_benchmark])
+            subject_id, hadm_id = patient_stays_df['SUBJECT_ID'][0], patient_stays_df[patient_stays_df['ICUSTAY_ID'] == label_df['Icustay'].values[0]]['HADM_ID'].values[0]
+            rows.append((hadm_id, mortality, los, age, male, female, cur_labels))
+
+    report.rows('episodes_{}'.format(partition), n_episodes, len(rows))
+    write_listfile(output_dir, rows, partition, mapping.groups_in_benchmark(),
+                   shard_path("listfile.csv", args.shard, args.num_shards))
+
+
+def write_listfile(output_dir, rows, partition, codes_in_benchmark, fn="listfile.csv"):
     print("Number of created samples:", len(rows))
     if partition == "train":
-        random.shuffle(rows)
+        random.Random(shuffle_seed).shuffle(rows)
     if partition == "train":
         rows = sorted(rows)
 
-    codes_in_benchmark = [x for x in id_to_group
-                          if definitions[x]['use_in_benchmark']]
-
     listfile_header = "hadm_id,mortality,period_length,age,male,female," + ",".join(codes_in_benchmark)
-    with open(os.path.join(output_dir, "listfile.csv"), "w") as listfile:
+    with open(os.path.join(output_dir, fn), "w") as listfile:
         listfile.write(listfile_header + "\n")
         for (hadm_id, mortality, t, age, male, female, y) in rows:
             labels = ','.join(map(str, y))
             listfile.write('{},,{},{:.6f},{}, {}, {}, {}\n'.format(hadm_id, mortality, t, age, male, female, labels))
 
 
+def make_cohort_table(stays, phenotype_labels, codes_in_benchmark):
+    """
+    Per-stay demographics and phenotype labels from a stays table like the one of all_stays.csv and the
+    SparseLabels of its stays.
+    """
+    stays = stays[['ICUSTAY_ID', 'HADM_ID', 'AGE', 'GENDER', 'MORTALITY']].copy()
+    labels = phenotype_labels.reindex(index=stays.ICUSTAY_ID, columns=codes_in_benchmark)
+    stays['LABELS'] = labels.matrix.toarray().astype(int).tolist()
+    return stays
+
+
+def read_cohort_table(root_path, codes_in_benchmark):
+    """
+    Per-stay demographics and phenotype labels for the whole cohort, from the tables written by extract_subjects.
+    phenotype_labels.csv (written without index) has one row per stay in ICUSTAY_ID order and only the groups
+    that occur in the data; phenotype_labels.npz carries both indexes and is used when present.
+    """
+    # the ages are read back to the floats that were written, like those of the episode files
+    stays = pd.read_csv(os.path.join(root_path, 'all_stays.csv'),
+                        usecols=['ICUSTAY_ID', 'HADM_ID', 'AGE', 'GENDER', 'MORTALITY'], float_precision='round_trip')
+    labels_npz = os.path.join(root_path, 'phenotype_labels.npz')
+    if os.path.exists(labels_npz):
+        return make_cohort_table(stays, SparseLabels.load_npz(labels_npz), codes_in_benchmark)
+    labels = pd.read_csv(os.path.join(root_path, 'phenotype_labels.csv'))
+    labels.index = stays.ICUSTAY_ID.sort_values().values
+    labels = labels.reindex(columns=codes_in_benchmark, fill_value=0).astype(int)
+    stays['LABELS'] = labels.reindex(stays.ICUSTAY_ID, fill_value=0).values.tolist()
+    return stays
+
+
+def process_partition_vectorized(root_path, output_path, codes_in_benchmark, cohort, catalog, partition, eps=1e-6,
+                                 manifest=None, shard=None, num_shards=None, report=None):
+    """
+    Writes the listfile of a partition from the cohort table of read_cohort_table and the episode catalog,
+    without reading per-patient files.
+    """
+    report = report if report is not None else RunReport('create_demography_diagnosis')
+    output_dir = os.path.join(output_path, partition)
+    if not os.path.exists(output_dir):
+        os.mkdir(output_dir)
+
+    patients = set(int(patient) for (patient, _) in select_shard(list_partition_subjects(root_path, partition,
+                                                                                         manifest),
+                                                                 shard, num_shards, key=lambda x: x[0]))
+    partition_catalog = catalog[catalog.SUBJECT_ID.isin(patients)]
+    episodes = select_episodes(partition_catalog, min_los_hours=48, eps=eps)
+    episodes = episodes[['ICUSTAY_ID', 'LOS']].merge(cohort, on='ICUSTAY_ID', how='inner')
+    report.rows('episodes_{}'.format(partition), partition_catalog.shape[0], episodes.shape[0])
+
+    gender = transform_gender(episodes.GENDER)['Gender']
+    rows = list(zip(episodes.HADM_ID, episodes.MORTALITY, 24.0 * episodes.LOS, episodes.AGE,
+                    (gender == 2).astype(int), (gender == 1).astype(int), episodes.LABELS))
+    write_listfile(output_dir, rows, partition, codes_in_benchmark, shard_path("listfile.csv", shard, num_shards))
+
+
+def merge_listfiles(output_dir, partition, fns, catalog):
+    """
+    Writes {output_dir}/listfile.csv from the listfiles of all shards of a partition, in the order of a run over
+    all subjects: train sorted by HADM_ID like write_listfile, test in subject and episode order of the catalog.
+    """
+    header, lines = None, []
+    for fn in fns:
+        with open(fn) as listfile:
+            shard_lines = listfile.readlines()
+        header = shard_lines[0]
+        lines += shard_lines[1:]
+    if partition == "train":
+        lines = sorted(lines, key=lambda line: int(line[:line.find(',')]))
+    else:
+        order = episode_order(catalog)
+        lines = sorted(lines, key=lambda line: order[int(line[:line.find(',')])])
+
+    with open(os.path.join(output_dir, "listfile.csv"), "w") as listfile:
+        listfile.write(header)
+        listfile.writelines(lines)
+    return len(lines)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Create data for phenotype classification task.")
     parser.add_argument('root_path', type=str, help="Path to root folder containing train and test sets.")
@@ -100,28 +206,51 @@ def main():
     parser.add_argument('--phenotype_definitions', '-p', type=str,
                         default=os.path.join(os.path.dirname(__file__), '../resources/hcup_ccs_2015_definitions.yaml'),
                         help='YAML file with phenotype definitions.')
+    parser.add_argument('--hcup_cache_dir', type=str, default=default_cache_dir,
+                        help='Directory where the compiled phenotype definitions are cached, empty to disable.')
+    parser.add_argument('--vectorized', action='store_true',
+                        help='Build the listfiles from all_stays.csv, phenotype_labels.csv and the episode catalog '
+                             'instead of reading per-patient files.')
+    parser.add_argument('--episode_catalog', type=str, default=None,
+                        help='Episode catalog written by extract_episodes_from_subjects; only eligible episodes '
+                             'are opened. By default {root_path}/episode_catalog.csv is used if it exists and still '
+                             'matches the episode files, and --vectorized rebuilds it otherwise.')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='Partition manifest written by split_train_and_test --manifest; subjects are then read '
+                             'from root_path instead of its train/test sub-directories.')
+    add_shard_arguments(parser)
+    add_prefetch_arguments(parser)
+    add_report_arguments(parser)
     args, _ = parser.parse_known_args()
+    check_shard_arguments(parser, args)
+    report = start_run_report('create_demography_diagnosis', args)
 
-    with open(args.phenotype_definitions) as definitions_file:
-        definitions = yaml.safe_load(definitions_file)
-
-    code_to_group = {}
-    for group in definitions:
-        codes = definitions[group]['codes']
-        for code in codes:
-            if code not in code_to_group:
-                code_to_group[code] = group
-            else:
-                assert code_to_group[code] == group
-
-    id_to_group = sorted(definitions.keys())
-    group_to_id = dict((x, i) for (i, x) in enumerate(id_to_group))
+    mapping = load_hcup_ccs_mapping(args.phenotype_definitions, args.hcup_cache_dir or None)
 
     if not os.path.exists(args.output_path):
         os.makedirs(args.output_path)
+    manifest = read_partition_manifest(args.manifest) if args.manifest else None
+
+    catalog = load_episode_catalog(args.root_path, args.episode_catalog)
+    if args.vectorized:
+        codes_in_benchmark = mapping.groups_in_benchmark()
+        cohort = read_cohort_table(args.root_path, codes_in_benchmark)
+        if catalog is None:
+            catalog_path = os.path.join(args.root_path, 'episode_catalog.csv')
+            print("No current episode catalog, building it from the episode files:", catalog_path)
+            catalog = build_episode_catalog(args.root_path)
+            write_episode_catalog(catalog, catalog_path)
+        for partition in ["test", "train"]:
+            with report.phase(partition):
+                process_partition_vectorized(args.root_path, args.output_path, codes_in_benchmark, cohort, catalog,
+                                             partition, manifest=manifest, shard=args.shard,
+                                             num_shards=args.num_shards, report=report)
+        return
 
-    process_partition(args, definitions, code_to_group, id_to_group, group_to_id, "test")
-    process_partition(args, definitions, code_to_group, id_to_group, group_to_id, "train")
+    with report.phase('test'):
+        process_partition(args, mapping, "test", manifest=manifest, catalog=catalog, report=report)
+    with report.phase('train'):
+        process_partition(args, mapping, "train", manifest=manifest, catalog=catalog, report=report)
 
 
 if __name__ == '__main__':
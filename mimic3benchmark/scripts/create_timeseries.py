@@ -4,100 +4,358 @@ from __future__ import print_function
 import json
 import os
 import argparse
+import numpy as np
 import pandas as pd
 import random
-random.seed(49297)
 from tqdm import tqdm
 
+from mimic3benchmark.episode_catalog import episode_timeseries_files, episode_timeseries_re,\
+    list_episode_timeseries_files, load_episode_catalog, select_episodes
+from mimic3benchmark.instrumentation import RunReport, add_report_arguments, start_run_report
+from mimic3benchmark.partitions import add_shard_arguments, check_shard_arguments, list_partition_subjects,\
+    read_partition_manifest, select_shard, shard_path
+from mimic3benchmark.subject import read_episode_labels, read_episode_timeseries
+from mimic3benchmark.util import add_prefetch_arguments, parse_float, parse_times, prefetch
 
-def process_partition(args, partition, eps=1e-6, n_hours=48):
-    output_dir = os.path.join(args.output_path, partition)
-    if not os.path.exists(output_dir):
-        os.mkdir(output_dir)
+# seed of the shuffle of the train listfiles
+shuffle_seed = 49297
 
-    xy_pairs = []
-    patients = list(filter(str.isdigit, os.listdir(os.path.join(args.root_path, partition))))
-    mp_listfile = pd.DataFrame(columns=["SUBJECT_ID", "HADM_ID"])
 
-    with open("mimic3benchmark/resources/channel_info.json") as channel_info_file:
+def read_channel_config():
+    resources = os.path.join(os.path.dirname(__file__), '../resources')
+    with open(os.path.join(resources, 'channel_info.json')) as channel_info_file:
         channel_info = json.loads(channel_info_file.read())
-    with open("mimic3benchmark/resources/discretizer_config.json") as discretizer_config_file:
+    with open(os.path.join(resources, 'discretizer_config.json')) as discretizer_config_file:
         discretizer_config = json.loads(discretizer_config_file.read())
+    return channel_info, discretizer_config
 
 
+def make_timeseries_sample(patient, ts_filename, label_df, read_timeseries, patient_stays_df, channel_info,
+                           discretizer_config, eps=1e-6, n_hours=48):
+    """
+    In-hospital mortality sample of one episode: the first n_hours of its time series with categorical channels
+    mapped to their codes, its mortality label, SUBJECT_ID and HADM_ID. read_timeseries() loads the time series,
+    it is only called for episodes that are long enough. None if the episode is not a sample.
+    """
+    # empty label file
+    if label_df.shape[0] == 0:
+        return None
 
-    for patient in tqdm(patients, desc='Iterating over patients in {}'.format(partition)):
-        patient_folder = os.path.join(args.root_path, partition, patient)
-        patient_ts_files = list(filter(lambda x: x.find("timeseries") != -1, os.listdir(patient_folder)))
-        patient_stays_df = pd.read_csv(patient_folder+"/stays.csv")
+    mortality = int(label_df.iloc[0]["Mortality"])
+    los = 24.0 * label_df.iloc[0]['Length of Stay']  # in hours
+    if pd.isnull(los):
+        print("\n\t(length of stay is missing)", patient, ts_filename)
+        return None
 
-        for ts_filename in patient_ts_files:
-            with open(os.path.join(patient_folder, ts_filename)) as tsfile:
-                lb_filename = ts_filename.replace("_timeseries", "") # the name of episode data (for example episode1.csv)
-                label_df = pd.read_csv(os.path.join(patient_folder, lb_filename))
-                # empty label file
-                if label_df.shape[0] == 0:
-                    continue
+    if los < n_hours - eps:
+        return None
 
-                mortality = int(label_df.iloc[0]["Mortality"])
-                los = 24.0 * label_df.iloc[0]['Length of Stay']  # in hours
-                if pd.isnull(los):
-                    print("\n\t(length of stay is missing)", patient, ts_filename)
-                    continue
+    ts_df = read_timeseries()
+    ts_df = typed_channels(ts_df[(ts_df['Hours'] > -eps) & (ts_df['Hours'] < n_hours + eps)], discretizer_config)
 
-                if los < n_hours - eps:
-                    continue
+    event_times = ts_df['Hours'].to_numpy()
 
-                ts_df = pd.read_csv(os.path.join(patient_folder, ts_filename))
-                ts_df = ts_df[(ts_df['Hours'] > -eps) & (ts_df['Hours'] < n_hours + eps)]
+    # no measurements in ICU
+    if len(event_times) == 0:
+        print("\n\t(no events in ICU) ", patient, ts_filename)
+        return None
 
-                event_times = ts_df['Hours'].to_numpy()
+    map_categorical_channels(ts_df, channel_info, discretizer_config)
 
-                # no measurements in ICU
-                if len(event_times) == 0:
-                    print("\n\t(no events in ICU) ", patient, ts_filename)
-                    continue
+    subject_id, hadm_id = patient_stays_df['SUBJECT_ID'].iloc[0], patient_stays_df[patient_stays_df['ICUSTAY_ID'] == label_df['Icustay'].values[0]]['HADM_ID'].values[0]
+    ts_df['HADM_ID'] = hadm_id
+    return ts_df, mortality, subject_id, hadm_id
 
-                for col in ts_df.columns:
-                    if col == 'Hours':
-                        continue
-                    if discretizer_config['is_categorical_channel'][col]:
-                        not_na_indice = ts_df[col].notna()
-                        ts_df[col][not_na_indice] = ts_df[col][not_na_indice].map(channel_info[col]['values'])
 
+def typed_channels(ts_df, discretizer_config):
+    """
+    The time series with the values of its channels in the same types however it was read or built: text for
+    the categorical channels, which is what channel_info maps to codes, and floats for the other channels,
+    where values that are not numbers are kept as they are. Every distinct value of a channel is converted once.
+    """
+    columns = {}
+    for col in ts_df.columns:
+        if col == 'Hours':
+            continue
+        codes, uniques = pd.factorize(ts_df[col])
+        if discretizer_config['is_categorical_channel'][col]:
+            values = np.array([str(u) for u in uniques] + [np.nan], dtype=object)
+        else:
+            values = np.array([parse_float(u) for u in uniques] + [np.nan], dtype=float)
+            if np.isnan(values[:-1]).any():
+                values = np.array([u if np.isnan(x) else x for (u, x) in zip(uniques, values)] + [np.nan],
+                                  dtype=object)
+        # code -1 (missing values) picks the NaN at the end
+        columns[col] = values[codes]
+    return ts_df.assign(**columns)
 
 
-                output_ts_filename = patient + "_" + ts_filename
+def map_categorical_channels(ts_df, channel_info, discretizer_config):
+    for col in ts_df.columns:
+        if col == 'Hours':
+            continue
+        if discretizer_config['is_categorical_channel'][col]:
+            not_na_indice = ts_df[col].notna()
+            ts_df[col][not_na_indice] = ts_df[col][not_na_indice].map(channel_info[col]['values'])
+
+
+def episode_window_index(ts_df, times):
+    """
+    For every one of the sorted prediction times, the number of values of each channel with Hours < time. The
+    per-row cumulative counts of the episode are looked up once for all times, with one vectorized binary search
+    over its Hours (sorted, as extract_episodes_from_subjects writes them), so that any window between two
+    prediction times is counted in O(1) (see window_observations).
+    """
+    hours = ts_df['Hours'].to_numpy()
+    observed = ts_df.drop('Hours', axis=1).notna().to_numpy()
+    counts = np.zeros((observed.shape[0] + 1, observed.shape[1]), dtype=int)
+    np.cumsum(observed, axis=0, out=counts[1:])
+    return counts[np.searchsorted(hours, times, side='left')]
 
-                subject_id, hadm_id = patient_stays_df['SUBJECT_ID'][0], patient_stays_df[patient_stays_df['ICUSTAY_ID'] == label_df['Icustay'].values[0]]['HADM_ID'].values[0]
-                ts_df['HADM_ID'] = hadm_id
-                ts_df.to_csv(os.path.join(output_dir, output_ts_filename))
-                mp_listfile = mp_listfile.append({'SUBJECT_ID': subject_id, 'HADM_ID': hadm_id}, ignore_index=True)
-                xy_pairs.append((output_ts_filename, mortality, hadm_id))
 
+def window_observations(index, start, end):
+    """
+    Number of values of each channel with times[start] <= Hours < times[end], for positions start <= end in the
+    prediction times of the index, or with Hours < times[end] if start is None.
+    """
+    return index[end] if start is None else index[end] - index[start]
+
+
+def make_window_samples(patient, ts_filename, label_df, read_timeseries, patient_stays_df, channel_info,
+                        discretizer_config, horizons=(24,), sample_rate=1.0, shortest_length=4.0, min_channels=1,
+                        eps=1e-6):
+    """
+    Decompensation and length-of-stay samples of one episode at every sample_rate hours after the first
+    shortest_length hours of the stay, up to the end of the stay or the death of the patient: the time series of
+    the whole stay (written once, the samples only point into it) and one (period length, remaining length of
+    stay, died within each of the horizons) row per prediction time with at least min_channels channels
+    observed before it. None if the episode has no samples.
+    """
+    if label_df.shape[0] == 0:
+        return None
+
+    mortality = int(label_df.iloc[0]["Mortality"])
+    los = 24.0 * label_df.iloc[0]['Length of Stay']  # in hours
+    if pd.isnull(los):
+        print("\n\t(length of stay is missing)", patient, ts_filename)
+        return None
+
+    stay = patient_stays_df[patient_stays_df['ICUSTAY_ID'] == label_df['Icustay'].values[0]]
+    intime, deathtime = parse_times(stay['INTIME']).iloc[0], parse_times(stay['DEATHTIME']).iloc[0]
+    lived_time = np.inf if pd.isnull(deathtime) else (deathtime - intime) / pd.Timedelta(hours=1)
+
+    ts_df = read_timeseries()
+    ts_df = typed_channels(ts_df[(ts_df['Hours'] > -eps) & (ts_df['Hours'] < los + eps)], discretizer_config)
+    if ts_df.shape[0] == 0:
+        print("\n\t(no events in ICU) ", patient, ts_filename)
+        return None
+
+    times = np.arange(0.0, min(los, lived_time) + eps, sample_rate)
+    index = episode_window_index(ts_df, times)
+    rows = []
+    for (i, t) in enumerate(times):
+        if t <= shortest_length:
+            continue
+        if (window_observations(index, None, i) > 0).sum() < min_channels:
+            continue
+        rows.append((t, los - t) + tuple(int(mortality == 1 and lived_time - t < horizon) for horizon in horizons))
+    if len(rows) == 0:
+        return None
+
+    map_categorical_channels(ts_df, channel_info, discretizer_config)
+    subject_id, hadm_id = patient_stays_df['SUBJECT_ID'].iloc[0], stay['HADM_ID'].values[0]
+    ts_df['HADM_ID'] = hadm_id
+    return ts_df, rows, subject_id, hadm_id
+
+
+def write_timeseries_listfile(output_dir, xy_pairs, partition, fn="listfile.csv"):
     print("Number of created samples:", len(xy_pairs))
     if partition == "train":
-        random.shuffle(xy_pairs)
+        random.Random(shuffle_seed).shuffle(xy_pairs)
     if partition == "test":
         xy_pairs = sorted(xy_pairs)
 
-    with open(os.path.join(output_dir, "listfile.csv"), "w") as listfile:
+    with open(os.path.join(output_dir, fn), "w") as listfile:
         listfile.write('stay,y_true,HADM_ID\n')
         for (x, y, z) in xy_pairs:
             listfile.write('{},{:d},{:d}\n'.format(x, y, z))
-    mp_listfile.to_csv('./mp_listfile.csv')
+
+
+def write_window_listfile(output_dir, rows, partition, horizons, fn="listfile.csv"):
+    """ Listfile of make_window_samples rows, (stay, period length, remaining LOS, labels..., HADM_ID). """
+    print("Number of created samples:", len(rows))
+    if partition == "train":
+        random.Random(shuffle_seed).shuffle(rows)
+    if partition == "test":
+        rows = sorted(rows)
+
+    with open(os.path.join(output_dir, fn), "w") as listfile:
+        listfile.write(','.join(['stay', 'period_length', 'y_los'] +
+                                ['y_decompensation_{:g}h'.format(h) for h in horizons] + ['HADM_ID']) + '\n')
+        for row in rows:
+            listfile.write('{},{:.6f},{:.6f},'.format(*row[:3]) + ''.join('{:d},'.format(y) for y in row[3:-1]) +
+                           '{:d}\n'.format(row[-1]))
+
+
+def sample_order(stay):
+    """ (SUBJECT_ID, episode) of a sample file name like 123_episode1_timeseries.csv. """
+    patient, ts_filename = stay.split('_', 1)
+    return int(patient), int(episode_timeseries_re.match(ts_filename).group(1))
+
+
+def merge_timeseries_listfiles(output_dir, partition, fns):
+    """
+    Writes {output_dir}/listfile.csv from the listfiles of all shards of a partition, in the order of a run
+    over all subjects: the samples in subject, episode and prediction time order, shuffled like
+    write_timeseries_listfile.
+    """
+    header, lines = None, []
+    for fn in fns:
+        with open(fn) as listfile:
+            shard_lines = listfile.readlines()
+        header = shard_lines[0]
+        lines += shard_lines[1:]
+    lines = sorted(lines, key=lambda line: sample_order(line[:line.find(',')]) + (float(line.split(',')[1]),))
+    if partition == "train":
+        random.Random(shuffle_seed).shuffle(lines)
+    if partition == "test":
+        lines = sorted(lines, key=lambda line: line[:line.find(',')])
+
+    with open(os.path.join(output_dir, "listfile.csv"), "w") as listfile:
+        listfile.write(header)
+        listfile.writelines(lines)
+    return len(lines)
+
+
+def process_partition(args, partition, eps=1e-6, n_hours=48, manifest=None, catalog=None, report=None):
+    report = report if report is not None else RunReport('create_timeseries')
+    output_dir = os.path.join(args.output_path, partition)
+    if not os.path.exists(output_dir):
+        os.mkdir(output_dir)
+
+    windows = getattr(args, 'sliding_window', False)
+    xy_pairs = []
+    patients = select_shard(list_partition_subjects(args.root_path, partition, manifest), args.shard, args.num_shards,
+                            key=lambda x: x[0])
+    if catalog is not None and windows:
+        # episodes long enough for a sample with events during the stay
+        episode_files = episode_timeseries_files(select_episodes(catalog, min_los_hours=args.shortest_length,
+                                                                 window_hours=None, eps=eps))
+    elif catalog is not None:
+        # episodes with a length of stay of at least n_hours and events in the first n_hours
+        episode_files = episode_timeseries_files(select_episodes(catalog, min_los_hours=n_hours,
+                                                                 window_hours=n_hours, eps=eps))
+    mp_listfile = pd.DataFrame(columns=["SUBJECT_ID", "HADM_ID"])
+    channel_info, discretizer_config = read_channel_config()
+
+    def read_patient(patient_and_folder):
+        patient, patient_folder = patient_and_folder
+        if catalog is not None:
+            patient_ts_files = episode_files.get(int(patient), [])
+            if len(patient_ts_files) == 0:
+                return None
+        else:
+            patient_ts_files = list_episode_timeseries_files(patient_folder)
+        patient_stays_df = pd.read_csv(patient_folder+"/stays.csv")
+        episodes = []
+        for ts_filename in patient_ts_files:
+            lb_filename = ts_filename.replace("_timeseries", "") # the name of episode data (for example episode1.csv)
+            label_df = read_episode_labels(os.path.join(patient_folder, lb_filename))
+            # the time series of the episodes in the catalog are all used, read them ahead as well
+            ts_df = read_episode_timeseries(os.path.join(patient_folder, ts_filename)) if catalog is not None else None
+            episodes.append((ts_filename, label_df, ts_df))
+        return patient_stays_df, episodes
+
+    n_episodes, n_stays = 0, 0
+    patient_data = prefetch(patients, read_patient, depth=args.prefetch)
+    for ((patient, patient_folder), data) in report.timed(tqdm(patient_data, total=len(patients),
+                                                               desc='Iterating over patients in {}'.format(partition)),
+                                                          name='patients_{}'.format(partition), key=lambda x: x[0][0]):
+        data = data()
+        if data is None:
+            continue
+        patient_stays_df, episodes = data
+
+        n_episodes += len(episodes)
+        for (ts_filename, label_df, ts_df) in episodes:
+            if ts_df is not None:
+                read_timeseries = lambda ts_df=ts_df: ts_df
+            else:
+                read_timeseries = lambda ts_filename=ts_filename: read_episode_timeseries(os.path.join(patient_folder,
+                                                                                                      ts_filename))
+            output_ts_filename = patient + "_" + ts_filename
+            if windows:
+                sample = make_window_samples(patient, ts_filename, label_df, read_timeseries, patient_stays_df,
+                                             channel_info, discretizer_config, horizons=args.horizons,
+                                             sample_rate=args.sample_rate, shortest_length=args.shortest_length,
+                                             min_channels=args.min_channels, eps=eps)
+                if sample is None:
+                    continue
+                ts_df, rows, _, hadm_id = sample
+                ts_df.to_csv(os.path.join(output_dir, output_ts_filename))
+                n_stays += 1
+                xy_pairs += [(output_ts_filename,) + row + (hadm_id,) for row in rows]
+                continue
+
+            sample = make_timeseries_sample(patient, ts_filename, label_df, read_timeseries, patient_stays_df,
+                                            channel_info, discretizer_config, eps=eps, n_hours=n_hours)
+            if sample is None:
+                continue
+            ts_df, mortality, subject_id, hadm_id = sample
+
+            ts_df.to_csv(os.path.join(output_dir, output_ts_filename))
+            mp_listfile = mp_listfile.append({'SUBJECT_ID': subject_id, 'HADM_ID': hadm_id}, ignore_index=True)
+            xy_pairs.append((output_ts_filename, mortality, hadm_id))
+
+    if windows:
+        report.rows('episodes_{}'.format(partition), n_episodes, n_stays)
+        report.count('samples_{}'.format(partition), len(xy_pairs))
+        write_window_listfile(output_dir, xy_pairs, partition, args.horizons,
+                              shard_path("listfile.csv", args.shard, args.num_shards))
+        return
+    report.rows('episodes_{}'.format(partition), n_episodes, len(xy_pairs))
+    write_timeseries_listfile(output_dir, xy_pairs, partition, shard_path("listfile.csv", args.shard, args.num_shards))
+    mp_listfile.to_csv(shard_path('./mp_listfile.csv', args.shard, args.num_shards))
 
 def main():
     parser = argparse.ArgumentParser(description="Create data for in-hospital mortality prediction task.")
     parser.add_argument('root_path', type=str, help="Path to root folder containing train and test sets.")
     parser.add_argument('output_path', type=str, help="Directory where the created data should be stored.")
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='Partition manifest written by split_train_and_test --manifest; subjects are then read '
+                             'from root_path instead of its train/test sub-directories.')
+    parser.add_argument('--episode_catalog', type=str, default=None,
+                        help='Episode catalog written by extract_episodes_from_subjects; only eligible episodes '
+                             'are opened. By default {root_path}/episode_catalog.csv is used if it exists and still '
+                             'matches the episode files.')
+    parser.add_argument('--sliding_window', action='store_true',
+                        help='Create decompensation and length-of-stay samples at every --sample_rate hours of the '
+                             'stays instead of the in-hospital mortality samples; the time series of each stay is '
+                             'written once and the listfile has one row per prediction time.')
+    parser.add_argument('--horizons', type=float, nargs='+', default=[24.0],
+                        help='Decompensation horizons in hours (--sliding_window).')
+    parser.add_argument('--sample_rate', type=float, default=1.0,
+                        help='Hours between prediction times (--sliding_window).')
+    parser.add_argument('--shortest_length', type=float, default=4.0,
+                        help='No prediction times in the first hours of a stay (--sliding_window).')
+    parser.add_argument('--min_channels', type=int, default=1,
+                        help='Channels that must have a value before a prediction time (--sliding_window).')
+    add_shard_arguments(parser)
+    add_prefetch_arguments(parser)
+    add_report_arguments(parser)
     args, _ = parser.parse_known_args()
+    check_shard_arguments(parser, args)
+    report = start_run_report('create_timeseries', args)
 
     if not os.path.exists(args.output_path):
         os.makedirs(args.output_path)
 
-    process_partition(args, "test")
-    process_partition(args, "train")
+    manifest = read_partition_manifest(args.manifest) if args.manifest else None
+    catalog = load_episode_catalog(args.root_path, args.episode_catalog)
+    with report.phase('test'):
+        process_partition(args, "test", manifest=manifest, catalog=catalog, report=report)
+    with report.phase('train'):
+        process_partition(args, "train", manifest=manifest, catalog=catalog, report=report)
 
 
 if __name__ == '__main__':
@@ -4,57 +4,50 @@ from __future__ import print_function
 import argparse
 import os
 import sys
+import numpy as np
+import pandas as pd
 from tqdm import tqdm
 
+from mimic3benchmark.episode_catalog import summarize_episode, write_episode_catalog, catalog_columns
+from mimic3benchmark.instrumentation import RunReport, add_report_arguments, start_run_report
+from mimic3benchmark.partitions import add_shard_arguments, check_shard_arguments, select_shard, shard_path
 from mimic3benchmark.subject import read_stays, read_diagnoses, read_events, get_events_for_stay,\
     add_hours_elpased_to_events
 from mimic3benchmark.subject import convert_events_to_timeseries, get_first_valid_from_timeseries
 from mimic3benchmark.preprocessing import read_itemid_to_variable_map, map_itemids_to_variables, clean_events
 from mimic3benchmark.preprocessing import assemble_episodic_data
+from mimic3benchmark.util import add_prefetch_arguments, prefetch
 
+default_variable_map_file = os.path.join(os.path.dirname(__file__), '../resources/itemid_to_variable_map.csv')
+default_reference_range_file = os.path.join(os.path.dirname(__file__), '../resources/variable_ranges.csv')
 
-parser = argparse.ArgumentParser(description='Extract episodes from per-subject data.')
-parser.add_argument('subjects_root_path', type=str, help='Directory containing subject sub-directories.')
-parser.add_argument('--variable_map_file', type=str,
-                    default=os.path.join(os.path.dirname(__file__), '../resources/itemid_to_variable_map.csv'),
-                    help='CSV containing ITEMID-to-VARIABLE map.')
-parser.add_argument('--reference_range_file', type=str,
-                    default=os.path.join(os.path.dirname(__file__), '../resources/variable_ranges.csv'),
-                    help='CSV containing reference ranges for VARIABLEs.')
-args, _ = parser.parse_known_args()
-
-var_map = read_itemid_to_variable_map(args.variable_map_file)
-variables = var_map.VARIABLE.unique()
-print(args.subjects_root_path)
-for subject_dir in tqdm(os.listdir(args.subjects_root_path), desc='Iterating over subjects'):
-    dn = os.path.join(args.subjects_root_path, subject_dir)
-    try:
-        subject_id = int(subject_dir)
-        if not os.path.isdir(dn):
-            raise Exception
-    except:
-        continue
-
-    try:
-        # reading tables of this subject
-        stays = read_stays(os.path.join(args.subjects_root_path, subject_dir))
-        diagnoses = read_diagnoses(os.path.join(args.subjects_root_path, subject_dir))
-        events = read_events(os.path.join(args.subjects_root_path, subject_dir))
-    except:
-        sys.stderr.write('Error reading from disk for subject: {}\n'.format(subject_id))
-        continue
-
-    episodic_data = assemble_episodic_data(stays, diagnoses)
+
+def extract_subject_episodes(subject_id, stays, diagnoses, events, var_map, variables, report=None,
+                             episodic_data=None):
+    """
+    Episodes of one subject, one per stay with events, as (episode number, episodic data row indexed by Icustay,
+    time series indexed by Hours, catalog row) tuples. episodic_data, the rows of the subject's stays in the
+    table of read_cohort_episodic_data, replaces the table built from stays and diagnoses.
+    """
+    report = report if report is not None else RunReport('extract_episodes_from_subjects')
+    if episodic_data is None:
+        episodic_data = assemble_episodic_data(stays, diagnoses)
 
     # cleaning and converting to time series
+    n_events = events.shape[0]
     events = map_itemids_to_variables(events, var_map)
+    report.count('events', n_events)
+    report.count('mapped_events', events.shape[0])
     events = clean_events(events)
+    report.count('clean_events', events.shape[0])
     if events.shape[0] == 0:
         # no valid events for this subject
-        continue
+        report.count('subjects_without_valid_events')
+        return []
     timeseries = convert_events_to_timeseries(events, variables=variables)
 
     # extracting separate episodes
+    episodes = []
     for i in range(stays.shape[0]):
         stay_id = stays.ICUSTAY_ID.iloc[i]
         intime = stays.INTIME.iloc[i]
@@ -69,11 +62,113 @@ for subject_dir in tqdm(os.listdir(args.subjects_root_path), desc='Iterating ove
         if stay_id in episodic_data.index:
             episodic_data.loc[stay_id, 'Weight'] = get_first_valid_from_timeseries(episode, 'Weight')
             episodic_data.loc[stay_id, 'Height'] = get_first_valid_from_timeseries(episode, 'Height')
-        episodic_data.loc[episodic_data.index == stay_id].to_csv(os.path.join(args.subjects_root_path, subject_dir,
-                                                                              'episode{}.csv'.format(i+1)),
-                                                                 index_label='Icustay')
         columns = list(episode.columns)
         columns_sorted = sorted(columns, key=(lambda x: "" if x == "Hours" else x))
         episode = episode[columns_sorted]
-        episode.to_csv(os.path.join(args.subjects_root_path, subject_dir, 'episode{}_timeseries.csv'.format(i+1)),
-                       index_label='Hours')
+
+        if stay_id in episodic_data.index:
+            los, mortality = episodic_data.loc[stay_id, 'Length of Stay'], episodic_data.loc[stay_id, 'Mortality']
+        else:
+            los, mortality = float('nan'), float('nan')
+        episodes.append((i + 1, episodic_data.loc[episodic_data.index == stay_id], episode,
+                         summarize_episode(subject_id, i + 1, stay_id, stays.HADM_ID.iloc[i], los, mortality,
+                                           episode.index.values)))
+    return episodes
+
+
+def read_subject_tables(subject_path, with_diagnoses=True):
+    diagnoses = read_diagnoses(subject_path) if with_diagnoses else None
+    return read_stays(subject_path), diagnoses, read_events(subject_path)
+
+
+def read_cohort_episodic_data(subjects_root_path):
+    """
+    assemble_episodic_data of all stays at once, from the all_stays.csv and all_diagnoses.csv of extract_subjects
+    (with ICD9_CODE read as text, like read_diagnoses). Height and Weight are left to the episodes.
+    """
+    return assemble_episodic_data(pd.read_csv(os.path.join(subjects_root_path, 'all_stays.csv'),
+                                              float_precision='round_trip'),
+                                  pd.read_csv(os.path.join(subjects_root_path, 'all_diagnoses.csv'),
+                                              dtype={'ICD9_CODE': str}))
+
+
+def extract_episodes(subjects_root_path, variable_map_file=default_variable_map_file, report=None, shard=None,
+                     num_shards=None, prefetch_depth=4, cohort_episodic_data=False):
+    """
+    Writes episode{#}.csv and episode{#}_timeseries.csv to every subject directory of subjects_root_path and the
+    catalog of all episodes to subjects_root_path/episode_catalog.csv. With a shard, only the subjects of the
+    shard are processed and the catalog is written to the shard's part of episode_catalog.csv. The tables of the
+    next prefetch_depth subjects are read on background threads. With cohort_episodic_data, the demographics
+    and diagnosis labels of all stays are built at once from the cohort tables instead of once per subject.
+    """
+    report = report if report is not None else RunReport('extract_episodes_from_subjects')
+    cohort = None
+    if cohort_episodic_data:
+        with report.phase('cohort_episodic_data'):
+            cohort = read_cohort_episodic_data(subjects_root_path)
+    var_map = read_itemid_to_variable_map(variable_map_file)
+    variables = var_map.VARIABLE.unique()
+    print(subjects_root_path)
+    catalog = []
+    subject_dirs = select_shard([x for x in os.listdir(subjects_root_path)
+                                 if str.isdigit(x) and os.path.isdir(os.path.join(subjects_root_path, x))],
+                                shard, num_shards)
+    subject_tables = prefetch(subject_dirs, lambda x: read_subject_tables(os.path.join(subjects_root_path, x),
+                                                                          with_diagnoses=cohort is None),
+                              depth=prefetch_depth)
+    for (subject_dir, tables) in report.timed(tqdm(subject_tables, total=len(subject_dirs),
+                                                   desc='Iterating over subjects'), key=lambda x: x[0]):
+        dn = os.path.join(subjects_root_path, subject_dir)
+        subject_id = int(subject_dir)
+
+        try:
+            # reading tables of this subject
+            stays, diagnoses, events = tables()
+        except:
+            sys.stderr.write('Error reading from disk for subject: {}\n'.format(subject_id))
+            report.count('subjects_not_read')
+            continue
+
+        subject_episodic_data = None
+        if cohort is not None:
+            # looked up in the index of the cohort, which is built once
+            positions = cohort.index.get_indexer(stays.ICUSTAY_ID)
+            subject_episodic_data = cohort.iloc[np.sort(positions[positions >= 0])].copy()
+        for (number, episodic_data, episode, summary) in extract_subject_episodes(subject_id, stays, diagnoses,
+                                                                                  events, var_map, variables,
+                                                                                  report=report,
+                                                                                  episodic_data=subject_episodic_data):
+            episodic_data.to_csv(os.path.join(dn, 'episode{}.csv'.format(number)), index_label='Icustay')
+            episode.to_csv(os.path.join(dn, 'episode{}_timeseries.csv'.format(number)), index_label='Hours')
+            catalog.append(summary)
+
+    write_episode_catalog(pd.DataFrame(catalog, columns=catalog_columns),
+                          shard_path(os.path.join(subjects_root_path, 'episode_catalog.csv'), shard, num_shards))
+    report.rows('map_itemids_to_variables', report.counters.get('events', 0), report.counters.get('mapped_events', 0))
+    report.rows('clean_events', report.counters.get('mapped_events', 0), report.counters.get('clean_events', 0))
+    report.count('episodes', len(catalog))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract episodes from per-subject data.')
+    parser.add_argument('subjects_root_path', type=str, help='Directory containing subject sub-directories.')
+    parser.add_argument('--variable_map_file', type=str, default=default_variable_map_file,
+                        help='CSV containing ITEMID-to-VARIABLE map.')
+    parser.add_argument('--reference_range_file', type=str, default=default_reference_range_file,
+                        help='CSV containing reference ranges for VARIABLEs.')
+    parser.add_argument('--cohort_episodic_data', action='store_true',
+                        help='Build the demographics and diagnosis labels of the episodes for all stays at once '
+                             'from all_stays.csv and all_diagnoses.csv.')
+    add_shard_arguments(parser)
+    add_prefetch_arguments(parser)
+    add_report_arguments(parser)
+    args, _ = parser.parse_known_args()
+    check_shard_arguments(parser, args)
+    report = start_run_report('extract_episodes_from_subjects', args)
+    extract_episodes(args.subjects_root_path, args.variable_map_file, report=report, shard=args.shard,
+                     num_shards=args.num_shards, prefetch_depth=args.prefetch,
+                     cohort_episodic_data=args.cohort_episodic_data)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,81 +2,163 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import argparse
-import yaml
 
+from mimic3benchmark.hcup_ccs import default_cache_dir, load_hcup_ccs_mapping
+from mimic3benchmark.instrumentation import RunReport, add_report_arguments, start_run_report
+from mimic3benchmark.item_profile import ItemProfile, write_item_profile
 from mimic3benchmark.mimic3csv import *
-from mimic3benchmark.preprocessing import add_hcup_ccs_2015_groups, make_phenotype_label_matrix
+from mimic3benchmark.preprocessing import add_hcup_ccs_2015_groups
+from mimic3benchmark.sparse_labels import make_phenotype_label_sparse, extract_diagnosis_labels_sparse
 from mimic3benchmark.util import dataframe_from_csv
 
-parser = argparse.ArgumentParser(description='Extract per-subject data from MIMIC-III CSV files.')
-parser.add_argument('mimic3_path', type=str, help='Directory containing MIMIC-III CSV files.')
-parser.add_argument('output_path', type=str, help='Directory where per-subject data should be written.')
-parser.add_argument('--event_tables', '-e', type=str, nargs='+', help='Tables from which to read events.',
-                    default=['CHARTEVENTS', 'LABEVENTS', 'OUTPUTEVENTS'])
-parser.add_argument('--phenotype_definitions', '-p', type=str,
-                    default=os.path.join(os.path.dirname(__file__), '../resources/hcup_ccs_2015_definitions.yaml'),
-                    help='YAML file with phenotype definitions.')
-parser.add_argument('--itemids_file', '-i', type=str, help='CSV containing list of ITEMIDs to keep.')
-parser.add_argument('--verbose', '-v', dest='verbose', action='store_true', help='Verbosity in output')
-parser.add_argument('--quiet', '-q', dest='verbose', action='store_false', help='Suspend printing of details')
-parser.set_defaults(verbose=True)
-parser.add_argument('--test', action='store_true', help='TEST MODE: process only 1000 subjects, 1000000 events.')
-args, _ = parser.parse_known_args()
-
-try:
-    os.makedirs(args.output_path)
-except:
-    pass
-
-patients = read_patients_table(args.mimic3_path)
-admits = read_admissions_table(args.mimic3_path)
-stays = read_icustays_table(args.mimic3_path)
-if args.verbose:
-    print('START:\n\tICUSTAY_IDs: {}\n\tHADM_IDs: {}\n\tSUBJECT_IDs: {}'.format(stays.ICUSTAY_ID.unique().shape[0],
-          stays.HADM_ID.unique().shape[0], stays.SUBJECT_ID.unique().shape[0]))
+default_event_tables = ['CHARTEVENTS', 'LABEVENTS', 'OUTPUTEVENTS']
+default_phenotype_definitions = os.path.join(os.path.dirname(__file__), '../resources/hcup_ccs_2015_definitions.yaml')
 
-stays = remove_icustays_with_transfers(stays)
-if args.verbose:
-    print('REMOVE ICU TRANSFERS:\n\tICUSTAY_IDs: {}\n\tHADM_IDs: {}\n\tSUBJECT_IDs: {}'.format(stays.ICUSTAY_ID.unique().shape[0],
-          stays.HADM_ID.unique().shape[0], stays.SUBJECT_ID.unique().shape[0]))
 
-stays = merge_on_subject_admission(stays, admits)
-stays = merge_on_subject(stays, patients)
-stays = filter_admissions_on_nb_icustays(stays)
-if args.verbose:
-    print('REMOVE MULTIPLE STAYS PER ADMIT:\n\tICUSTAY_IDs: {}\n\tHADM_IDs: {}\n\tSUBJECT_IDs: {}'.format(stays.ICUSTAY_ID.unique().shape[0],
+def print_stay_counts(title, stays):
+    print('{}:\n\tICUSTAY_IDs: {}\n\tHADM_IDs: {}\n\tSUBJECT_IDs: {}'.format(title, stays.ICUSTAY_ID.unique().shape[0],
           stays.HADM_ID.unique().shape[0], stays.SUBJECT_ID.unique().shape[0]))
 
-stays = add_age_to_icustays(stays)
-stays = add_inunit_mortality_to_icustays(stays)
-stays = add_inhospital_mortality_to_icustays(stays)
-stays = filter_icustays_on_age(stays)
-if args.verbose:
-    print('REMOVE PATIENTS AGE < 18:\n\tICUSTAY_IDs: {}\n\tHADM_IDs: {}\n\tSUBJECT_IDs: {}'.format(stays.ICUSTAY_ID.unique().shape[0],
-          stays.HADM_ID.unique().shape[0], stays.SUBJECT_ID.unique().shape[0]))
 
-stays.to_csv(os.path.join(args.output_path, 'all_stays.csv'), index=False)
-diagnoses = read_icd_diagnoses_table(args.mimic3_path)
-diagnoses = filter_diagnoses_on_stays(diagnoses, stays)
-diagnoses.to_csv(os.path.join(args.output_path, 'all_diagnoses.csv'), index=False)
-count_icd_codes(diagnoses, output_path=os.path.join(args.output_path, 'diagnosis_counts.csv'))
-
-phenotypes = add_hcup_ccs_2015_groups(diagnoses, yaml.safe_load(open(args.phenotype_definitions, 'r')))
-make_phenotype_label_matrix(phenotypes, stays).to_csv(os.path.join(args.output_path, 'phenotype_labels.csv'),
-                                                      index=False, quoting=csv.QUOTE_NONNUMERIC)
-
-if args.test:
-    pat_idx = np.random.choice(patients.shape[0], size=1000)
-    patients = patients.iloc[pat_idx]
-    stays = stays.merge(patients[['SUBJECT_ID']], left_on='SUBJECT_ID', right_on='SUBJECT_ID')
-    args.event_tables = [args.event_tables[0]]
-    print('Using only', stays.shape[0], 'stays and only', args.event_tables[0], 'table')
-
-subjects = stays.SUBJECT_ID.unique()
-break_up_stays_by_subject(stays, args.output_path, subjects=subjects)
-break_up_diagnoses_by_subject(phenotypes, args.output_path, subjects=subjects)
-items_to_keep = set(
-    [int(itemid) for itemid in dataframe_from_csv(args.itemids_file)['ITEMID'].unique()]) if args.itemids_file else None
-for table in args.event_tables:
-    read_events_table_and_break_up_by_subject(args.mimic3_path, table, args.output_path, items_to_keep=items_to_keep,
-                                              subjects_to_keep=subjects)
+def build_cohort(mimic3_path, verbose=True, report=None):
+    """
+    Patients table and the ICU stays of the benchmark cohort (no transfers, one stay per admission, adults)
+    with demographics, age and mortality.
+    """
+    report = report if report is not None else RunReport('extract_subjects')
+    with report.phase('read_tables'):
+        patients = read_patients_table(mimic3_path)
+        admits = read_admissions_table(mimic3_path)
+        stays = read_icustays_table(mimic3_path)
+    if verbose:
+        print_stay_counts('START', stays)
+
+    with report.phase('filter_stays'):
+        n_stays = stays.shape[0]
+        stays = remove_icustays_with_transfers(stays)
+        report.rows('remove_icustays_with_transfers', n_stays, stays.shape[0])
+        if verbose:
+            print_stay_counts('REMOVE ICU TRANSFERS', stays)
+
+        stays = merge_on_subject_admission(stays, admits)
+        stays = merge_on_subject(stays, patients)
+        n_stays = stays.shape[0]
+        stays = filter_admissions_on_nb_icustays(stays)
+        report.rows('filter_admissions_on_nb_icustays', n_stays, stays.shape[0])
+        if verbose:
+            print_stay_counts('REMOVE MULTIPLE STAYS PER ADMIT', stays)
+
+        stays = add_age_to_icustays(stays)
+        stays = add_inunit_mortality_to_icustays(stays)
+        stays = add_inhospital_mortality_to_icustays(stays)
+        n_stays = stays.shape[0]
+        stays = filter_icustays_on_age(stays)
+        report.rows('filter_icustays_on_age', n_stays, stays.shape[0])
+        if verbose:
+            print_stay_counts('REMOVE PATIENTS AGE < 18', stays)
+    return patients, stays
+
+
+def build_diagnoses(mimic3_path, stays, phenotype_definitions=default_phenotype_definitions, hcup_cache_dir=None,
+                    report=None):
+    """ Diagnoses of the cohort stays, and the same diagnoses with their HCUP CCS groups. """
+    report = report if report is not None else RunReport('extract_subjects')
+    diagnoses = read_icd_diagnoses_table(mimic3_path)
+    n_diagnoses = diagnoses.shape[0]
+    diagnoses = filter_diagnoses_on_stays(diagnoses, stays)
+    report.rows('filter_diagnoses_on_stays', n_diagnoses, diagnoses.shape[0])
+    phenotypes = add_hcup_ccs_2015_groups(diagnoses, load_hcup_ccs_mapping(phenotype_definitions, hcup_cache_dir))
+    return diagnoses, phenotypes
+
+
+def extract_subjects(mimic3_path, output_path, event_tables=default_event_tables,
+                     phenotype_definitions=default_phenotype_definitions, itemids_file=None, verbose=True,
+                     test=False, epoch_times=False, item_profile_file=None, hcup_cache_dir=None, report=None):
+    """
+    Writes the cohort tables and labels to output_path and the stays, diagnoses and events of every subject
+    to output_path/{SUBJECT_ID}. With epoch_times, the CHARTTIME of the events is written as seconds since the
+    epoch, which the later steps read without parsing dates. With item_profile_file, every row of the event
+    tables is also profiled by ITEMID during the same scan (see write_item_profile).
+    """
+    report = report if report is not None else RunReport('extract_subjects')
+    try:
+        os.makedirs(output_path)
+    except:
+        pass
+
+    patients, stays = build_cohort(mimic3_path, verbose=verbose, report=report)
+    stays.to_csv(os.path.join(output_path, 'all_stays.csv'), index=False)
+
+    with report.phase('diagnoses_and_labels'):
+        diagnoses, phenotypes = build_diagnoses(mimic3_path, stays, phenotype_definitions, hcup_cache_dir,
+                                                report=report)
+        diagnoses.to_csv(os.path.join(output_path, 'all_diagnoses.csv'), index=False)
+        count_icd_codes(diagnoses, output_path=os.path.join(output_path, 'diagnosis_counts.csv'))
+
+        phenotype_labels = make_phenotype_label_sparse(phenotypes, stays)
+        phenotype_labels.save_npz(os.path.join(output_path, 'phenotype_labels.npz'))
+        phenotype_labels.to_dense().to_csv(os.path.join(output_path, 'phenotype_labels.csv'),
+                                           index=False, quoting=csv.QUOTE_NONNUMERIC)
+        extract_diagnosis_labels_sparse(diagnoses).save_npz(os.path.join(output_path, 'diagnosis_labels.npz'))
+
+    if test:
+        pat_idx = np.random.choice(patients.shape[0], size=1000)
+        patients = patients.iloc[pat_idx]
+        stays = stays.merge(patients[['SUBJECT_ID']], left_on='SUBJECT_ID', right_on='SUBJECT_ID')
+        event_tables = [event_tables[0]]
+        print('Using only', stays.shape[0], 'stays and only', event_tables[0], 'table')
+
+    subjects = stays.SUBJECT_ID.unique()
+    report.count('subjects', subjects.shape[0])
+    report.count('icustays', stays.shape[0])
+    with report.phase('break_up_stays_and_diagnoses'):
+        break_up_stays_by_subject(stays, output_path, subjects=subjects)
+        break_up_diagnoses_by_subject(phenotypes, output_path, subjects=subjects)
+    items_to_keep = set(
+        [int(itemid) for itemid in dataframe_from_csv(itemids_file)['ITEMID'].unique()]) if itemids_file else None
+    item_profile = ItemProfile() if item_profile_file else None
+    for table in event_tables:
+        with report.phase('break_up_{}'.format(table.lower())):
+            nb_read, nb_kept = read_events_table_and_break_up_by_subject(mimic3_path, table, output_path,
+                                                                         items_to_keep=items_to_keep,
+                                                                         subjects_to_keep=subjects,
+                                                                         epoch_times=epoch_times,
+                                                                         item_profile=item_profile)
+        report.rows(table, nb_read, nb_kept)
+    if item_profile is not None:
+        write_item_profile(item_profile, item_profile_file)
+        report.count('profiled_itemids', len(item_profile.items))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract per-subject data from MIMIC-III CSV files.')
+    parser.add_argument('mimic3_path', type=str, help='Directory containing MIMIC-III CSV files.')
+    parser.add_argument('output_path', type=str, help='Directory where per-subject data should be written.')
+    parser.add_argument('--event_tables', '-e', type=str, nargs='+', help='Tables from which to read events.',
+                        default=default_event_tables)
+    parser.add_argument('--phenotype_definitions', '-p', type=str, default=default_phenotype_definitions,
+                        help='YAML file with phenotype definitions.')
+    parser.add_argument('--hcup_cache_dir', type=str, default=default_cache_dir,
+                        help='Directory where the compiled phenotype definitions are cached, empty to disable.')
+    parser.add_argument('--itemids_file', '-i', type=str, help='CSV containing list of ITEMIDs to keep.')
+    parser.add_argument('--verbose', '-v', dest='verbose', action='store_true', help='Verbosity in output')
+    parser.add_argument('--quiet', '-q', dest='verbose', action='store_false', help='Suspend printing of details')
+    parser.set_defaults(verbose=True)
+    parser.add_argument('--test', action='store_true', help='TEST MODE: process only 1000 subjects, 1000000 events.')
+    parser.add_argument('--epoch_times', action='store_true',
+                        help='Write the CHARTTIME of the events as seconds since the epoch instead of as text.')
+    parser.add_argument('--item_profile', type=str, default=None,
+                        help='Profile the event tables by ITEMID (rows, units, null and numeric rates, quantiles) '
+                             'and write the profile to this JSON file and a summary next to it as CSV.')
+    add_report_arguments(parser)
+    args, _ = parser.parse_known_args()
+
+    report = start_run_report('extract_subjects', args)
+    extract_subjects(args.mimic3_path, args.output_path, event_tables=args.event_tables,
+                     phenotype_definitions=args.phenotype_definitions, itemids_file=args.itemids_file,
+                     verbose=args.verbose, test=args.test, epoch_times=args.epoch_times,
+                     item_profile_file=args.item_profile, hcup_cache_dir=args.hcup_cache_dir or None, report=report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+import yaml
+from tqdm import tqdm
+
+from mimic3benchmark.util import dataframe_from_csv
+
+
+ethnicities = ['WHITE', 'WHITE - RUSSIAN', 'BLACK/AFRICAN AMERICAN', 'BLACK/CAPE VERDEAN', 'HISPANIC OR LATINO',
+               'HISPANIC/LATINO - PUERTO RICAN', 'ASIAN', 'ASIAN - CHINESE', 'UNKNOWN/NOT SPECIFIED',
+               'UNABLE TO OBTAIN', 'PATIENT DECLINED TO ANSWER', 'OTHER', 'AMERICAN INDIAN/ALASKA NATIVE',
+               'MIDDLE EASTERN', 'PORTUGUESE', 'MULTI RACE ETHNICITY']
+careunits = ['MICU', 'SICU', 'CCU', 'CSRU', 'TSICU']
+
+categorical_values = {
+    'Capillary refill rate': ['Normal <3 secs', 'Abnormal >3 secs', 'Brisk', 'Delayed'],
+    'Glascow coma scale eye opening': ['4 Spontaneously', '3 To speech', '2 To pain', '1 No Response',
+                                       'Spontaneously', 'To Speech', 'To Pain', 'None'],
+    'Glascow coma scale motor response': ['6 Obeys Commands', '5 Localizes Pain', '4 Flex-withdraws',
+                                          '1 No Response', 'Obeys Commands', 'Localizes Pain'],
+    'Glascow coma scale verbal response': ['5 Oriented', '4 Confused', '1.0 ET/Trach', '1 No Response',
+                                           'Oriented', 'Confused', 'No Response-ETT'],
+}
+
+numeric_ranges = {
+    'Diastolic blood pressure': (40, 90),
+    'Systolic blood pressure': (90, 160),
+    'Mean blood pressure': (55, 110),
+    'Fraction inspired oxygen': (21, 100),
+    'Glascow coma scale total': (3, 15),
+    'Glucose': (70, 250),
+    'Heart Rate': (50, 130),
+    'Oxygen saturation': (88, 100),
+    'Respiratory rate': (10, 30),
+    'pH': (7.1, 7.6),
+}
+
+output_itemids = [40055, 43175, 40069, 40094, 40715, 40473, 226559, 226560, 227510]
+
+note_sections = ['Chief Complaint:', 'History of Present Illness:', 'Past Medical History:',
+                 'Medications on Admission:', 'Allergies:', 'Physical Exam:', 'Family History:',
+                 'Social History:', 'Brief Hospital Course:', 'Discharge Diagnosis:']
+note_words = ['patient', 'pain', 'chest', 'shortness', 'breath', 'fever', 'denies', 'history', 'stable', 'normal',
+              'afebrile', 'aspirin', 'lisinopril', 'daily', 'mg', 'intubated', 'extubated', 'improved', 'smoker',
+              'alcohol', 'mother', 'father', 'diabetes', 'hypertension', 'no', 'acute', 'distress', 'well']
+
+
+def format_time(t):
+    return pd.Timestamp(t).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def read_subject_pool(repo_path):
+    """
+    Subject/admission ids that appear in the shipped split files, so that the split and notes stages
+    find their subjects in the generated cohort.
+    """
+    pairs = []
+    for fn in ['train_listfile.csv', 'val_listfile.csv', 'test_listfile.csv']:
+        path = os.path.join(repo_path, 'data', fn)
+        if not os.path.exists(path):
+            continue
+        listfile = pd.read_csv(path)
+        subjects = listfile.stay.str.split('_').str[0].astype(int)
+        pairs.extend(zip(subjects, listfile.HADM_ID.astype(int)))
+    subjects = []
+    for fn in ['mimic_train.csv', 'mimic_val.csv', 'mimic_test.csv']:
+        path = os.path.join(repo_path, 'mimic3benchmark', fn)
+        if os.path.exists(path):
+            subjects.extend(pd.read_csv(path).SUBJECT_ID.tolist())
+    return pairs, subjects
+
+
+def make_cohort(rng, n_subjects, max_stays, pairs, pool_subjects):
+    order = rng.permutation(len(pairs))
+    chosen = []
+    seen = set()
+    for i in order:
+        if len(chosen) == n_subjects:
+            break
+        if pairs[i][0] not in seen:
+            seen.add(pairs[i][0])
+            chosen.append(pairs[i])
+    extra = [s for s in pool_subjects if s not in seen]
+    rng.shuffle(extra)
+    next_subject = max(list(seen) + extra + [0]) + 1
+    while len(chosen) < n_subjects:
+        subject = extra.pop() if extra else next_subject
+        next_subject += subject == next_subject
+        chosen.append((subject, None))
+
+    patients, admissions, icustays = [], [], []
+    next_hadm, next_icustay = 300000, 400000
+    for subject_id, known_hadm in chosen:
+        gender = rng.choice(['F', 'M'])
+        age = rng.integers(16, 92)
+        base = pd.Timestamp('2100-01-01') + pd.Timedelta(days=int(rng.integers(0, 365 * 80)))
+        dob = base - pd.Timedelta(days=int(age * 365.25))
+        if age >= 90:
+            dob = dob - pd.Timedelta(days=int(210 * 365.25))
+        dies = rng.random() < 0.12
+        t = base
+        dod = None
+        n_admissions = int(rng.integers(1, max_stays + 1))
+        for a in range(n_admissions):
+            hadm_id = known_hadm if (a == 0 and known_hadm is not None) else next_hadm
+            next_hadm += hadm_id == next_hadm
+            admittime = t + pd.Timedelta(hours=float(rng.uniform(0, 24)))
+            los_days = float(rng.uniform(1.0, 9.0))
+            intime = admittime + pd.Timedelta(hours=float(rng.uniform(0.5, 12)))
+            outtime = intime + pd.Timedelta(days=los_days)
+            dischtime = outtime + pd.Timedelta(days=float(rng.uniform(0.2, 5)))
+            last = a == n_admissions - 1
+            deathtime = None
+            if dies and last:
+                deathtime = outtime - pd.Timedelta(hours=float(rng.uniform(0, 20)))
+                dischtime = deathtime
+                dod = deathtime.normalize()
+            admission_type = 'NEWBORN' if rng.random() < 0.02 else rng.choice(['EMERGENCY', 'ELECTIVE', 'URGENT'])
+            admissions.append({'SUBJECT_ID': subject_id, 'HADM_ID': hadm_id, 'ADMITTIME': admittime,
+                               'DISCHTIME': dischtime, 'DEATHTIME': deathtime, 'ADMISSION_TYPE': admission_type,
+                               'ADMISSION_LOCATION': 'EMERGENCY ROOM ADMIT', 'DISCHARGE_LOCATION':
+                                   'DEAD/EXPIRED' if deathtime is not None else 'HOME',
+                               'INSURANCE': rng.choice(['Medicare', 'Private', 'Medicaid']), 'LANGUAGE': 'ENGL',
+                               'RELIGION': 'UNOBTAINABLE', 'MARITAL_STATUS': rng.choice(['MARRIED', 'SINGLE']),
+                               'ETHNICITY': rng.choice(ethnicities), 'EDREGTIME': None, 'EDOUTTIME': None,
+                               'DIAGNOSIS': 'SYNTHETIC', 'HOSPITAL_EXPIRE_FLAG': int(deathtime is not None),
+                               'HAS_CHARTEVENTS_DATA': 1})
+            n_stays = 2 if rng.random() < 0.05 else 1
+            for s in range(n_stays):
+                unit = rng.choice(careunits)
+                transfer = rng.random() < 0.05
+                stay_in = intime + pd.Timedelta(days=s * los_days)
+                stay_out = outtime + pd.Timedelta(days=s * los_days)
+                icustays.append({'SUBJECT_ID': subject_id, 'HADM_ID': hadm_id, 'ICUSTAY_ID': next_icustay,
+                                 'DBSOURCE': rng.choice(['carevue', 'metavision']), 'FIRST_CAREUNIT': unit,
+                                 'LAST_CAREUNIT': rng.choice(careunits) if transfer else unit,
+                                 'FIRST_WARDID': 50, 'LAST_WARDID': 52 if transfer else 50,
+                                 'INTIME': stay_in, 'OUTTIME': stay_out,
+                                 'LOS': round((stay_out - stay_in) / pd.Timedelta(days=1), 4)})
+                next_icustay += 1
+            t = dischtime + pd.Timedelta(days=float(rng.uniform(30, 900)))
+        patients.append({'SUBJECT_ID': subject_id, 'GENDER': gender, 'DOB': dob, 'DOD': dod,
+                         'DOD_HOSP': dod, 'DOD_SSN': None, 'EXPIRE_FLAG': int(dod is not None)})
+
+    patients = pd.DataFrame(patients)
+    admissions = pd.DataFrame(admissions)
+    icustays = pd.DataFrame(icustays)
+    for df in [patients, admissions, icustays]:
+        df.insert(0, 'ROW_ID', np.arange(1, df.shape[0] + 1))
+    return patients, admissions, icustays
+
+
+def make_diagnoses(rng, admissions, definitions, codes_per_admission):
+    codes = sorted(set(code for group in definitions.values() for code in group['codes']))
+    rows = []
+    for subject_id, hadm_id in zip(admissions.SUBJECT_ID, admissions.HADM_ID):
+        n = int(rng.integers(1, 2 * codes_per_admission))
+        for seq, code in enumerate(rng.choice(codes, size=n, replace=False)):
+            rows.append((subject_id, hadm_id, seq + 1, code))
+    diagnoses = pd.DataFrame(rows, columns=['SUBJECT_ID', 'HADM_ID', 'SEQ_NUM', 'ICD9_CODE'])
+    diagnoses.insert(0, 'ROW_ID', np.arange(1, diagnoses.shape[0] + 1))
+    used = sorted(diagnoses.ICD9_CODE.unique())
+    d_icd = pd.DataFrame({'ICD9_CODE': used,
+                          'SHORT_TITLE': ['Synthetic dx {}'.format(c) for c in used],
+                          'LONG_TITLE': ['Synthetic diagnosis {}'.format(c) for c in used]})
+    d_icd.insert(0, 'ROW_ID', np.arange(1, d_icd.shape[0] + 1))
+    return diagnoses, d_icd
+
+
+def make_value(rng, variable, label):
+    """ Returns VALUE, VALUENUM, VALUEUOM strings for one measurement of a clinical variable. """
+    if variable in categorical_values:
+        return rng.choice(categorical_values[variable]), '', ''
+    if variable == 'Temperature':
+        if 'F' in label:
+            v = round(float(rng.normal(98.6, 1.5)), 1)
+            return str(v), str(v), '?F'
+        v = round(float(rng.normal(37.0, 0.8)), 1)
+        return str(v), str(v), '?C'
+    if variable == 'Weight':
+        if 'lb' in label:
+            v = round(float(rng.uniform(100, 300)), 1)
+            return str(v), str(v), 'lbs'
+        if 'oz' in label:
+            v = round(float(rng.uniform(1600, 4800)), 1)
+            return str(v), str(v), 'oz'
+        v = round(float(rng.uniform(45, 140)), 1)
+        return str(v), str(v), 'kg'
+    if variable == 'Height':
+        if 'cm' in label:
+            v = float(rng.integers(150, 200))
+            return str(v), str(v), 'cm'
+        v = float(rng.integers(58, 78))
+        return str(v), str(v), 'Inch'
+    low, high = numeric_ranges[variable]
+    if variable in ['Glucose', 'pH'] and rng.random() < 0.01:
+        return 'ERROR', '', ''
+    if variable in ['Systolic blood pressure', 'Diastolic blood pressure'] and rng.random() < 0.05:
+        return '{}/{}'.format(int(rng.integers(90, 160)), int(rng.integers(40, 90))), '', 'mmHg'
+    if variable == 'Oxygen saturation' and rng.random() < 0.02:
+        v = round(float(rng.uniform(0.88, 1.0)), 2)
+        return str(v), str(v), '%'
+    if variable == 'Fraction inspired oxygen' and rng.random() < 0.3:
+        v = round(float(rng.uniform(0.21, 1.0)), 2)
+        return str(v), str(v), ''
+    if isinstance(low, int):
+        v = int(rng.integers(low, high + 1))
+    else:
+        v = round(float(rng.uniform(low, high)), 2)
+    if rng.random() < 0.01:
+        return '', '', ''
+    return str(v), str(v), ''
+
+
+def format_times(intime, offsets):
+    """ Timestamps intime + offsets hours, formatted like the MIMIC-III CSVs. """
+    times = np.datetime64(intime, 's') + np.round(offsets * 3600).astype('timedelta64[s]')
+    return np.char.replace(np.datetime_as_string(times, unit='s'), 'T', ' ')
+
+
+def write_events(rng, path, table, icustays, var_map, events_per_stay, missing_icustay_rate):
+    linksto = 'labevents' if table == 'LABEVENTS' else 'chartevents'
+    items = var_map[var_map.LINKSTO == linksto]
+    item_ids, item_variables, item_labels = (items.ITEMID.tolist(), items.VARIABLE.tolist(),
+                                             items.MIMIC_LABEL.tolist())
+    if table == 'LABEVENTS':
+        header = ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'ITEMID', 'CHARTTIME', 'VALUE', 'VALUENUM', 'VALUEUOM', 'FLAG']
+        n_per_stay = max(1, events_per_stay // 10)
+    elif table == 'OUTPUTEVENTS':
+        header = ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'CHARTTIME', 'ITEMID', 'VALUE', 'VALUEUOM',
+                  'STORETIME', 'CGID', 'STOPPED', 'NEWBOTTLE', 'ISERROR']
+        n_per_stay = max(1, events_per_stay // 20)
+    else:
+        header = ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'ITEMID', 'CHARTTIME', 'STORETIME', 'CGID',
+                  'VALUE', 'VALUENUM', 'VALUEUOM', 'WARNING', 'ERROR', 'RESULTSTATUS', 'STOPPED']
+        n_per_stay = events_per_stay
+
+    row_id = 1
+    with open(path, 'w', newline='') as f:
+        w = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+        w.writerow(header)
+        for stay in tqdm(icustays.itertuples(), total=icustays.shape[0], desc='Writing {}'.format(table)):
+            n = int(rng.poisson(n_per_stay))
+            if n == 0:
+                continue
+            # times, items and missing ICUSTAY_IDs are drawn for the whole stay at once, only the values are
+            # drawn per event
+            span = (stay.OUTTIME - stay.INTIME) / pd.Timedelta(hours=1)
+            offsets = np.round(np.sort(rng.uniform(-6, span + 6, size=n)) * 4) / 4
+            charttimes = format_times(stay.INTIME, offsets).tolist()
+            row_ids = range(row_id, row_id + n)
+            icustay_ids = np.where(rng.random(n) < missing_icustay_rate, '', str(stay.ICUSTAY_ID)).tolist()
+            if table == 'OUTPUTEVENTS':
+                values = np.round(rng.uniform(0, 500, size=n), 1).tolist()
+                itemids = rng.choice(output_itemids, size=n).tolist()
+                w.writerows([r, stay.SUBJECT_ID, stay.HADM_ID, i, t, item, v, 'mL', t, 1, '', '', '']
+                            for (r, i, t, item, v) in zip(row_ids, icustay_ids, charttimes, itemids, values))
+            else:
+                picks = rng.integers(0, len(item_ids), size=n).tolist()
+                values = [make_value(rng, item_variables[p], item_labels[p]) for p in picks]
+                if table == 'LABEVENTS':
+                    w.writerows([r, stay.SUBJECT_ID, stay.HADM_ID, item_ids[p], t, v, vn, uom, '']
+                                for (r, p, t, (v, vn, uom)) in zip(row_ids, picks, charttimes, values))
+                else:
+                    w.writerows([r, stay.SUBJECT_ID, stay.HADM_ID, i, item_ids[p], t, t, 1, v, vn, uom, 0, 0, '', '']
+                                for (r, i, p, t, (v, vn, uom)) in zip(row_ids, icustay_ids, picks, charttimes,
+                                                                       values))
+            row_id += n
+    return row_id - 1
+
+
+def make_note_text(rng, died, words_per_section):
+    lines = ['Admission Date:  [**2100-1-1**]     Discharge Date:   [**2100-1-9**]', '',
+             'Service: MEDICINE', '']
+    for section in note_sections:
+        n = int(rng.integers(1, 2 * words_per_section))
+        body = ' '.join(rng.choice(note_words, size=n))
+        if section == 'Physical Exam:' and rng.random() < 0.1:
+            body += ' patient expired'
+        if died and section == 'Brief Hospital Course:' and rng.random() < 0.5:
+            body += ' patient expired on the floor. time of death 10:30'
+        lines.append('{}\n{}'.format(section, body))
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def write_notes(rng, path, admissions, words_per_section):
+    header = ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'CHARTDATE', 'CHARTTIME', 'STORETIME', 'CATEGORY', 'DESCRIPTION',
+              'CGID', 'ISERROR', 'TEXT']
+    row_id = 1
+    with open(path, 'w', newline='') as f:
+        w = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+        w.writerow(header)
+        for adm in tqdm(admissions.itertuples(), total=admissions.shape[0], desc='Writing NOTEEVENTS'):
+            chartdate = adm.DISCHTIME.strftime('%Y-%m-%d')
+            died = isinstance(adm.DEATHTIME, pd.Timestamp)
+            w.writerow([row_id, adm.SUBJECT_ID, adm.HADM_ID, chartdate, '', '', 'Discharge summary', 'Report',
+                        '', '', make_note_text(rng, died, words_per_section)])
+            row_id += 1
+            if rng.random() < 0.1:
+                w.writerow([row_id, adm.SUBJECT_ID, adm.HADM_ID, chartdate, '', '', 'Discharge summary', 'Addendum',
+                            '', '', 'Addendum:\n' + ' '.join(rng.choice(note_words, size=12))])
+                row_id += 1
+            for category in ['Nursing', 'Radiology', 'ECG']:
+                if rng.random() < 0.7:
+                    w.writerow([row_id, adm.SUBJECT_ID, adm.HADM_ID if rng.random() > 0.05 else '', chartdate,
+                                format_time(adm.ADMITTIME), '', category, 'Report', 1, '',
+                                ' '.join(rng.choice(note_words, size=40))])
+                    row_id += 1
+    return row_id - 1
+
+
+def write_table(df, path):
+    df.to_csv(path, index=False, date_format='%Y-%m-%d %H:%M:%S')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate schema-compatible synthetic MIMIC-III CSV files.')
+    parser.add_argument('output_path', type=str, help='Directory where the synthetic CSV files should be written.')
+    parser.add_argument('--n_subjects', type=int, default=1000, help='Number of subjects.')
+    parser.add_argument('--max_admissions', type=int, default=2, help='Maximum number of admissions per subject.')
+    parser.add_argument('--events_per_stay', type=int, default=500, help='Mean number of CHARTEVENTS per ICU stay.')
+    parser.add_argument('--codes_per_admission', type=int, default=8, help='Mean number of ICD9 codes per admission.')
+    parser.add_argument('--words_per_section', type=int, default=30, help='Mean number of words per note section.')
+    parser.add_argument('--missing_icustay_rate', type=float, default=0.1,
+                        help='Fraction of events written with an empty ICUSTAY_ID.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    parser.add_argument('--variable_map_file', type=str,
+                        default=os.path.join(os.path.dirname(__file__), '../resources/itemid_to_variable_map.csv'),
+                        help='CSV containing ITEMID-to-VARIABLE map.')
+    parser.add_argument('--phenotype_definitions', '-p', type=str,
+                        default=os.path.join(os.path.dirname(__file__), '../resources/hcup_ccs_2015_definitions.yaml'),
+                        help='YAML file with phenotype definitions.')
+    args, _ = parser.parse_known_args()
+
+    if not os.path.exists(args.output_path):
+        os.makedirs(args.output_path)
+    rng = np.random.default_rng(args.seed)
+
+    repo_path = os.path.join(os.path.dirname(__file__), '../..')
+    pairs, pool_subjects = read_subject_pool(repo_path)
+    patients, admissions, icustays = make_cohort(rng, args.n_subjects, args.max_admissions, pairs, pool_subjects)
+    write_table(patients, os.path.join(args.output_path, 'PATIENTS.csv'))
+    write_table(admissions, os.path.join(args.output_path, 'ADMISSIONS.csv'))
+    write_table(icustays, os.path.join(args.output_path, 'ICUSTAYS.csv'))
+
+    with open(args.phenotype_definitions) as definitions_file:
+        definitions = yaml.safe_load(definitions_file)
+    diagnoses, d_icd = make_diagnoses(rng, admissions, definitions, args.codes_per_admission)
+    write_table(diagnoses, os.path.join(args.output_path, 'DIAGNOSES_ICD.csv'))
+    write_table(d_icd, os.path.join(args.output_path, 'D_ICD_DIAGNOSES.csv'))
+
+    var_map = dataframe_from_csv(args.variable_map_file, index_col=None).fillna('')
+    var_map = var_map[(var_map.LEVEL2 != '') & (var_map.STATUS == 'ready')]
+    var_map = var_map.rename({'LEVEL2': 'VARIABLE', 'MIMIC LABEL': 'MIMIC_LABEL'}, axis=1)
+    var_map = var_map[['VARIABLE', 'ITEMID', 'MIMIC_LABEL', 'LINKSTO']]
+
+    counts = {'PATIENTS': patients.shape[0], 'ADMISSIONS': admissions.shape[0], 'ICUSTAYS': icustays.shape[0],
+              'DIAGNOSES_ICD': diagnoses.shape[0]}
+    for table in ['CHARTEVENTS', 'LABEVENTS', 'OUTPUTEVENTS']:
+        counts[table] = write_events(rng, os.path.join(args.output_path, table + '.csv'), table, icustays, var_map,
+                                     args.events_per_stay, args.missing_icustay_rate)
+    counts['NOTEEVENTS'] = write_notes(rng, os.path.join(args.output_path, 'NOTEEVENTS.csv'), admissions,
+                                       args.words_per_section)
+    for table, n in counts.items():
+        print('{}: {} rows'.format(table, n))
+
+
+if __name__ == '__main__':
+    main()
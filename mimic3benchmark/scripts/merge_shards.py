@@ -0,0 +1,109 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+
+import pandas as pd
+
+from mimic3benchmark.episode_catalog import episode_order, merge_episode_catalogs, read_episode_catalog,\
+    write_episode_catalog
+from mimic3benchmark.instrumentation import merge_run_reports
+from mimic3benchmark.partitions import shard_path
+from mimic3benchmark.scripts.create_demography_diagnosis import merge_listfiles
+from mimic3benchmark.scripts.create_timeseries import merge_timeseries_listfiles
+
+
+def shard_files(fn, num_shards):
+    """
+    The parts of fn written by all shards, None if no shard wrote one. Exits if only some of the shards did,
+    because the merged output would silently miss subjects.
+    """
+    fns = [shard_path(fn, shard, num_shards) for shard in range(num_shards)]
+    missing = [x for x in fns if not os.path.exists(x)]
+    if len(missing) == len(fns):
+        return None
+    if missing:
+        sys.exit('Missing shard outputs: {}'.format(', '.join(missing)))
+    return fns
+
+
+def remove_files(fns, keep):
+    if not keep:
+        for fn in fns:
+            os.remove(fn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Combine the outputs of the shards of the per-subject scripts into '
+                                                 'the outputs of a run over all subjects.')
+    parser.add_argument('--num_shards', '--num-shards', dest='num_shards', type=int, required=True,
+                        help='Number of shards the scripts ran with.')
+    parser.add_argument('--root_path', type=str, default=None,
+                        help='Root of the per-subject data; merges the episode catalogs of '
+                             'extract_episodes_from_subjects. The catalog also orders the merged '
+                             'demography_diagnosis test listfile and mp_listfile.csv.')
+    parser.add_argument('--timeseries', type=str, default=None,
+                        help='Output directory of create_timeseries; merges the listfiles of its partitions and '
+                             'mp_listfile.csv in the working directory.')
+    parser.add_argument('--demography_diagnosis', type=str, default=None,
+                        help='Output directory of create_demography_diagnosis; merges the listfiles of its partitions.')
+    parser.add_argument('--reports', type=str, nargs='+', default=[],
+                        help='Run reports of the shards of one script, merged into --report_output.')
+    parser.add_argument('--report_output', type=str, default=None, help='Where to write the merged run report.')
+    parser.add_argument('--keep_shards', action='store_true', help='Keep the per-shard files after merging.')
+    args, _ = parser.parse_known_args()
+    if args.reports and not args.report_output:
+        parser.error('--reports needs --report_output')
+
+    catalog = None
+    if args.root_path is not None:
+        catalog_fn = os.path.join(args.root_path, 'episode_catalog.csv')
+        fns = shard_files(catalog_fn, args.num_shards)
+        if fns is not None:
+            catalog = merge_episode_catalogs(fns)
+            write_episode_catalog(catalog, catalog_fn)
+            remove_files(fns, args.keep_shards)
+            print('Merged {} episodes into {}'.format(catalog.shape[0], catalog_fn))
+        catalog = read_episode_catalog(catalog_fn)
+
+    if args.timeseries is not None:
+        for partition in ['test', 'train']:
+            listfile_fn = os.path.join(args.timeseries, partition, 'listfile.csv')
+            fns = shard_files(listfile_fn, args.num_shards)
+            if fns is not None:
+                n = merge_timeseries_listfiles(os.path.join(args.timeseries, partition), partition, fns)
+                remove_files(fns, args.keep_shards)
+                print('Merged {} samples into {}'.format(n, listfile_fn))
+        fns = shard_files('./mp_listfile.csv', args.num_shards)
+        if fns is not None:
+            if catalog is None:
+                parser.error('merging mp_listfile.csv needs --root_path')
+            order = episode_order(catalog)
+            mp_listfile = pd.concat([pd.read_csv(fn, index_col=0) for fn in fns], ignore_index=True)
+            hadm_ids = mp_listfile.HADM_ID.tolist()
+            mp_listfile = mp_listfile.iloc[sorted(range(len(hadm_ids)), key=lambda i: order[hadm_ids[i]])]
+            mp_listfile.reset_index(drop=True).to_csv('./mp_listfile.csv')
+            remove_files(fns, args.keep_shards)
+
+    if args.demography_diagnosis is not None:
+        if catalog is None:
+            parser.error('--demography_diagnosis needs --root_path for the order of the episodes')
+        for partition in ['test', 'train']:
+            listfile_fn = os.path.join(args.demography_diagnosis, partition, 'listfile.csv')
+            fns = shard_files(listfile_fn, args.num_shards)
+            if fns is not None:
+                n = merge_listfiles(os.path.join(args.demography_diagnosis, partition), partition, fns, catalog)
+                remove_files(fns, args.keep_shards)
+                print('Merged {} samples into {}'.format(n, listfile_fn))
+
+    if args.reports:
+        with open(args.report_output, 'w') as f:
+            json.dump(merge_run_reports([json.load(open(fn)) for fn in args.reports]), f, indent=2)
+        print('Merged run report written to', args.report_output)
+
+
+if __name__ == '__main__':
+    main()
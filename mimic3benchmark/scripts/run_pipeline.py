@@ -0,0 +1,78 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+from mimic3benchmark.in_memory import run_in_memory
+from mimic3benchmark.instrumentation import RunReport
+from mimic3benchmark.pipeline import default_stages, plan_stages, run_stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run all steps of the benchmark, independent steps in parallel.')
+    parser.add_argument('mimic3_path', type=str, help='Directory containing MIMIC-III CSV files.')
+    parser.add_argument('--data_dir', type=str, default='data',
+                        help='Directory of the outputs, the root, timeseries, demography_diagnosis and '
+                             'clinical_notes directories are created in it.')
+    parser.add_argument('--stages', type=str, nargs='+', default=None,
+                        help='Stages to bring up to date together with the stages they depend on, all by default.')
+    parser.add_argument('--force', action='store_true', help='Run the stages even if they are up to date.')
+    parser.add_argument('--dry_run', action='store_true', help='Only print which stages would run.')
+    parser.add_argument('--cpus', type=int, default=None,
+                        help='Number of CPUs the running stages may use together, all CPUs by default.')
+    parser.add_argument('--memory_gb', type=float, default=None,
+                        help='Memory in GB the running stages may use together, the physical memory by default.')
+    parser.add_argument('--notes_workers', type=int, default=2,
+                        help='Number of processes create_clinical_notes uses, counted against --cpus.')
+    parser.add_argument('--manifest', action='store_true',
+                        help='Split with a partition manifest instead of moving the subject directories.')
+    parser.add_argument('--in_memory', action='store_true',
+                        help='Build the timeseries and demography_diagnosis datasets in one process without writing '
+                             'the per-subject files of the root directory; all events of the cohort are held in '
+                             'memory. create_clinical_notes still runs as a stage and is the only stage that '
+                             '--stages can select.')
+    args, _ = parser.parse_known_args()
+
+    data_dir = os.path.abspath(args.data_dir)
+    stages = default_stages(os.path.abspath(args.mimic3_path), data_dir, manifest=args.manifest,
+                            notes_workers=args.notes_workers)
+    names = [stage.name for stage in stages]
+    for name in args.stages or []:
+        if name not in names:
+            parser.error('unknown stage {}, the stages are: {}'.format(name, ', '.join(names)))
+    if args.in_memory:
+        replaced = [name for name in args.stages or [] if name != 'create_clinical_notes']
+        if replaced:
+            parser.error('--in_memory replaces the stages {}, only create_clinical_notes can be selected'.format(
+                ', '.join(replaced)))
+
+    pipeline_dir = os.path.join(data_dir, 'pipeline')
+    if args.in_memory:
+        if args.dry_run:
+            print('{:<32} run'.format('in_memory'))
+            return
+        report = RunReport('in_memory', path=os.path.join(pipeline_dir, 'logs', 'in_memory.json'), args=args)
+        try:
+            run_in_memory(os.path.abspath(args.mimic3_path), data_dir, report=report)
+        except BaseException:
+            report.close('failed')
+            raise
+        report.close()
+        stages = [stage for stage in stages if stage.name == 'create_clinical_notes']
+
+    plan = plan_stages(stages, pipeline_dir, targets=args.stages, force=args.force)
+    if args.dry_run:
+        for stage, runs in plan:
+            print('{:<32} {}'.format(stage.name, 'run' if runs else 'up to date'))
+        return
+
+    failed = run_stages(plan, pipeline_dir, os.path.join(pipeline_dir, 'logs'), cpus=args.cpus,
+                        memory_gb=args.memory_gb, cwd=data_dir)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
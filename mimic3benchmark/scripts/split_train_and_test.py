@@ -7,6 +7,9 @@ import argparse
 
 import pandas as pd
 
+from mimic3benchmark.instrumentation import add_report_arguments, start_run_report
+from mimic3benchmark.partitions import build_partition_manifest, write_partition_manifest
+
 
 def move_to_partition(args, patients, partition):
     if not os.path.exists(os.path.join(args.subjects_root_path, partition)):
@@ -20,17 +23,39 @@ def move_to_partition(args, patients, partition):
 def main():
     parser = argparse.ArgumentParser(description='Split data into train and test sets.')
     parser.add_argument('subjects_root_path', type=str, help='Directory containing subject sub-directories.')
+    parser.add_argument('--manifest', action='store_true',
+                        help='Write the partition of every subject to {subjects_root_path}/partitions.csv '
+                             'instead of moving the subject directories.')
+    parser.add_argument('--test_subjects', type=str, default='mimic3benchmark/mimic_test.csv',
+                        help='CSV with the SUBJECT_IDs of the test set.')
+    parser.add_argument('--val_subjects', type=str, default='mimic3benchmark/mimic_val.csv',
+                        help='CSV with the SUBJECT_IDs of the validation set, only used for the manifest.')
+    add_report_arguments(parser)
     args, _ = parser.parse_known_args()
+    report = start_run_report('split_train_and_test', args)
     folders = os.listdir(args.subjects_root_path)
     folders = list((filter(str.isdigit, folders)))
 
-    test_set = set(pd.read_csv('mimic3benchmark/mimic_test.csv')['SUBJECT_ID'].values)
+    test_set = set(pd.read_csv(args.test_subjects)['SUBJECT_ID'].values)
+
+    if args.manifest:
+        val_set = set(pd.read_csv(args.val_subjects)['SUBJECT_ID'].values)
+        manifest = build_partition_manifest(folders, test_set, val_set)
+        for partition, n in manifest.SPLIT.value_counts().items():
+            report.count('{}_subjects'.format(partition), n)
+        write_partition_manifest(manifest, os.path.join(args.subjects_root_path, 'partitions.csv'))
+        print(manifest.SPLIT.value_counts().to_string())
+        return
+
     train_patients = [x for x in folders if int(x) not in test_set]
     test_patients = [x for x in folders if int(x) in test_set]
     assert len(set(train_patients) & set(test_patients)) == 0
 
-    move_to_partition(args, train_patients, "train")
-    move_to_partition(args, test_patients, "test")
+    report.count('train_subjects', len(train_patients))
+    report.count('test_subjects', len(test_patients))
+    with report.phase('move_to_partitions'):
+        move_to_partition(args, train_patients, "train")
+        move_to_partition(args, test_patients, "test")
 
 
 if __name__ == '__main__':
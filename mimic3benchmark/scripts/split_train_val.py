@@ -7,35 +7,58 @@ import os
 
 import pandas as pd
 
+from mimic3benchmark.instrumentation import RunReport, add_report_arguments, start_run_report
+from mimic3benchmark.partitions import read_partition_manifest
 
-def main():
-    parser = argparse.ArgumentParser(description="Split train data into train and validation sets.")
-    parser.add_argument('dataset_dir', type=str, help='Path to the directory which contains the dataset')
-    args, _ = parser.parse_known_args()
 
-    val_patients = set(pd.read_csv('mimic3benchmark/mimic_val.csv')['SUBJECT_ID'].values)
-
-
-    with open(os.path.join(args.dataset_dir, 'train/listfile.csv')) as listfile:
+def split_train_val(dataset_dir, val_patients, report=None):
+    """
+    Splits {dataset_dir}/train/listfile.csv into train_listfile.csv and val_listfile.csv by the subject of every
+    sample and copies test/listfile.csv to test_listfile.csv.
+    """
+    report = report if report is not None else RunReport('split_train_val')
+    with open(os.path.join(dataset_dir, 'train/listfile.csv')) as listfile:
         lines = listfile.readlines()
         header = lines[0]
         lines = lines[1:]
     train_lines = [x for x in lines if int(x[:x.find("_")]) not in val_patients]
     val_lines = [x for x in lines if int(x[:x.find("_")]) in val_patients]
     assert len(train_lines) + len(val_lines) == len(lines)
+    report.rows('train_listfile', len(lines), len(train_lines))
+    report.rows('val_listfile', len(lines), len(val_lines))
 
-    with open(os.path.join(args.dataset_dir, 'train_listfile.csv'), 'w') as train_listfile:
+    with open(os.path.join(dataset_dir, 'train_listfile.csv'), 'w') as train_listfile:
         train_listfile.write(header)
         for line in train_lines:
             train_listfile.write(line)
 
-    with open(os.path.join(args.dataset_dir, 'val_listfile.csv'), 'w') as val_listfile:
+    with open(os.path.join(dataset_dir, 'val_listfile.csv'), 'w') as val_listfile:
         val_listfile.write(header)
         for line in val_lines:
             val_listfile.write(line)
 
-    shutil.copy(os.path.join(args.dataset_dir, 'test/listfile.csv'),
-                os.path.join(args.dataset_dir, 'test_listfile.csv'))
+    shutil.copy(os.path.join(dataset_dir, 'test/listfile.csv'),
+                os.path.join(dataset_dir, 'test_listfile.csv'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split train data into train and validation sets.")
+    parser.add_argument('dataset_dir', type=str, help='Path to the directory which contains the dataset')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='Partition manifest written by split_train_and_test --manifest, whose SPLIT column '
+                             'replaces --val_subjects.')
+    parser.add_argument('--val_subjects', type=str, default='mimic3benchmark/mimic_val.csv',
+                        help='CSV with the SUBJECT_IDs of the validation set.')
+    add_report_arguments(parser)
+    args, _ = parser.parse_known_args()
+    report = start_run_report('split_train_val', args)
+
+    if args.manifest:
+        manifest = read_partition_manifest(args.manifest)
+        val_patients = set(manifest.SUBJECT_ID[manifest.SPLIT == 'val'].values)
+    else:
+        val_patients = set(pd.read_csv(args.val_subjects)['SUBJECT_ID'].values)
+    split_train_val(args.dataset_dir, val_patients, report=report)
 
 
 if __name__ == '__main__':
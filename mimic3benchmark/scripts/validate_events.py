@@ -6,88 +6,134 @@ import argparse
 import pandas as pd
 from tqdm import tqdm
 
+from mimic3benchmark.instrumentation import add_report_arguments, start_run_report
+from mimic3benchmark.partitions import add_shard_arguments, check_shard_arguments, select_shard
+from mimic3benchmark.preprocessing import add_typed_values
+from mimic3benchmark.util import add_prefetch_arguments, prefetch
+
 
 def is_subject_folder(x):
     return str.isdigit(x)
 
 
-def main():
+validation_counts = ['n_events', 'empty_hadm', 'no_hadm_in_stay', 'no_icustay', 'recovered', 'could_not_recover',
+                     'icustay_missing_in_stays']
+
+
+def validate_subject_events(stays_df, events_df):
+    """
+    Events of one subject that can be assigned to one of its stays, with missing ICUSTAY_IDs recovered from
+    the stays by HADM_ID, and the counts of validation_counts. The events are text, as read from the event
+    tables; HADM_ID and ICUSTAY_ID of the stays are compared as text. The values are parsed here, once, into the
+    typed columns of add_typed_values, which are written with the events and read back by read_events.
+    """
+    counts = {}
+
+    # assert that there is no row with empty ICUSTAY_ID or HADM_ID
+    assert(not stays_df['ICUSTAY_ID'].isnull().any())
+    assert(not stays_df['HADM_ID'].isnull().any())
+
+    # assert there are no repetitions of ICUSTAY_ID or HADM_ID
+    # since admissions with multiple ICU stays were excluded
+    assert(len(stays_df['ICUSTAY_ID'].unique()) == len(stays_df['ICUSTAY_ID']))
+    assert(len(stays_df['HADM_ID'].unique()) == len(stays_df['HADM_ID']))
+    stays_df = stays_df.astype({'HADM_ID': str, 'ICUSTAY_ID': str})
+
+    counts['n_events'] = events_df.shape[0]
+
+    # we drop all events for them HADM_ID is empty
+    # TODO: maybe we can recover HADM_ID by looking at ICUSTAY_ID
+    counts['empty_hadm'] = events_df['HADM_ID'].isnull().sum()
+    events_df = events_df.dropna(subset=['HADM_ID'])
+
+    merged_df = events_df.merge(stays_df, left_on=['HADM_ID'], right_on=['HADM_ID'],
+                                how='left', suffixes=['', '_r'], indicator=True)
+
+    # we drop all events for which HADM_ID is not listed in stays.csv
+    # since there is no way to know the targets of that stay (for example mortality)
+    counts['no_hadm_in_stay'] = (merged_df['_merge'] == 'left_only').sum()
+    merged_df = merged_df[merged_df['_merge'] == 'both']
+
+    # if ICUSTAY_ID is empty in stays.csv, we try to recover it
+    # we exclude all events for which we could not recover ICUSTAY_ID
+    cur_no_icustay = merged_df['ICUSTAY_ID'].isnull().sum()
+    counts['no_icustay'] = cur_no_icustay
+    merged_df.loc[:, 'ICUSTAY_ID'] = merged_df['ICUSTAY_ID'].fillna(merged_df['ICUSTAY_ID_r'])
+    counts['recovered'] = cur_no_icustay - merged_df['ICUSTAY_ID'].isnull().sum()
+    counts['could_not_recover'] = merged_df['ICUSTAY_ID'].isnull().sum()
+    merged_df = merged_df.dropna(subset=['ICUSTAY_ID'])
+
+    # now we take a look at the case when ICUSTAY_ID is present in events.csv, but not in stays.csv
+    # this mean that ICUSTAY_ID in events.csv is not the same as that of stays.csv for the same HADM_ID
+    # we drop all such events
+    counts['icustay_missing_in_stays'] = (merged_df['ICUSTAY_ID'] != merged_df['ICUSTAY_ID_r']).sum()
+    merged_df = merged_df[(merged_df['ICUSTAY_ID'] == merged_df['ICUSTAY_ID_r'])]
+
+    events_df = merged_df[['SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'CHARTTIME', 'ITEMID', 'VALUE', 'VALUEUOM']].copy()
+    return add_typed_values(events_df), counts
+
+
+def read_subject_tables(subject_path):
+    """
+    stays.csv with HADM_ID and ICUSTAY_ID read as strings and events.csv, all read as strings; typed values of
+    an earlier validation are parsed again from VALUE.
+    """
+    stays_df = pd.read_csv(os.path.join(subject_path, 'stays.csv'), index_col=False,
+                           dtype={'HADM_ID': str, "ICUSTAY_ID": str})
+    stays_df.columns = stays_df.columns.str.upper()
+
+    # the values are written back as they were read
+    events_df = pd.read_csv(os.path.join(subject_path, 'events.csv'), index_col=False, dtype=str)
+    events_df.columns = events_df.columns.str.upper()
+    return stays_df, events_df
+
+
+def report_validation_counts(report, totals):
+    n_events, empty_hadm, no_hadm_in_stay, could_not_recover, icustay_missing_in_stays = \
+        [totals[k] for k in ['n_events', 'empty_hadm', 'no_hadm_in_stay', 'could_not_recover',
+                             'icustay_missing_in_stays']]
+    n_written = n_events - empty_hadm - no_hadm_in_stay - could_not_recover - icustay_missing_in_stays
+    report.rows('drop_empty_hadm', n_events, n_events - empty_hadm)
+    report.rows('drop_hadm_not_in_stays', n_events - empty_hadm, n_events - empty_hadm - no_hadm_in_stay)
+    report.rows('drop_unrecovered_icustay', n_events - empty_hadm - no_hadm_in_stay,
+                n_events - empty_hadm - no_hadm_in_stay - could_not_recover)
+    report.rows('drop_icustay_missing_in_stays', n_written + icustay_missing_in_stays, n_written)
+    report.count('recovered_icustay', totals['recovered'])
 
-    n_events = 0                   # total number of events
-    empty_hadm = 0                 # HADM_ID is empty in events.csv. We exclude such events.
-    no_hadm_in_stay = 0            # HADM_ID does not appear in stays.csv. We exclude such events.
-    no_icustay = 0                 # ICUSTAY_ID is empty in events.csv. We try to fix such events.
-    recovered = 0                  # empty ICUSTAY_IDs are recovered according to stays.csv files (given HADM_ID)
-    could_not_recover = 0          # empty ICUSTAY_IDs that are not recovered. This should be zero.
-    icustay_missing_in_stays = 0   # ICUSTAY_ID does not appear in stays.csv. We exclude such events.
 
+def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('subjects_root_path', type=str,
                         help='Directory containing subject subdirectories.')
+    add_shard_arguments(parser)
+    add_prefetch_arguments(parser)
+    add_report_arguments(parser)
     args = parser.parse_args()
+    check_shard_arguments(parser, args)
     print(args)
+    report = start_run_report('validate_events', args)
 
     subdirectories = os.listdir(args.subjects_root_path)
-    subjects = list(filter(is_subject_folder, subdirectories))
-
-    for subject in tqdm(subjects, desc='Iterating over subjects'):
-        stays_df = pd.read_csv(os.path.join(args.subjects_root_path, subject, 'stays.csv'), index_col=False,
-                               dtype={'HADM_ID': str, "ICUSTAY_ID": str})
-        stays_df.columns = stays_df.columns.str.upper()
-
-        # assert that there is no row with empty ICUSTAY_ID or HADM_ID
-        assert(not stays_df['ICUSTAY_ID'].isnull().any())
-        assert(not stays_df['HADM_ID'].isnull().any())
-
-        # assert there are no repetitions of ICUSTAY_ID or HADM_ID
-        # since admissions with multiple ICU stays were excluded
-        assert(len(stays_df['ICUSTAY_ID'].unique()) == len(stays_df['ICUSTAY_ID']))
-        assert(len(stays_df['HADM_ID'].unique()) == len(stays_df['HADM_ID']))
-
-        events_df = pd.read_csv(os.path.join(args.subjects_root_path, subject, 'events.csv'), index_col=False,
-                                dtype={'HADM_ID': str, "ICUSTAY_ID": str})
-        events_df.columns = events_df.columns.str.upper()
-        n_events += events_df.shape[0]
-
-        # we drop all events for them HADM_ID is empty
-        # TODO: maybe we can recover HADM_ID by looking at ICUSTAY_ID
-        empty_hadm += events_df['HADM_ID'].isnull().sum()
-        events_df = events_df.dropna(subset=['HADM_ID'])
-
-        merged_df = events_df.merge(stays_df, left_on=['HADM_ID'], right_on=['HADM_ID'],
-                                    how='left', suffixes=['', '_r'], indicator=True)
-
-        # we drop all events for which HADM_ID is not listed in stays.csv
-        # since there is no way to know the targets of that stay (for example mortality)
-        no_hadm_in_stay += (merged_df['_merge'] == 'left_only').sum()
-        merged_df = merged_df[merged_df['_merge'] == 'both']
-
-        # if ICUSTAY_ID is empty in stays.csv, we try to recover it
-        # we exclude all events for which we could not recover ICUSTAY_ID
-        cur_no_icustay = merged_df['ICUSTAY_ID'].isnull().sum()
-        no_icustay += cur_no_icustay
-        merged_df.loc[:, 'ICUSTAY_ID'] = merged_df['ICUSTAY_ID'].fillna(merged_df['ICUSTAY_ID_r'])
-        recovered += cur_no_icustay - merged_df['ICUSTAY_ID'].isnull().sum()
-        could_not_recover += merged_df['ICUSTAY_ID'].isnull().sum()
-        merged_df = merged_df.dropna(subset=['ICUSTAY_ID'])
-
-        # now we take a look at the case when ICUSTAY_ID is present in events.csv, but not in stays.csv
-        # this mean that ICUSTAY_ID in events.csv is not the same as that of stays.csv for the same HADM_ID
-        # we drop all such events
-        icustay_missing_in_stays += (merged_df['ICUSTAY_ID'] != merged_df['ICUSTAY_ID_r']).sum()
-        merged_df = merged_df[(merged_df['ICUSTAY_ID'] == merged_df['ICUSTAY_ID_r'])]
-
-        to_write = merged_df[['SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'CHARTTIME', 'ITEMID', 'VALUE', 'VALUEUOM']]
+    subjects = select_shard(filter(is_subject_folder, subdirectories), args.shard, args.num_shards)
+
+    totals = dict((k, 0) for k in validation_counts)
+    subject_tables = prefetch(subjects, lambda subject: read_subject_tables(os.path.join(args.subjects_root_path,
+                                                                                         subject)),
+                              depth=args.prefetch)
+    for (subject, tables) in report.timed(tqdm(subject_tables, total=len(subjects), desc='Iterating over subjects'),
+                                          key=lambda x: x[0]):
+        stays_df, events_df = tables()
+        to_write, counts = validate_subject_events(stays_df, events_df)
+        for k in validation_counts:
+            totals[k] += counts[k]
         to_write.to_csv(os.path.join(args.subjects_root_path, subject, 'events.csv'), index=False)
 
-    assert(could_not_recover == 0)
-    print('n_events: {}'.format(n_events))
-    print('empty_hadm: {}'.format(empty_hadm))
-    print('no_hadm_in_stay: {}'.format(no_hadm_in_stay))
-    print('no_icustay: {}'.format(no_icustay))
-    print('recovered: {}'.format(recovered))
-    print('could_not_recover: {}'.format(could_not_recover))
-    print('icustay_missing_in_stays: {}'.format(icustay_missing_in_stays))
+    report.count('subjects', len(subjects))
+    report_validation_counts(report, totals)
+
+    assert(totals['could_not_recover'] == 0)
+    for k in validation_counts:
+        print('{}: {}'.format(k, totals[k]))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,97 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from mimic3benchmark.preprocessing import diagnosis_labels
+
+
+class SparseLabels(object):
+    """
+    Binary label matrix in CSR format with explicit row (ICUSTAY_ID) and column (label) indexes.
+    """
+    def __init__(self, matrix, index, columns, index_name='ICUSTAY_ID'):
+        self.matrix = sp.csr_matrix(matrix, dtype=np.int8)
+        self.index = pd.Index(index, name=index_name)
+        self.columns = pd.Index(columns)
+        assert self.matrix.shape == (len(self.index), len(self.columns))
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def to_dense(self):
+        return pd.DataFrame(self.matrix.toarray().astype(int), index=self.index, columns=self.columns)
+
+    def reindex(self, index=None, columns=None):
+        """ Rows/columns in the given order; labels that are not present become all-zero rows/columns. """
+        matrix = self.matrix
+        if index is not None:
+            index = pd.Index(index, name=self.index.name)
+            matrix = _take_or_zero(matrix.T.tocsc(), self.index.get_indexer(index)).T
+        if columns is not None:
+            columns = pd.Index(columns)
+            matrix = _take_or_zero(matrix.tocsc(), self.columns.get_indexer(columns))
+        return SparseLabels(matrix, self.index if index is None else index,
+                            self.columns if columns is None else columns, index_name=self.index.name)
+
+    def save_npz(self, fn):
+        np.savez_compressed(fn, data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+                            shape=np.array(self.matrix.shape), index=self.index.values,
+                            columns=np.array(self.columns, dtype=str), index_name=np.array(self.index.name))
+
+    @classmethod
+    def load_npz(cls, fn):
+        with np.load(fn, allow_pickle=False) as f:
+            matrix = sp.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            return cls(matrix, f['index'], f['columns'], index_name=str(f['index_name']))
+
+
+def _take_or_zero(matrix, positions):
+    """ Columns of a sparse matrix at the given positions, -1 giving an all-zero column. """
+    positions = np.asarray(positions)
+    found = positions >= 0
+    taken = matrix[:, positions[found]].tocoo()
+    return sp.csr_matrix((taken.data, (taken.row, np.flatnonzero(found)[taken.col])),
+                         shape=(matrix.shape[0], positions.shape[0]))
+
+
+def sparse_label_matrix(row_labels, column_labels, index, columns, index_name='ICUSTAY_ID'):
+    """
+    Sets a 1 for every (row label, column label) pair; pairs whose row or column is not indexed are ignored.
+    """
+    index = pd.Index(index, name=index_name)
+    columns = pd.Index(columns)
+    rows = index.get_indexer(row_labels)
+    cols = columns.get_indexer(column_labels)
+    keep = (rows >= 0) & (cols >= 0)
+    matrix = sp.csr_matrix((np.ones(keep.sum(), dtype=np.int8), (rows[keep], cols[keep])),
+                           shape=(len(index), len(columns)))
+    matrix.data[:] = 1
+    return SparseLabels(matrix, index, columns, index_name=index_name)
+
+
+def make_phenotype_label_sparse(phenotypes, stays=None):
+    """
+    Sparse counterpart of preprocessing.make_phenotype_label_matrix, with the same rows and columns.
+    """
+    phenotypes = phenotypes.loc[phenotypes.USE_IN_BENCHMARK > 0, ['ICUSTAY_ID', 'HCUP_CCS_2015']]
+    if stays is not None:
+        index = np.sort(stays.ICUSTAY_ID.values)
+    else:
+        index = np.sort(phenotypes.ICUSTAY_ID.unique())
+    columns = np.sort(phenotypes.HCUP_CCS_2015.unique())
+    return sparse_label_matrix(phenotypes.ICUSTAY_ID, phenotypes.HCUP_CCS_2015, index, columns)
+
+
+def extract_diagnosis_labels_sparse(diagnoses):
+    """
+    Sparse counterpart of preprocessing.extract_diagnosis_labels: one row per ICU stay that has diagnoses
+    and one 'Diagnosis <ICD9>' column per code in preprocessing.diagnosis_labels.
+    """
+    index = np.sort(diagnoses.ICUSTAY_ID.unique())
+    labels = sparse_label_matrix(diagnoses.ICUSTAY_ID, diagnoses.ICD9_CODE, index, diagnosis_labels)
+    labels.columns = pd.Index(['Diagnosis ' + d for d in diagnosis_labels])
+    return labels
@@ -3,38 +3,79 @@ from __future__ import print_function
 
 import numpy as np
 import os
-import pandas as pd
 
-from mimic3benchmark.util import dataframe_from_csv
+from mimic3benchmark.preprocessing import add_typed_values
+from mimic3benchmark.util import dataframe_from_csv, parse_times
 
 
 def read_stays(subject_path):
-    stays = dataframe_from_csv(os.path.join(subject_path, 'stays.csv'), index_col=None)
-    stays.INTIME = pd.to_datetime(stays.INTIME)
-    stays.OUTTIME = pd.to_datetime(stays.OUTTIME)
-    stays.DOB = pd.to_datetime(stays.DOB)
-    stays.DOD = pd.to_datetime(stays.DOD)
-    stays.DEATHTIME = pd.to_datetime(stays.DEATHTIME)
+    # ages and lengths of stay are written to the episode files, read them back to the same floats
+    return prepare_stays(dataframe_from_csv(os.path.join(subject_path, 'stays.csv'), index_col=None,
+                                            float_precision='round_trip'))
+
+
+def prepare_stays(stays):
+    """ Parses the times of a subject's stays table and sorts it by stay. """
+    stays.INTIME = parse_times(stays.INTIME)
+    stays.OUTTIME = parse_times(stays.OUTTIME)
+    stays.DOB = parse_times(stays.DOB)
+    stays.DOD = parse_times(stays.DOD)
+    stays.DEATHTIME = parse_times(stays.DEATHTIME)
     stays.sort_values(by=['INTIME', 'OUTTIME'], inplace=True)
     return stays
 
 
 def read_diagnoses(subject_path):
-    return dataframe_from_csv(os.path.join(subject_path, 'diagnoses.csv'), index_col=None)
+    # ICD9 codes are text: read as numbers (when a subject has no V or E codes) they lose their leading zeros
+    # and never match diagnosis_labels
+    return dataframe_from_csv(os.path.join(subject_path, 'diagnoses.csv'), index_col=None, dtype={'ICD9_CODE': str})
+
+
+# the columns written by extract_subjects are read as text like the event tables, so VALUE does not depend on
+# whether all values of a subject are numbers; validate_events adds the typed values of add_typed_values
+event_dtypes = {'SUBJECT_ID': str, 'HADM_ID': str, 'ICUSTAY_ID': str, 'CHARTTIME': str, 'ITEMID': str, 'VALUE': str,
+                'VALUEUOM': str, 'VALUE_NUM': float, 'VALUE_TEXT': 'category'}
 
 
 def read_events(subject_path, remove_null=True):
-    events = dataframe_from_csv(os.path.join(subject_path, 'events.csv'), index_col=None)
+    return prepare_events(dataframe_from_csv(os.path.join(subject_path, 'events.csv'), index_col=None,
+                                             dtype=event_dtypes, float_precision='round_trip'),
+                          remove_null=remove_null)
+
+
+def prepare_events(events, remove_null=True):
+    """
+    Parses the times and ids of a subject's events table read as text, without the events that have no value.
+    VALUE stays text, missing units become '' and the typed values of add_typed_values are added if the table
+    does not have them.
+    """
     if remove_null:
         events = events[events.VALUE.notnull()]
-    events.CHARTTIME = pd.to_datetime(events.CHARTTIME)
+    events.CHARTTIME = parse_times(events.CHARTTIME)
+    events.SUBJECT_ID = events.SUBJECT_ID.astype(int)
+    events.ITEMID = events.ITEMID.astype(int)
     events.HADM_ID = events.HADM_ID.fillna(value=-1).astype(int)
     events.ICUSTAY_ID = events.ICUSTAY_ID.fillna(value=-1).astype(int)
-    events.VALUEUOM = events.VALUEUOM.fillna('').astype(str)
+    events = add_typed_values(events)
     # events.sort_values(by=['CHARTTIME', 'ITEMID', 'ICUSTAY_ID'], inplace=True)
     return events
 
 
+def read_episode_labels(fn):
+    """ An episode{#}.csv written by extract_episodes_from_subjects. """
+    return dataframe_from_csv(fn, index_col=None, float_precision='round_trip')
+
+
+def read_episode_timeseries(fn):
+    """
+    An episode{#}_timeseries.csv written by extract_episodes_from_subjects: Hours as floats and the values of the
+    variables as the text they were written with.
+    """
+    ts = dataframe_from_csv(fn, index_col=None, dtype=str)
+    ts['Hours'] = ts['Hours'].astype(float)
+    return ts
+
+
 def get_events_for_stay(events, icustayid, intime=None, outtime=None):
     idx = (events.ICUSTAY_ID == icustayid)
     if intime is not None and outtime is not None:
@@ -1,8 +1,104 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import calendar
+import collections
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
 import pandas as pd
 
 
-def dataframe_from_csv(path, header=0, index_col=0):
-    return pd.read_csv(path, header=header, index_col=index_col, encoding = 'utf-8')
+def dataframe_from_csv(path, header=0, index_col=0, dtype=None, float_precision=None):
+    return pd.read_csv(path, header=header, index_col=index_col, encoding = 'utf-8', dtype=dtype,
+                       float_precision=float_precision)
+
+
+mimic_time_format = '%Y-%m-%d %H:%M:%S'
+epoch_seconds_re = re.compile(r'^-?\d+$')
+
+
+def parse_times(column, format=mimic_time_format):
+    """
+    pd.to_datetime(column) for the times of MIMIC-III and the files derived from it. Every distinct string is
+    parsed once with the fixed format (times repeat a lot within a subject), and strings in other formats fall
+    back to pd.to_datetime's inference. Numbers, and strings of digits like those of files with epoch times that
+    are read as text, are read as seconds since the epoch (see epoch_seconds) and columns that are already
+    parsed are returned as they are.
+    """
+    if pd.api.types.is_datetime64_any_dtype(column.dtype):
+        return column
+    if pd.api.types.is_numeric_dtype(column.dtype):
+        return pd.to_datetime(column, unit='s')
+    codes, uniques = pd.factorize(column)
+    if len(uniques) > 0 and all(isinstance(u, str) and epoch_seconds_re.match(u) for u in uniques):
+        times = pd.to_datetime(np.array(uniques, dtype=np.int64), unit='s')
+    else:
+        try:
+            times = pd.to_datetime(uniques, format=format)
+        except (TypeError, ValueError):
+            times = pd.to_datetime(uniques)
+    # code -1 (missing values) picks the NaT at the end
+    times = np.append(times.values.astype('datetime64[ns]'), np.datetime64('NaT', 'ns'))
+    return pd.Series(times[codes], index=column.index, name=column.name)
+
+
+def parse_float(s):
+    """ float(s), NaN for values that are not numbers. """
+    try:
+        return float(s)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+_epoch_seconds_cache = {}
+
+
+def epoch_seconds(text, format=mimic_time_format):
+    """ Seconds since the epoch of a time string as written in MIMIC-III, '' for ''. Cached by string. """
+    seconds = _epoch_seconds_cache.get(text)
+    if seconds is None:
+        seconds = '' if text == '' else str(calendar.timegm(datetime.strptime(text, format).timetuple()))
+        if len(_epoch_seconds_cache) >= 1000000:
+            _epoch_seconds_cache.clear()
+        _epoch_seconds_cache[text] = seconds
+    return seconds
+
+
+def prefetch(items, load, depth=4):
+    """
+    Yields (item, result) for every item in order, where result() returns load(item) or raises the exception
+    that load raised. load runs on a pool of depth threads for up to depth items ahead of the item being
+    processed, so reading the files of the next subjects overlaps with the work on the current one while at most
+    depth + 1 loaded items are held in memory. With depth=0 every item is loaded when result() is called.
+    """
+    if depth <= 0:
+        for item in items:
+            yield item, (lambda item=item: load(item))
+        return
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=depth) as executor:
+        try:
+            for item in items:
+                pending.append((item, executor.submit(load, item)))
+                if len(pending) > depth:
+                    yield _next_result(pending)
+            while pending:
+                yield _next_result(pending)
+        finally:
+            # the consumer stopped early: do not load the items it will not ask for
+            for (_, future) in pending:
+                future.cancel()
+
+
+def _next_result(pending):
+    item, future = pending.popleft()
+    return item, future.result
+
+
+def add_prefetch_arguments(parser):
+    parser.add_argument('--prefetch', type=int, default=4,
+                        help='Number of subjects whose files are read ahead on background threads while the current '
+                             'subject is processed, 0 to read them on demand.')
@@ -0,0 +1,130 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import re
+
+import pandas as pd
+import pytest
+
+from mimic3benchmark.scripts.create_clinical_notes import admission_sections, split_admission_sections,\
+    strip_death_mentions
+
+
+def split_admission_sections_with_regexes(text):
+    """ The sections as filter_admission_text extracted them before, with one regex per section. """
+    notes_df = pd.DataFrame({'TEXT': [text]})
+    notes_df['TEXT'] = notes_df['TEXT'].str.replace(r"\n", r"\\n", regex=True)
+    for key in admission_sections.keys():
+        section = admission_sections[key]
+        notes_df[key] = notes_df.TEXT.str.extract(r'(?i){}(.+?)\\n\\n[^(\\|\d|\.)]+?:'.format(section))
+        notes_df[key] = notes_df[key].str.replace(r'\\n', r' ', regex=True)
+        notes_df[key] = notes_df[key].str.strip()
+        notes_df[key] = notes_df[key].fillna("")
+    return dict((key, notes_df[key].iloc[0]) for key in admission_sections.keys())
+
+
+notes = {
+    'all sections':
+        "Admission Date: [**2150-1-1**]\n\nChief Complaint:\nchest pain\n\nHistory of Present Illness:\n"
+        "65M with\nCAD\n\nPast Medical History:\nHTN, DM\n\nMedications on Admission:\naspirin 81 mg\n\n"
+        "Allergies:\nNo Known Allergies\n\nPhysical Exam:\nT 98.6\n\nFamily History:\nnon-contributory\n\n"
+        "Social History:\nno tobacco\n\nBrief Hospital Course:\nadmitted",
+    'mixed case':
+        "CHIEF COMPLAINT: dyspnea\n\npresent ILLNESS: worse\nsince monday\n\nMEDICAL history: COPD\n\n"
+        "social HISTORY: smoker\n\nPlan: home",
+    'missing sections':
+        "Chief Complaint: fall\n\nAllergies: penicillin\n\nDischarge Diagnosis: fracture",
+    'last section without an end':
+        "Chief Complaint: fever\n\nPresent Illness: 3 days\n\nSocial History: lives alone",
+    'no sections':
+        "Discharge summary without any of the headers.\n\nPlan: follow up",
+    'repeated headers':
+        "Chief Complaint: first\n\nPresent Illness: one\n\nChief Complaint: second\n\n"
+        "Present Illness: two\n\nMedical History: none\n\nPlan: none",
+    'sections ending at the same header':
+        "Allergies:\n\nPhysical Exam: Chief Complaint: rash\n\nPresent Illness: itchy\n\nLabs: normal",
+    'empty section':
+        "Chief Complaint:\n\nPresent Illness: cough\n\nMedical History:\n\n1. asthma\n\nAllergies: none\n\nPlan: x",
+    'ends that are not headers':
+        "Present Illness: a\n\n2. b: c\n\n(d): e\n\n.f: g\n\nMedical History: h\n\nPlan: i",
+    'non-ASCII':
+        "Chief Complaint: Übelkeit\n\nPresent İllness: ß\n\nPresent Illness: naïve\n\nMedical History: café\n\n"
+        "Allergies: Straße: none\n\nPlan: ok",
+    'non-ASCII header':
+        "CHIEF COMPLAİNT: not a header\n\nChief Complaint: nausea\n\nSocial History: ñ\n\nPlan: ok",
+    'no empty line before the next header':
+        "Chief Complaint: pain\nPresent Illness: onset\n\nMedical History: none\n\nPlan: ok",
+}
+
+
+@pytest.mark.parametrize('name', sorted(notes.keys()))
+def test_split_admission_sections_is_the_same_as_the_regexes(name):
+    text = notes[name]
+    assert split_admission_sections(text) == split_admission_sections_with_regexes(text)
+
+
+def test_split_admission_sections():
+    sections = split_admission_sections(notes['all sections'])
+    assert sections['CHIEF_COMPLAINT'] == 'chest pain'
+    assert sections['PRESENT_ILLNESS'] == '65M with CAD'
+    assert sections['SOCIAL_HISTORY'] == 'no tobacco'
+    assert split_admission_sections(notes['no sections']) == dict.fromkeys(admission_sections.keys(), '')
+
+
+def strip_death_mentions_with_pandas(text):
+    """ The note as remove_mentions_of_patients_death handled it before, on a frame of one note; None if dropped. """
+    death_indication_in_special_sections = re.compile(
+        r"((?:PHYSICAL EXAM|MEDICATION ON ADMISSION):[^\n\n]*?)((?:patient|pt)?\s+(?:had\s|has\s)?(?:expired|died|passed away|deceased))",
+        flags=re.IGNORECASE)
+    death_indication_in_all_other_sections = re.compile(
+        r"(?:patient|pt)\s+(?:had\s|has\s)?(?:expired|died|passed away|deceased)", flags=re.IGNORECASE)
+
+    df = pd.DataFrame({'TEXT': [text]})
+    df['TEXT'] = df['TEXT'].replace(death_indication_in_special_sections, r"\1", regex=True)
+    df = df[~df['TEXT'].str.contains(death_indication_in_all_other_sections)]
+    df = df[~df['TEXT'].str.contains("he expired", flags=re.IGNORECASE)]
+    df = df[~df['TEXT'].str.contains("pronounced expired", flags=re.IGNORECASE)]
+    df = df[~df['TEXT'].str.contains("time of death", flags=re.IGNORECASE)]
+    return df.TEXT.iloc[0] if df.shape[0] > 0 else None
+
+
+def admission_note(**sections):
+    headers = ['CHIEF COMPLAINT', 'PRESENT ILLNESS', 'MEDICAL HISTORY', 'MEDICATION ON ADMISSION', 'ALLERGIES',
+               'PHYSICAL EXAM', 'FAMILY HISTORY', 'SOCIAL HISTORY']
+    return '\n\n'.join('{}: {}'.format(h, sections.get(h.replace(' ', '_').lower(), '')) for h in headers)
+
+
+death_notes = {
+    'no death mention': admission_note(chief_complaint='chest pain', physical_exam='alert and oriented'),
+    'death word without a pattern': admission_note(family_history='father died of MI at 60'),
+    'mention in physical exam': admission_note(chief_complaint='arrest', physical_exam='on arrival pt expired'),
+    'mention in medications': admission_note(medication_on_admission='none, patient had passed away'),
+    'mentions in both special sections': admission_note(medication_on_admission='patient deceased',
+                                                        physical_exam='Pt has died.'),
+    'mention in another section': admission_note(present_illness='the patient expired in the ED'),
+    'mention in special and other sections': admission_note(present_illness='pt died',
+                                                            physical_exam='patient died'),
+    'he expired': admission_note(present_illness='she expired on hospital day 3'),
+    'pronounced expired': admission_note(medical_history='Pronounced expired at 10:42'),
+    'time of death': admission_note(social_history='TIME OF DEATH 04:12'),
+    'mixed case': admission_note(physical_exam='PATIENT PASSED AWAY', social_history='Patient Has Expired'),
+    'deceased relative': admission_note(family_history='mother deceased'),
+    'non-ASCII': admission_note(chief_complaint='Übelkeit', physical_exam='café, patient deceased'),
+    'non-ASCII without mention': admission_note(chief_complaint='naïve', present_illness='İ ß'),
+    'not an admission note': 'Patient expired at 3 am.',
+    'empty': '',
+}
+
+
+@pytest.mark.parametrize('name', sorted(death_notes.keys()))
+def test_strip_death_mentions_is_the_same_as_pandas(name):
+    text = death_notes[name]
+    assert strip_death_mentions(text) == strip_death_mentions_with_pandas(text)
+
+
+def test_strip_death_mentions():
+    text = death_notes['no death mention']
+    assert strip_death_mentions(text) is text
+    assert 'expired' not in strip_death_mentions(death_notes['mention in physical exam'])
+    assert strip_death_mentions(death_notes['mention in another section']) is None
+    assert strip_death_mentions(death_notes['time of death']) is None
@@ -0,0 +1,127 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+from mimic3benchmark.episode_catalog import build_episode_catalog, read_episode_catalog, write_episode_catalog
+from mimic3benchmark.hcup_ccs import load_hcup_ccs_mapping
+from mimic3benchmark.partitions import shard_path
+from mimic3benchmark.preprocessing import add_hcup_ccs_2015_groups
+from mimic3benchmark.scripts import create_demography_diagnosis
+from mimic3benchmark.scripts.extract_subjects import default_phenotype_definitions
+from mimic3benchmark.sparse_labels import make_phenotype_label_sparse
+
+# (partition, SUBJECT_ID, ICUSTAY_ID, HADM_ID, AGE, GENDER, MORTALITY, LOS in days, event hours, ICD9 codes)
+stays = [
+    ('train', 9, 200009, 190009, 71.60821917808219, 'M', 0, 3.2109, [0.5, 2.0], ['4019', '42731']),
+    ('train', 9, 200019, 110019, 72.10136986301370, 'M', 1, 2.5, [1.0], ['5849']),
+    ('train', 200, 200010, 150010, 45.04109589041096, 'F', 0, 1.5, [0.5], ['4019']),
+    ('train', 100, 200100, 120100, 88.91780821917808, 'F', 0, 4.0, [-3.0, 10.0], ['25000', 'V5861']),
+    ('train', 300, 200011, 180011, 63.0, 'M', 0, 2.75, [-5.0], ['0389']),
+    ('test', 9001, 209001, 139001, 55.25479452054794, 'F', 1, 2.0000001, [0.0], ['0389', '4019']),
+    ('test', 1000, 201000, 101000, 67.5, 'M', 0, 6.125, [30.0], []),
+    ('test', 20, 200020, 170020, 80.82739726027397, 'F', 0, 2.2, [1.0, 48.0], ['42731']),
+    ('test', 20, 200021, 170021, 81.0, 'F', 0, 2.4, [2.0], ['5849']),
+]
+
+
+def write_root(root):
+    """ A root like the one split_train_and_test leaves, with the tables extract_subjects writes. """
+    columns = ['PARTITION', 'SUBJECT_ID', 'ICUSTAY_ID', 'HADM_ID', 'AGE', 'GENDER', 'MORTALITY', 'LOS', 'HOURS',
+               'CODES']
+    all_stays = pd.DataFrame(stays, columns=columns)
+    all_stays['INTIME'] = pd.Timestamp('2150-01-01') + pd.to_timedelta(all_stays.index, unit='D')
+    all_stays['OUTTIME'] = all_stays.INTIME + pd.to_timedelta(all_stays.LOS, unit='D')
+    all_stays['DOB'], all_stays['DOD'], all_stays['DEATHTIME'] = pd.Timestamp('2080-01-01'), pd.NaT, pd.NaT
+    stay_columns = ['SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'INTIME', 'OUTTIME', 'DOB', 'DOD', 'DEATHTIME', 'LOS',
+                    'AGE', 'GENDER', 'MORTALITY']
+    all_stays[stay_columns].to_csv(os.path.join(root, 'all_stays.csv'), index=False)
+
+    diagnoses = pd.DataFrame([(s[1], s[3], s[2], code) for s in stays for code in s[9]],
+                             columns=['SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'ICD9_CODE'])
+    mapping = load_hcup_ccs_mapping(default_phenotype_definitions)
+    diagnoses = add_hcup_ccs_2015_groups(diagnoses, mapping)
+    make_phenotype_label_sparse(diagnoses, all_stays).save_npz(os.path.join(root, 'phenotype_labels.npz'))
+
+    for (partition, subject_id), subject_stays in all_stays.groupby(['PARTITION', 'SUBJECT_ID']):
+        subject_dir = os.path.join(root, partition, str(subject_id))
+        os.makedirs(subject_dir)
+        subject_stays[stay_columns].to_csv(os.path.join(subject_dir, 'stays.csv'), index=False)
+        diagnoses[diagnoses.SUBJECT_ID == subject_id].to_csv(os.path.join(subject_dir, 'diagnoses.csv'), index=False)
+        for episode, stay in enumerate(subject_stays.itertuples(), 1):
+            pd.DataFrame({'Icustay': [stay.ICUSTAY_ID], 'Age': [stay.AGE], 'Length of Stay': [stay.LOS],
+                          'Mortality': [stay.MORTALITY], 'Gender': [1 if stay.GENDER == 'F' else 2]})\
+                .to_csv(os.path.join(subject_dir, 'episode{}.csv'.format(episode)), index=False)
+            pd.DataFrame({'Hours': stay.HOURS, 'Heart Rate': 80})\
+                .to_csv(os.path.join(subject_dir, 'episode{}_timeseries.csv'.format(episode)), index=False)
+
+
+def run_main(monkeypatch, root, output_path, *options):
+    monkeypatch.setattr(sys, 'argv', ['create_demography_diagnosis', root, output_path, '--hcup_cache_dir', '']
+                        + list(options))
+    create_demography_diagnosis.main()
+    listfiles = []
+    for partition in ['train', 'test']:
+        with open(os.path.join(output_path, partition, 'listfile.csv')) as listfile:
+            listfiles.append(listfile.read())
+    return listfiles
+
+
+@pytest.fixture
+def root(tmpdir):
+    root = os.path.join(str(tmpdir), 'root')
+    os.makedirs(root)
+    write_root(root)
+    return root
+
+
+def test_all_modes_write_the_same_listfiles(root, tmpdir, monkeypatch):
+    per_episode = run_main(monkeypatch, root, os.path.join(str(tmpdir), 'per_episode'))
+    write_episode_catalog(build_episode_catalog(root), os.path.join(root, 'episode_catalog.csv'))
+    with_catalog = run_main(monkeypatch, root, os.path.join(str(tmpdir), 'with_catalog'))
+    vectorized = run_main(monkeypatch, root, os.path.join(str(tmpdir), 'vectorized'), '--vectorized')
+
+    assert with_catalog == per_episode
+    assert vectorized == per_episode
+
+    # train is sorted by HADM_ID, test is in SUBJECT_ID order and episode order within a subject; episodes
+    # shorter than 48 hours or without events in the ICU are left out
+    train, test = [[int(line.split(',')[0]) for line in listfile.splitlines()[1:]] for listfile in per_episode]
+    assert train == [110019, 120100, 190009]
+    assert test == [170020, 170021, 101000, 139001]
+
+
+def test_listfile_rows(root, tmpdir, monkeypatch):
+    train, _ = run_main(monkeypatch, root, os.path.join(str(tmpdir), 'per_episode'))
+    header, row = train.splitlines()[0].split(','), train.splitlines()[3].split(',')
+    # the listfiles are written with an empty column after hadm_id
+    assert row[:7] == ['190009', '', '0', '77.061600', '{}'.format(71.60821917808219), ' 1', ' 0']
+    labels = dict(zip(header[6:], row[7:]))
+    assert labels['Essential hypertension'].strip() == '1'
+    assert labels['Cardiac dysrhythmias'].strip() == '1'
+    assert sum(int(v) for v in labels.values()) == 2
+
+
+@pytest.mark.parametrize('options', [[], ['--vectorized']])
+def test_merged_shards_are_the_same_as_all_subjects(root, tmpdir, monkeypatch, options):
+    write_episode_catalog(build_episode_catalog(root), os.path.join(root, 'episode_catalog.csv'))
+    expected = run_main(monkeypatch, root, os.path.join(str(tmpdir), 'all'), *options)
+
+    output_path = os.path.join(str(tmpdir), 'shards')
+    for shard in range(3):
+        monkeypatch.setattr(sys, 'argv', ['create_demography_diagnosis', root, output_path, '--hcup_cache_dir', '',
+                                          '--shard', str(shard), '--num_shards', '3'] + options)
+        create_demography_diagnosis.main()
+    catalog = read_episode_catalog(os.path.join(root, 'episode_catalog.csv'))
+    merged = []
+    for partition in ['train', 'test']:
+        output_dir = os.path.join(output_path, partition)
+        fns = [os.path.join(output_dir, shard_path('listfile.csv', shard, 3)) for shard in range(3)]
+        create_demography_diagnosis.merge_listfiles(output_dir, partition, fns, catalog)
+        with open(os.path.join(output_dir, 'listfile.csv')) as listfile:
+            merged.append(listfile.read())
+    assert merged == expected
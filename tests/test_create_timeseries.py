@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from mimic3benchmark.scripts.create_timeseries import episode_window_index, make_window_samples,\
+    read_channel_config, typed_channels, window_observations
+
+channel_info, discretizer_config = read_channel_config()
+
+
+def test_typed_channels_are_the_same_for_text_and_values():
+    as_read = pd.DataFrame({'Hours': [0.5, 1.0, 2.0],
+                            'Capillary refill rate': ['0.0', np.nan, '1.0'],
+                            'Glascow coma scale total': ['15', '10', np.nan],
+                            'Heart Rate': ['80', np.nan, 'ERROR'],
+                            'pH': ['7.33', '7.4', np.nan]})
+    as_built = pd.DataFrame({'Hours': [0.5, 1.0, 2.0],
+                             'Capillary refill rate': [0.0, np.nan, 1.0],
+                             'Glascow coma scale total': ['15', '10', np.nan],
+                             'Heart Rate': ['80', np.nan, 'ERROR'],
+                             'pH': [7.33, 7.4, np.nan]}).astype({'Capillary refill rate': object, 'pH': object})
+
+    typed = typed_channels(as_read, discretizer_config)
+    pd.testing.assert_frame_equal(typed, typed_channels(as_built, discretizer_config))
+    assert typed['Capillary refill rate'].tolist()[::2] == ['0.0', '1.0']
+    # values of numeric channels that are not numbers are kept
+    assert typed['Heart Rate'].tolist()[::2] == [80.0, 'ERROR']
+    assert typed['pH'].dtype == float
+
+
+channels = ['Heart Rate', 'pH', 'Glucose', 'Temperature']
+
+
+def make_episode(seed, n_rows=60, los_hours=30.0):
+    """
+    Time series of one episode as read_episode_timeseries returns it, with rows on and off whole hours. The first
+    value of channel i is at 6 * i hours or later, so that the number of observed channels grows over the stay.
+    """
+    rng = np.random.RandomState(seed)
+    hours = np.sort(np.concatenate([rng.uniform(-5, los_hours + 5, n_rows - 10), rng.randint(-2, 34, 10)]))
+    ts_df = pd.DataFrame({'Hours': hours})
+    for (i, channel) in enumerate(channels):
+        present = (rng.uniform(size=n_rows) < 0.3) & (hours >= 6 * i)
+        ts_df[channel] = np.where(present, '{}'.format(i + 1), None)
+    return ts_df
+
+
+def count_channels_brute_force(ts_df, start, end):
+    window = ts_df[(ts_df['Hours'] >= start) & (ts_df['Hours'] < end)]
+    return window[channels].notna().sum(axis=0).to_numpy()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_window_observations_are_the_same_as_a_brute_force_count(seed):
+    ts_df = make_episode(seed)
+    times = np.arange(-6.0, 40.0, 0.5)
+    index = episode_window_index(ts_df, times)
+    for end in range(len(times)):
+        assert (window_observations(index, None, end) ==
+                count_channels_brute_force(ts_df, -np.inf, times[end])).all()
+        for start in range(0, end + 1, 7):
+            assert (window_observations(index, start, end) ==
+                    count_channels_brute_force(ts_df, times[start], times[end])).all()
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('min_channels', [0, 1, 2, 3, 4, 5])
+@pytest.mark.parametrize('sample_rate', [1.0, 0.5])
+@pytest.mark.parametrize('lived_hours', [None, 20.0, 30.0])
+def test_window_samples_are_the_same_as_a_brute_force_count(seed, min_channels, sample_rate, lived_hours):
+    los_hours, shortest_length, horizons, eps = 30.0, 4.0, (24, 12), 1e-6
+    ts_df = make_episode(seed, los_hours=los_hours)
+    label_df = pd.DataFrame({'Icustay': [200001], 'Mortality': [int(lived_hours is not None)],
+                             'Length of Stay': [los_hours / 24.0]})
+    stays = pd.DataFrame({'SUBJECT_ID': [7], 'HADM_ID': [100001], 'ICUSTAY_ID': [200001],
+                          'INTIME': ['2150-01-01 00:00:00'],
+                          'DEATHTIME': [None if lived_hours is None else
+                                        str(pd.Timestamp('2150-01-01') + pd.Timedelta(hours=lived_hours))]})
+
+    sample = make_window_samples(7, 'episode1_timeseries.csv', label_df, lambda: ts_df.copy(), stays, channel_info,
+                                 discretizer_config, horizons=horizons, sample_rate=sample_rate,
+                                 shortest_length=shortest_length, min_channels=min_channels, eps=eps)
+
+    lived = np.inf if lived_hours is None else lived_hours
+    in_icu = ts_df[(ts_df['Hours'] > -eps) & (ts_df['Hours'] < los_hours + eps)]
+    expected = []
+    for t in np.arange(0.0, min(los_hours, lived) + eps, sample_rate):
+        # values at the prediction time itself are not observed before it
+        n_channels = (count_channels_brute_force(in_icu, -np.inf, t) > 0).sum()
+        if t > shortest_length and n_channels >= min_channels:
+            expected.append((t, los_hours - t) + tuple(int(lived - t < h) for h in horizons))
+    if len(expected) == 0:
+        assert sample is None
+        return
+    written_ts, rows, subject_id, hadm_id = sample
+    assert rows == expected
+    assert rows[0][0] > shortest_length and rows[-1][0] <= min(los_hours, lived)
+    assert (subject_id, hadm_id) == (7, 100001)
+    assert written_ts.shape[0] == in_icu.shape[0]
@@ -0,0 +1,29 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+import pytest
+
+from mimic3benchmark.item_profile import QuantileSketch
+
+
+def test_quantiles_of_merged_sketches_are_within_the_relative_accuracy():
+    rng = np.random.RandomState(0)
+    values = np.concatenate([rng.lognormal(3, 1, size=5000), -rng.lognormal(1, 1, size=1000), np.zeros(200)])
+    rng.shuffle(values)
+
+    sketches = [QuantileSketch(relative_accuracy=0.01) for _ in range(3)]
+    for (i, x) in enumerate(values):
+        sketches[i % 3].add(x)
+    merged = sketches[0].merge(sketches[1]).merge(sketches[2])
+
+    assert merged.count == values.shape[0]
+    assert (merged.min, merged.max) == (values.min(), values.max())
+    ordered = np.sort(values)
+    for q in [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]:
+        exact = ordered[int(q * (values.shape[0] - 1))]
+        assert merged.quantile(q) == pytest.approx(exact, rel=0.01, abs=1e-12)
+
+
+def test_empty_sketch_has_no_quantiles():
+    assert np.isnan(QuantileSketch().quantile(0.5))
@@ -0,0 +1,44 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+import pytest
+
+from mimic3benchmark.evaluation.bootstrap import bootstrap_binary_metrics, bootstrap_binary_metrics_batch
+from mimic3benchmark.evaluation.metrics import binary_metrics
+
+sklearn_metrics = pytest.importorskip('sklearn.metrics')
+
+
+@pytest.mark.parametrize('decimals', [None, 1])
+def test_binary_metrics_match_sklearn(decimals):
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+        y_true = rng.randint(0, 2, size=200)
+        y_score = rng.rand(200) + 0.3 * y_true
+        if decimals is not None:
+            # many tied scores
+            y_score = np.round(y_score, decimals)
+        precisions, recalls, _ = sklearn_metrics.precision_recall_curve(y_true, y_score)
+        ret = binary_metrics(y_true, y_score)
+        assert ret['auroc'] == pytest.approx(sklearn_metrics.roc_auc_score(y_true, y_score))
+        assert ret['auprc'] == pytest.approx(sklearn_metrics.auc(recalls, precisions))
+        assert ret['minpse'] == pytest.approx(np.max(np.minimum(precisions, recalls)))
+
+
+def test_bootstrap_is_deterministic_for_a_seed():
+    rng = np.random.RandomState(1)
+    y_true = rng.randint(0, 2, size=100)
+    y_score = rng.rand(100)
+    first = bootstrap_binary_metrics(y_true, y_score, n_iters=300, seed=7, block_size=64)
+    second = bootstrap_binary_metrics(y_true, y_score, n_iters=300, seed=7, block_size=64)
+    other = bootstrap_binary_metrics(y_true, y_score, n_iters=300, seed=8, block_size=64)
+    for k in first:
+        assert first[k].shape == (300,)
+        np.testing.assert_array_equal(first[k], second[k])
+    assert not np.array_equal(first['auroc'], other['auroc'])
+
+    # every model of a batch is evaluated on the same resamples
+    batch = bootstrap_binary_metrics_batch(y_true, [rng.rand(100), y_score], n_iters=300, seed=7, block_size=64)
+    for k in first:
+        np.testing.assert_array_equal(batch[1][k], first[k])
@@ -0,0 +1,122 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from mimic3benchmark.readers import TimeseriesReader, read_channels
+
+channels = read_channels()
+
+
+@pytest.fixture
+def dataset_dir(tmpdir):
+    """ Episodes and listfiles like create_timeseries writes them, in the in-hospital and sliding window layouts. """
+    dataset_dir = str(tmpdir)
+    rng = np.random.RandomState(0)
+    stays, rows = [], []
+    for i in range(11):
+        stay = '{}_episode1_timeseries.csv'.format(100 + i)
+        n_rows = rng.randint(1, 30)
+        ts_df = pd.DataFrame({'Hours': np.sort(rng.uniform(0, 48, n_rows))})
+        for channel in channels[:-3]:
+            ts_df[channel] = np.where(rng.uniform(size=n_rows) < 0.4, rng.randint(0, 100, n_rows), np.nan)
+        ts_df['HADM_ID'] = 100000 + i
+        ts_df.to_csv(os.path.join(dataset_dir, stay))
+        stays.append(stay)
+        rows += [(stay, t, 48.0 - t, int(t > 20), 100000 + i) for t in (5.0, ts_df.Hours.iloc[-1], 30.0)]
+    pd.DataFrame({'stay': stays, 'y_true': rng.randint(0, 2, len(stays)), 'HADM_ID': 100000 + np.arange(len(stays))})\
+        .to_csv(os.path.join(dataset_dir, 'listfile.csv'), index=False)
+    pd.DataFrame(rows, columns=['stay', 'period_length', 'y_los', 'y_decompensation_24h', 'HADM_ID'])\
+        .to_csv(os.path.join(dataset_dir, 'window_listfile.csv'), index=False)
+    return dataset_dir
+
+
+def assert_same_batches(batches, expected):
+    assert len(batches) == len(expected)
+    for (batch, expected_batch) in zip(batches, expected):
+        for (values, expected_values) in zip(batch, expected_batch):
+            np.testing.assert_array_equal(values, expected_values)
+
+
+@pytest.mark.parametrize('listfile', ['listfile.csv', 'window_listfile.csv'])
+@pytest.mark.parametrize('cache_size,prefetch_batches', [(1024, 2), (3, 3), (0, 1), (1024, 0)])
+def test_batches_are_the_same_with_and_without_cache_and_prefetch(dataset_dir, listfile, cache_size,
+                                                                  prefetch_batches):
+    def read_epochs(**kwargs):
+        reader = TimeseriesReader(dataset_dir, os.path.join(dataset_dir, listfile), batch_size=4, shuffle=True,
+                                  seed=5, **kwargs)
+        return [list(reader) for _ in range(3)]
+
+    expected = read_epochs(cache_size=0, prefetch_batches=0)
+    epochs = read_epochs(cache_size=cache_size, prefetch_batches=prefetch_batches)
+    for (batches, expected_batches) in zip(epochs, expected):
+        assert_same_batches(batches, expected_batches)
+
+
+def test_batches_hold_the_samples(dataset_dir):
+    reader = TimeseriesReader(dataset_dir, os.path.join(dataset_dir, 'window_listfile.csv'), batch_size=5,
+                              max_hours=20.0)
+    samples = reader.samples.itertuples()
+    for batch in reader.batches():
+        for (X, mask, length, y, name) in zip(*batch):
+            sample = next(samples)
+            assert name == sample.stay and list(y) == [sample.y_los, sample.y_decompensation_24h]
+            # a sample has the rows up to its period length, and at most max_hours of them
+            ts_df = pd.read_csv(os.path.join(dataset_dir, name), index_col=0)
+            ts_df = ts_df[ts_df.Hours <= min(sample.period_length, 20.0)]
+            assert length == ts_df.shape[0]
+            values = ts_df.reindex(columns=channels).to_numpy(dtype=np.float32)
+            np.testing.assert_array_equal(mask[:length], ~np.isnan(values))
+            np.testing.assert_array_equal(X[:length], np.nan_to_num(values))
+            assert not mask[length:].any() and not X[length:].any()
+    assert next(samples, None) is None
+
+
+def test_the_same_seed_and_epoch_give_the_same_order(dataset_dir):
+    def order(seed, epoch):
+        reader = TimeseriesReader(dataset_dir, os.path.join(dataset_dir, 'window_listfile.csv'), batch_size=4,
+                                  shuffle=True, seed=seed, cache_size=0)
+        return [tuple(batch.names) + tuple(batch.y[:, 0]) for batch in reader.batches(epoch)]
+
+    assert order(3, 2) == order(3, 2)
+    assert order(3, 2) != order(3, 1)
+    assert order(3, 2) != order(4, 2)
+
+    # iterating over the reader goes through epochs 0, 1, ...
+    reader = TimeseriesReader(dataset_dir, os.path.join(dataset_dir, 'window_listfile.csv'), batch_size=4,
+                              shuffle=True, seed=3)
+    for epoch in range(3):
+        assert [tuple(batch.names) + tuple(batch.y[:, 0]) for batch in reader] == order(3, epoch)
+
+    # without shuffle the batches are in listfile order
+    reader = TimeseriesReader(dataset_dir, os.path.join(dataset_dir, 'listfile.csv'), batch_size=4)
+    assert list(np.concatenate([batch.names for batch in reader])) == list(reader.samples.stay)
+
+
+def test_cache_evicts_the_least_recently_used_stay_at_capacity(dataset_dir):
+    reader = TimeseriesReader(dataset_dir, os.path.join(dataset_dir, 'listfile.csv'), cache_size=2)
+    a, b, c = reader.samples.stay[:3]
+
+    reader.read_episode(a)
+    reader.read_episode(b)
+    reader.read_episode(a)
+    assert list(reader._cache.keys()) == [b, a]
+    reader.read_episode(c)
+    assert list(reader._cache.keys()) == [a, c]
+    assert (reader.cache_hits, reader.cache_misses) == (1, 3)
+    reader.read_episode(b)
+    assert list(reader._cache.keys()) == [c, b]
+    assert (reader.cache_hits, reader.cache_misses) == (1, 4)
+
+    # a full epoch never holds more than cache_size stays
+    list(reader)
+    assert len(reader._cache) == 2
+
+    reader = TimeseriesReader(dataset_dir, os.path.join(dataset_dir, 'listfile.csv'), cache_size=0)
+    reader.read_episode(a)
+    reader.read_episode(a)
+    assert len(reader._cache) == 0 and reader.cache_misses == 2
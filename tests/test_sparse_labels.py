@@ -0,0 +1,22 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from mimic3benchmark.sparse_labels import SparseLabels
+
+
+def test_save_and_load_npz_round_trip(tmpdir):
+    rng = np.random.RandomState(0)
+    dense = (rng.rand(30, 8) < 0.2).astype(int)
+    labels = SparseLabels(dense, index=np.arange(200000, 200030), columns=['label {}'.format(i) for i in range(8)])
+    fn = os.path.join(str(tmpdir), 'labels.npz')
+    labels.save_npz(fn)
+
+    loaded = SparseLabels.load_npz(fn)
+    assert loaded.shape == labels.shape
+    assert loaded.index.name == 'ICUSTAY_ID'
+    pd.testing.assert_frame_equal(loaded.to_dense(), labels.to_dense())
@@ -0,0 +1,62 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+
+import pandas as pd
+
+from mimic3benchmark.preprocessing import add_typed_values
+from mimic3benchmark.scripts.validate_events import read_subject_tables, validate_subject_events
+from mimic3benchmark.subject import read_events
+from mimic3benchmark.util import epoch_seconds, parse_times
+
+charttimes = ['2104-04-05 20:32:52', '2104-04-05 21:00:00', '2104-04-06 00:00:00', '2104-04-05 20:32:52']
+
+
+def write_subject(subject_dir, epoch_times):
+    os.makedirs(subject_dir)
+    pd.DataFrame({'SUBJECT_ID': [7], 'HADM_ID': [100001], 'ICUSTAY_ID': [200001]})\
+        .to_csv(os.path.join(subject_dir, 'stays.csv'), index=False)
+    pd.DataFrame({'SUBJECT_ID': '7', 'HADM_ID': '100001', 'ICUSTAY_ID': ['200001', '', '200001', '200001'],
+                  'CHARTTIME': [epoch_seconds(t) for t in charttimes] if epoch_times else charttimes,
+                  'ITEMID': ['211', '211', '618', '220045'], 'VALUE': ['80', '82', 'Brisk', ''],
+                  'VALUEUOM': ['bpm', 'bpm', '', 'bpm']})\
+        .to_csv(os.path.join(subject_dir, 'events.csv'), index=False)
+
+
+def validate_and_read(subject_dir):
+    stays, events = read_subject_tables(subject_dir)
+    events, _ = validate_subject_events(stays, events)
+    events.to_csv(os.path.join(subject_dir, 'events.csv'), index=False)
+    return read_events(subject_dir)
+
+
+def test_epoch_times_read_back_to_the_same_times(tmpdir):
+    text_dir, epoch_dir = os.path.join(str(tmpdir), 'text'), os.path.join(str(tmpdir), 'epoch')
+    write_subject(text_dir, epoch_times=False)
+    write_subject(epoch_dir, epoch_times=True)
+
+    text_events, epoch_events = validate_and_read(text_dir), validate_and_read(epoch_dir)
+    assert pd.api.types.is_datetime64_any_dtype(epoch_events.CHARTTIME.dtype)
+    assert list(epoch_events.CHARTTIME) == list(pd.to_datetime(charttimes[:3]))
+    pd.testing.assert_frame_equal(epoch_events, text_events)
+
+
+def test_typed_values_read_back_as_parsed(tmpdir):
+    subject_dir = os.path.join(str(tmpdir), 'text')
+    write_subject(subject_dir, epoch_times=False)
+
+    events = validate_and_read(subject_dir)
+    parsed = add_typed_values(events.drop(['VALUE_NUM', 'VALUE_TEXT'], axis=1))
+    pd.testing.assert_frame_equal(events, parsed, check_categorical=False)
+    assert events.VALUE_NUM.tolist()[:2] == [80.0, 82.0] and pd.isnull(events.VALUE_NUM.iloc[2])
+    assert events.VALUE_TEXT.tolist()[2] == 'Brisk'
+    assert events.VALUEUOM.tolist() == ['bpm', 'bpm', '']
+
+
+def test_parse_times_reads_digit_strings_as_epoch_seconds():
+    column = pd.Series([epoch_seconds(charttimes[0]), None, epoch_seconds(charttimes[2])])
+    times = parse_times(column)
+    assert times[0] == pd.Timestamp(charttimes[0])
+    assert pd.isnull(times[1])
+    assert times[2] == pd.Timestamp(charttimes[2])
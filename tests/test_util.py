@@ -0,0 +1,24 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import pytest
+
+from mimic3benchmark.util import prefetch
+
+
+def load(item):
+    if item == 3:
+        raise ValueError('cannot load item 3')
+    return item * 10
+
+
+@pytest.mark.parametrize('depth', [0, 2])
+def test_prefetch_passes_exceptions_to_the_consumer(depth):
+    results = []
+    for (item, result) in prefetch(range(6), load, depth=depth):
+        if item == 3:
+            with pytest.raises(ValueError, match='item 3'):
+                result()
+        else:
+            results.append(result())
+    assert results == [0, 10, 20, 40, 50]